@@ -0,0 +1,94 @@
+############## Websocket broadcast hub ###############
+#
+# Fans every processed frame out to all connected clients. The detection
+# loop publishes each result once; every subscriber gets its own latest-only
+# mailbox. A client that is slower than detection simply skips the frames it
+# missed instead of holding back the pipeline or the other clients.
+#
+# All methods except subscriber_count() and pressure() must be called on the
+# event loop. The subscriber set is replaced rather than changed in place, so
+# the detection thread can iterate over it safely.
+
+# Import necessary packages
+import asyncio
+import time
+from FrameWorker import ema
+
+
+class Mailbox:
+    """Latest-only mailbox of one subscriber"""
+    def __init__(self):
+        self.item = None
+        self.event = asyncio.Event()
+
+        # Statistics
+        self.frames_sent = 0
+        self.frames_dropped = 0  # Results replaced before the client took them
+        self.send_latency_ms = 0.0  # Moving average from result ready to sent
+
+    def put(self, item):
+        # Replace any result the client has not taken yet
+        if self.item is not None:
+            self.frames_dropped += 1
+        self.item = item
+        self.event.set()
+
+    async def get(self):
+        # Wait for the next result
+        await self.event.wait()
+        self.event.clear()
+        item, self.item = self.item, None
+        return item
+
+    def record_send(self, result):
+        # Record the time from a result being ready to it being sent
+        self.frames_sent += 1
+        self.send_latency_ms = ema(self.send_latency_ms, (time.perf_counter() - result.produced_at) * 1000)
+
+
+class BroadcastHub:
+    """Single producer, multi-subscriber fan-out of processed frames"""
+    def __init__(self):
+        self.subscribers = set()
+        self.frames_published = 0
+
+    def subscribe(self):
+        mailbox = Mailbox()
+        self.subscribers = self.subscribers | {mailbox}
+        return mailbox
+
+    def unsubscribe(self, mailbox):
+        self.subscribers = self.subscribers - {mailbox}
+
+    def subscriber_count(self):
+        # Safe to call from the detection thread
+        return len(self.subscribers)
+
+    def pressure(self):
+        # Worst send latency of any client, and the results all clients skipped so far.
+        # Safe to call from the detection thread.
+        subscribers = self.subscribers
+        latency = max((mailbox.send_latency_ms for mailbox in subscribers), default=0.0)
+        dropped = sum(mailbox.frames_dropped for mailbox in subscribers)
+        return latency, dropped
+
+    def publish(self, result):
+        # Hand the result to every subscriber
+        self.frames_published += 1
+        for mailbox in self.subscribers:
+            mailbox.put(result)
+
+    def stats(self):
+        # Return a snapshot of the hub statistics
+        return {
+            "clients": len(self.subscribers),
+            "frames_published": self.frames_published,
+            "subscribers": [
+                {
+                    "frames_sent": mailbox.frames_sent,
+                    "frames_dropped": mailbox.frames_dropped,
+                    "send_latency_ms": round(mailbox.send_latency_ms, 2),
+                }
+                for mailbox in self.subscribers
+            ],
+        }
@@ -6,18 +6,34 @@ import numpy as np
 import os
 import Cards
 import VideoStream
+import FrameSource
+import sys
 import time
-import math
+import Metrics
+from RecognitionCache import RecognitionCache
+from MotionGate import MotionGate
+from Tracker import Tracker
+from RecognitionPool import RecognitionPool
+from Strategy import Strategy
+from Shoe import Shoe
+from CompositionEV import CompositionEV, composition_key, hand_values, best_total
 
 class CardDetector:
-    def __init__(self, videostream, IM_WIDTH=1280, IM_HEIGHT=720, number_of_decks=1):
+    def __init__(self, videostream, IM_WIDTH=1280, IM_HEIGHT=720, number_of_decks=1, detect_scale=1.0,
+                 recognition_workers=0, counting_systems=("hi_lo",)):
+        """
+        videostream can be a VideoStream camera or any FrameSource.
+        detect_scale below 1 searches for cards on a downscaled frame and refines
+        their contours at full resolution (see Cards.find_cards_coarse).
+        recognition_workers is the number of threads that warp and match cards in
+        parallel: 0 recognizes them on the calling thread, None uses one per CPU.
+        counting_systems are the counts sent with every frame (see Counting.SYSTEMS).
+        """
         ### ---- INITIALIZATION ---- ###
-        # Initialize variables for counting
-        self.running_count = 0
-        self.total_cards_seen = 0
+        # Cards left in the shoe, and the count
         self.number_of_decks = number_of_decks  # Adjust based on your game setup
-        self.total_cards_in_shoe = self.number_of_decks * 52
-        self.counted_cards = set()  # Set to store tuples of (Rank, Suit)
+        self.shoe = Shoe(number_of_decks, counting_systems)
+        self.reshuffle_pending = False  # Set by reshuffle(), applied by the next frame
 
         # Initialize last known rank and suit
         self.last_known_rank = None
@@ -25,7 +41,39 @@ class CardDetector:
 
         # Initialize a list to store cards from the previous frame
         self.previous_cards = []
-        self.next_card_id = 1  # Counter to assign unique IDs to cards
+
+        # Give every card a stable ID across frames
+        self.tracker = Tracker()
+
+        # Last computed true count and suggestion, returned again when no new frame arrives
+        self.true_count = 0
+        self.suggestion = ""
+        self.advice = None
+
+        # Sequence number and capture time of the last processed frame
+        self.frame_seq = 0
+        self.capture_time = 0.0
+
+        # Borrowed reference to the frame returned by the last process_frame() call.
+        # It stays valid (and is drawn on in place) until the next call releases it.
+        self.frame_ref = None
+
+        # Seconds to wait for a new frame before giving up
+        self.frame_timeout = 1.0
+
+        # Structured result of the last processed frame (see frame_result)
+        self.last_result = None
+
+        # False when the motion gate found the last frame unchanged, so the
+        # frame returned looks like the one before and need not be sent again
+        self.frame_changed = True
+
+        # Draw the results onto the frame. Clients that draw them from
+        # last_result themselves can turn this off and get the raw frame.
+        self.server_overlay = True
+
+        # Scale of the image cards are searched on; 1.0 searches the full frame
+        self.detect_scale = detect_scale
 
         ## Initialize calculated frame rate
         self.frame_rate_calc = 1
@@ -41,159 +89,240 @@ class CardDetector:
         self.IM_WIDTH = IM_WIDTH
         self.IM_HEIGHT = IM_HEIGHT
 
-        # Load the deviations dictionary
-        self.deviations = {
-            # ('Hand Total', 'Dealer Upcard'): (True Count Threshold, 'Action')
-            ('16', '10'): (0, 'Stand'),    # Stand on 16 vs. 10 when TC >= 0
-            ('15', '10'): (4, 'Stand'),    # Stand on 15 vs. 10 when TC >= 4
-            ('12', '3'): (2, 'Stand'),     # Stand on 12 vs. 3 when TC >= 2
-            ('12', '2'): (3, 'Stand'),     # Stand on 12 vs. 2 when TC >= 3
-            ('13', '2'): (-1, 'Hit'),      # Hit on 13 vs. 2 when TC <= -1
-            # Might need more
-        }
+        # Basic strategy and true count deviations, compiled from strategy_rules.json
+        self.strategy = Strategy()
 
+        # EVs of every decision for the cards left in the shoe, under the same rules.
+        # Set to None to only use the basic strategy.
+        self.composition_ev = CompositionEV(**self.strategy.rules)
 
         # Load the train rank and suit images
         path = os.path.dirname(os.path.abspath(__file__))
         self.train_ranks = Cards.load_ranks(path + '/Card_Imgs/')
         self.train_suits = Cards.load_suits(path + '/Card_Imgs/')
 
-    ### ---- FUNCTIONS ---- ###
-    def match_cards(self, current_cards):
-        """
-        Match the current detected cards with the previous frame's cards based on proximity.
-        Assigns IDs to new cards and updates existing ones.
-        """
-        for curr_card in current_cards:
-            # Default values
-            min_distance = float('inf')
-            matched_card = None
-
-            # Find the closest previous card to the current card
-            for prev_card in self.previous_cards:
-                dist = math.hypot(curr_card.center[0] - prev_card.center[0],
-                                  curr_card.center[1] - prev_card.center[1])
-                if dist < min_distance:
-                    min_distance = dist
-                    matched_card = prev_card
-
-            # Define a threshold distance to consider cards as the same
-            distance_threshold = 50  # Adjust this value based on expected movement between frames
-
-            if matched_card is not None and min_distance < distance_threshold:
-                # Assign the same ID and last known rank/suit
-                curr_card.id = matched_card.id
-                curr_card.last_rank = matched_card.last_rank
-                curr_card.last_suit = matched_card.last_suit
-            else:
-                # Assign a new ID to the card
-                curr_card.id = self.next_card_id
-                self.next_card_id += 1
+        # Describe the train ranks once so frames only describe the query cards
+        self.rank_index = Cards.load_rank_index(self.train_ranks)
 
-    def process_frame(self):
-        """
-        Processes a single frame from the video stream and updates card counts.
-        Returns the processed image, the true count, and the suggestion.
-        """
-        # Start timer (for calculating frame rate)
-        t1 = cv2.getTickCount()
+        # Remember the identity of tracked cards so they are not matched every frame.
+        # Set to None to match every card on every frame.
+        self.recognition_cache = RecognitionCache()
 
-        # Grab frame from video stream
-        image = self.videostream.read()
+        # Skip frames, or parts of frames, that have not changed since the last one.
+        # Set to None to process every frame in full.
+        self.motion_gate = MotionGate()
 
-        # Pre-process camera image (gray, blur, and threshold it)
-        pre_proc = Cards.preprocess_image(image)
+        # Keep the templates pre-normalized for batched template matching
+        self.rank_bank = Cards.load_template_bank(self.train_ranks, Cards.RANK_WIDTH, Cards.RANK_HEIGHT)
+        self.suit_bank = Cards.load_template_bank(self.train_suits, Cards.SUIT_WIDTH, Cards.SUIT_HEIGHT)
 
-        # Find and sort the contours of all cards in the image (query cards)
-        cnts_sort, cnt_is_card = Cards.find_cards(pre_proc)
+        # Session Recorder the frame results (and frames) are logged to.
+        # Set to a started Recorder to record the session.
+        self.recorder = None
 
-        # Initialize a new "cards" list to assign the card objects.
-        current_cards = []
-        k = 0
+        # Threads recognizing the cards of a frame in parallel, if enabled
+        self.recognition_pool = None
+        if recognition_workers != 0:
+            self.recognition_pool = RecognitionPool(self.rank_index, recognition_workers)
 
-        # Initialize suggestion
-        suggestion = None
+        # Stats of the components, as of the last processed frame (see component_stats)
+        self.last_stats = self.component_stats()
 
-        # If there are contours, process them
-        if len(cnts_sort) != 0:
+    ### ---- FUNCTIONS ---- ###
+    def detect_cards(self, image, region=None):
+        """
+        Finds the cards in the image, or only in region (x0, y0, x1, y1) if given,
+        and returns a new Query_card with the geometry of each.
+        """
+        if region is not None:
+            # Search only the changed part of the frame, at full resolution
+            with Metrics.timer("contours"):
+                cnts_sort, cnt_is_card = Cards.find_cards_region(image, region)
+        elif self.detect_scale < 1:
+            # Find card candidates on a downscaled frame, then refine them at full resolution
+            with Metrics.timer("contours"):
+                cnts_sort, cnt_is_card = Cards.find_cards_coarse(image, self.detect_scale)
+        else:
+            # Pre-process camera image (gray, blur, and threshold it)
+            with Metrics.timer("preprocess"):
+                pre_proc = Cards.preprocess_image(image)
+
+            # Find and sort the contours of all cards in the image (query cards)
+            with Metrics.timer("contours"):
+                cnts_sort, cnt_is_card = Cards.find_cards(pre_proc)
 
-            # For each contour detected:
+        # For each contour detected, create a card object from the contour
+        cards = []
+        with Metrics.timer("contours"):
             for i in range(len(cnts_sort)):
                 if cnt_is_card[i] == 1:
+                    cards.append(Cards.card_geometry(cnts_sort[i]))
+        return cards
 
-                    # Create a card object from the contour
-                    card = Cards.preprocess_card(cnts_sort[i], image)
-
-                    # Append to current cards list
-                    current_cards.append(card)
-                    k += 1
+    def split_changed_cards(self):
+        """
+        Splits the previous frame's cards using the motion gate's changed blocks.
+        Returns the cards lying wholly outside the changed region, which are kept
+        as they are, and the region (x0, y0, x1, y1) in which to search for cards again.
+        The region grows to take in every card it touches, so no card is cut in half.
+        """
+        x0, y0, x1, y1 = self.motion_gate.changed_rect()
+        pending = list(self.previous_cards)
+        grown = True
+        while grown:
+            grown = False
+            for card in list(pending):
+                x, y, w, h = cv2.boundingRect(card.contour)
+                if x < x1 and x + w > x0 and y < y1 and y + h > y0:
+                    x0, y0, x1, y1 = min(x0, x), min(y0, y), max(x1, x + w), max(y1, y + h)
+                    pending.remove(card)
+                    grown = True
+
+        # A card only just entering a block may not change it enough to count,
+        # so search one more block all round
+        margin = self.motion_gate.block_size
+        region = (max(x0 - margin, 0), max(y0 - margin, 0),
+                  min(x1 + margin, self.IM_WIDTH), min(y1 + margin, self.IM_HEIGHT))
+        return pending, region
+
+    def recognize_cards(self, image, cards, verify=False):
+        """
+        Finds the rank and suit of each card, skipping cards whose identity the
+        recognition cache already knows (unless verify is set), and updates the count.
+        """
+        # Only cards without a confirmed, up to date identity need recognizing
+        cached = {}
+        if self.recognition_cache is not None:
+            for card in cards:
+                entry = self.recognition_cache.lookup(card, image, force=verify)
+                if entry is not None:
+                    cached[card.id] = entry
+                    card.rank_score, card.suit_score = entry.rank_score, entry.suit_score
+        unknown_cards = [card for card in cards if card.id not in cached]
+
+        # Isolate the rank and suit of each card to recognize
+        with Metrics.timer("warp"):
+            if self.recognition_pool is not None:
+                self.recognition_pool.isolate(unknown_cards, image)
+            else:
+                for card in unknown_cards:
+                    Cards.isolate_rank_suit(card, image)
+
+        # Find the best rank and suit match for all of them at once
+        rank_matcher = self.recognition_pool.match_ranks if self.recognition_pool is not None else None
+        new_matches = Cards.match_card_batch(unknown_cards, self.train_ranks, self.train_suits,
+                                             self.rank_index, self.rank_bank, self.suit_bank,
+                                             stage_timer=Metrics.timer, rank_matcher=rank_matcher)
+        new_matches = dict(zip([card.id for card in unknown_cards], new_matches))
+
+        # For each card, update last known values and the count
+        with Metrics.timer("counting"):
+            for card in cards:
+                if card.id in cached:
+                    entry = cached[card.id]
+                    self.update_card(card, entry.rank, entry.suit, None, entry.suit_diff)
+                else:
+                    rank, suit, rank_diff, suit_diff = new_matches[card.id]
+                    if self.recognition_cache is not None:
+                        self.recognition_cache.update(card, image, rank, suit, suit_diff)
+                    self.update_card(card, rank, suit, rank_diff, suit_diff)
 
-            # Match current cards with previous cards
-            self.match_cards(current_cards)
+    def process_frame(self):
+        """
+        Processes a single frame from the video stream and updates card counts.
+        Returns the processed image, the true count, and the suggestion, and leaves
+        the structured result of the frame in last_result.
+        The image is None if no new frame arrived within frame_timeout.
+        """
+        # Hand the previous frame's buffer back to the stream
+        self.release_frame()
+
+        # Borrow a frame newer than the last one processed, without copying it
+        with Metrics.timer("grab"):
+            frame_ref = self.videostream.borrow(self.frame_timeout)
+        if frame_ref is None:
+            return None, self.true_count, self.suggestion
+        self.frame_ref = frame_ref
+        self.frame_seq = frame_ref.seq
+        self.capture_time = frame_ref.timestamp
+        image = frame_ref.image
 
-            # For each card, perform matching and update last known values
-            for card in current_cards:
-                # Find the best rank and suit match for the card.
-                rank, suit, rank_diff, suit_diff = Cards.match_card(card, self.train_ranks, self.train_suits)
-                card.best_rank_match = rank
-                card.best_suit_match = suit
-                card.rank_diff = rank_diff
-                card.suit_diff = suit_diff
-
-                # Update last known rank and suit if detection is valid
-                if card.best_rank_match != "Unknown":
-                    card.last_rank = card.best_rank_match
-                else:
-                    if card.last_rank is not None:
-                        card.best_rank_match = card.last_rank
+        # Start timer (for calculating frame rate)
+        t1 = cv2.getTickCount()
 
-                if card.best_suit_match != "Unknown":
-                    card.last_suit = card.best_suit_match
-                else:
-                    if card.last_suit is not None:
-                        card.best_suit_match = card.last_suit
-
-                # Create a tuple of the card's rank and suit
-                card_identity = (card.best_rank_match, card.best_suit_match)
-
-                # If this card has not been counted before and both rank and suit are known
-                if (card_identity not in self.counted_cards and
-                        card.best_rank_match != "Unknown" and
-                        card.best_suit_match != "Unknown"):
-                    # Assign count value based on rank
-                    rank_name = card.best_rank_match
-                    if rank_name in ['Two', 'Three', 'Four', 'Five', 'Six']:
-                        count_value = 1
-                    elif rank_name in ['Ten', 'Jack', 'Queen', 'King', 'Ace']:
-                        count_value = -1
-                    else:
-                        count_value = 0  # For Seven, Eight, Nine
-
-                    # Update running count and total cards seen
-                    self.running_count += count_value
-                    self.total_cards_seen += 1
-
-                    # Add the card to counted cards
-                    self.counted_cards.add(card_identity)
-
-                # Draw center point and match result on the image.
-                image = Cards.draw_results(image, card)
-
-            # Draw card contours on image
-            if len(current_cards) != 0:
-                temp_cnts = [card.contour for card in current_cards]
-                cv2.drawContours(image, temp_cnts, -1, (255, 0, 0), 2)
+        # Start a new shoe if asked to
+        reshuffled = self.reshuffle_pending
+        if reshuffled:
+            self.reshuffle_pending = False
+            self.shoe.reset()
+
+        # Advance the recognition cache's clock, whatever the motion gate decides
+        if self.recognition_cache is not None:
+            self.recognition_cache.next_frame()
+
+        # Compare the frame with the last processed one
+        gate = "full"
+        if self.motion_gate is not None:
+            with Metrics.timer("motion_gate"):
+                gate = self.motion_gate.check(image)
+
+        if gate == "static":
+            # Nothing moved: reuse the previous frame's cards, count and suggestion.
+            # Cards whose identity is not confirmed yet, or is due for
+            # re-verification, are still matched on their unchanged contours.
+            current_cards = self.previous_cards
+            with Metrics.timer("tracking"):
+                deleted = self.tracker.update([], held_cards=current_cards)
+            self.shoe.forget(deleted)
+            if self.recognition_cache is not None:
+                self.recognition_cache.forget(deleted)
+                settling = [card for card in current_cards if self.recognition_cache.is_due(card.id)]
+                if settling:
+                    self.recognize_cards(image, settling)
+                    gate = "settling"
+        else:
+            if gate == "partial":
+                # Keep the cards outside the changed region and search only inside it
+                kept_cards, region = self.split_changed_cards()
+            else:
+                kept_cards, region = [], None
+
+            # Find the cards in the image (query cards)
+            new_cards = self.detect_cards(image, region)
+
+            # Match the new cards with the tracked ones, and forget the tracks that ended
+            with Metrics.timer("tracking"):
+                deleted = self.tracker.update(new_cards, held_cards=kept_cards)
+            self.shoe.forget(deleted)
+            if self.recognition_cache is not None:
+                # A lost track picked up again may be a new card dealt in its place,
+                # so its identity is recognized afresh
+                self.recognition_cache.forget(deleted)
+                self.recognition_cache.forget(self.tracker.revived)
+
+            # On a partial frame the cards found again lie in the changed region,
+            # where a card may have been swapped in place, so they are re-matched
+            current_cards = kept_cards + new_cards
+            self.recognize_cards(image, new_cards, verify=gate == "partial")
 
             # Update previous cards with current cards for the next frame
             self.previous_cards = current_cards
 
-            # Classify cards into player and dealer cards
+        # Add the cards counted in this frame to the counts, in one pass
+        self.shoe.update_counts()
+
+        if gate == "static" and not reshuffled:
+            true_count, suggestion = self.true_count, self.suggestion
+        else:
+            # Classify cards into player and dealer cards,
+            # by the half of the frame they lie in
             player_cards = []
             dealer_cards = []
 
+            half_height = image.shape[0] / 2
             for card in current_cards:
                 x, y = card.center
-                if y < self.IM_HEIGHT / 2:
+                if y < half_height:
                     dealer_cards.append(card)
                 else:
                     player_cards.append(card)
@@ -202,216 +331,195 @@ class CardDetector:
             player_hand = [card.best_rank_match for card in player_cards if card.best_rank_match != 'Unknown']
             dealer_upcard = dealer_cards[0].best_rank_match if dealer_cards and dealer_cards[0].best_rank_match != 'Unknown' else None
 
-        else:
-            # No cards detected in the current frame
-            player_hand = []
-            dealer_upcard = None
-
-        # Calculate number of decks remaining
-        number_of_decks_remaining = (self.total_cards_in_shoe - self.total_cards_seen) / 52
+            with Metrics.timer("strategy"):
+                true_count = self.shoe.true_count()
 
-        # Avoid division by zero
-        if number_of_decks_remaining <= 0:
-            true_count = 0
-        else:
-            true_count = int(self.running_count / number_of_decks_remaining)
+                # Get suggestion
+                suggestion = self.get_suggestion(player_hand, dealer_upcard, true_count)
 
-        # Get suggestion
-        suggestion = self.get_suggestion(player_hand, dealer_upcard, true_count)
+            # EVs of the decisions for the exact cards left in the shoe
+            self.advice = None
+            if self.composition_ev is not None and player_hand and dealer_upcard:
+                player_values = hand_values(player_hand)
+                if best_total(sum(player_values), 1 in player_values) <= 21:  # Nothing to decide on a bust hand
+                    with Metrics.timer("composition_ev"):
+                        self.advice = self.composition_ev.evaluate(composition_key(self.shoe.remaining),
+                                                                   player_values, hand_values([dealer_upcard])[0])
 
-        # Draw the suggestion on the image
-        # if suggestion:
-        #     cv2.putText(image, f"Suggestion: {suggestion}", (10, 100), self.font, 1, (0, 255, 0), 2, cv2.LINE_AA)
+        # Copy the frame to record before anything is drawn on it
+        recorded_frame = None
+        if self.recorder is not None:
+            with Metrics.timer("recording"):
+                recorded_frame = self.recorder.snapshot(image)
 
-        # Draw the green line to divide dealer and player areas
-        cv2.line(image, (0, int(self.IM_HEIGHT / 2)), (self.IM_WIDTH, int(self.IM_HEIGHT / 2)), (0, 255, 0), 2)
-
-        # Display 'Dealer' and 'Player' labels
-        cv2.putText(image, "Dealer", (10, int(self.IM_HEIGHT / 4)), self.font, 1, (255, 255, 255), 2, cv2.LINE_AA)
-        cv2.putText(image, "Player", (10, int(3 * self.IM_HEIGHT / 4)), self.font, 1, (255, 255, 255), 2, cv2.LINE_AA)
-
-        # Draw framerate in the corner of the image.
-        # cv2.putText(image, "FPS: " + str(int(self.frame_rate_calc)), (10, 26), self.font, 0.7, (255, 0, 255), 2, cv2.LINE_AA)
+        if self.server_overlay:
+            with Metrics.timer("drawing"):
+                self.draw_overlay(image, current_cards)
 
         # Calculate framerate
         t2 = cv2.getTickCount()
         time1 = (t2 - t1) / self.freq
         self.frame_rate_calc = 1 / time1
 
+        Metrics.FRAME_SECONDS.observe(time1)
+        Metrics.CARDS_PER_FRAME.observe(len(current_cards))
+        Metrics.FRAMES_PROCESSED.inc()
+
         # Ensure suggestion is a string
         if suggestion is None:
             suggestion = ""
 
+        self.true_count = true_count
+        self.suggestion = suggestion
+        self.frame_changed = gate != "static"
+        self.last_result = self.frame_result(image, current_cards)
+        if self.recorder is not None:
+            self.recorder.record(self.last_result, self.capture_time, recorded_frame)
+
+        # Snapshot the component stats here, on the thread that changes them
+        self.last_stats = self.component_stats()
+
         # Return the processed image, the true count, and the suggestion
         return image, true_count, suggestion
 
-    
-    def get_suggestion(self, player_hand, dealer_upcard, true_count):
+
+    def component_stats(self):
         """
-        Returns a suggestion ('Hit', 'Stand', 'Double Down', 'Split', 'Surrender')
-        based on the player's hand, dealer's upcard, and true count.
+        Returns the stats of the motion gate, tracker, shoe, recorder and
+        composition EVs. Only safe to call on the thread running
+        process_frame(); other threads read the last_stats snapshot.
         """
-        # Ensure we have necessary information
-        if not player_hand or not dealer_upcard:
-            return None
-
-        # Map card ranks to values
-        rank_values = {
-            'Two': 2, 'Three': 3, 'Four': 4, 'Five': 5, 'Six': 6,
-            'Seven': 7, 'Eight': 8, 'Nine': 9, 'Ten': 10,
-            'Jack': 10, 'Queen': 10, 'King': 10, 'Ace': 11
+        return {
+            "motion_gate": self.motion_gate.stats() if self.motion_gate is not None else None,
+            "tracker": self.tracker.stats(),
+            "shoe": self.shoe.stats(),
+            "recorder": self.recorder.stats() if self.recorder is not None else None,
+            "composition_ev": self.composition_ev.stats() if self.composition_ev is not None else None,
         }
 
-        # Convert player's hand to numerical values
-        player_values = [rank_values.get(rank, 0) for rank in player_hand]
+    def update_card(self, card, rank, suit, rank_diff, suit_diff):
+        """
+        Stores a card's match result, falls back to its last known rank and suit
+        when unmatched, and adds it to the running count once its identity is
+        confirmed (see RecognitionCache).
+        """
+        card.best_rank_match = rank
+        card.best_suit_match = suit
+        card.rank_diff = rank_diff
+        card.suit_diff = suit_diff
+
+        # Update last known rank and suit if detection is valid
+        if card.best_rank_match != "Unknown":
+            card.last_rank = card.best_rank_match
+        else:
+            if card.last_rank is not None:
+                card.best_rank_match = card.last_rank
 
-        # Handle Aces for soft totals
-        total = sum(player_values)
-        soft = False
-        num_aces = player_values.count(11)
+        if card.best_suit_match != "Unknown":
+            card.last_suit = card.best_suit_match
+        else:
+            if card.last_suit is not None:
+                card.best_suit_match = card.last_suit
+
+        # Count the card once per track and identity: as soon as its rank and
+        # suit are known, or, with the recognition cache, as the identity the
+        # cache confirmed
+        if self.recognition_cache is None:
+            self.shoe.count_card(card.id, card.best_rank_match, card.best_suit_match)
+        else:
+            identity = self.recognition_cache.identity(card.id)
+            if identity is not None:
+                self.shoe.count_card(card.id, *identity)
 
-        while total > 21 and num_aces > 0:
-            total -= 10
-            num_aces -= 1
+    def reshuffle(self):
+        """
+        Starts counting a new shoe from the next frame on. Safe to call from
+        another thread than the one running process_frame().
+        """
+        self.reshuffle_pending = True
 
-        if 11 in player_values and total <= 21:
-            soft = True
+    def frame_result(self, image, cards):
+        """
+        Returns the structured result of a frame: a compact record of each card
+        (see Cards.card_record) with its track state and identity confidence,
+        plus the count and suggestion.
+        """
+        records = []
+        for card in cards:
+            record = Cards.card_record(card)
+            record["state"] = self.tracker.state_of(card.id)
+            if self.recognition_cache is not None:
+                record["confidence"] = round(self.recognition_cache.confidence(card.id), 3)
+            records.append(record)
+
+        return {
+            "frame_seq": self.frame_seq,
+            "width": int(image.shape[1]),
+            "height": int(image.shape[0]),
+            "annotated": self.server_overlay,  # True if the results are drawn on the frame
+            "cards": records,
+            "running_count": self.shoe.running_count,
+            "decks_remaining": round(self.shoe.decks_remaining(), 3),
+            "penetration": round(self.shoe.penetration(), 4),
+            "counts": self.shoe.counts(),
+            "true_count": self.true_count,
+            "suggestion": self.suggestion,
+            "advice": self.advice,  # Composition dependent EVs, see CompositionEV.evaluate
+        }
 
-        # Convert dealer's upcard to value
-        dealer_value = rank_values.get(dealer_upcard, 0)
-        if dealer_value == 11:
-            dealer_value = 1  # Treat dealer's Ace as 1
+    def draw_overlay(self, image, cards):
+        """
+        Draws the card results, card contours, dealer/player divider and labels on the image.
+        """
+        for card in cards:
+            # Draw center point and match result on the image.
+            Cards.draw_results(image, card)
 
-        # Get basic strategy suggestion
-        suggestion = self.basic_strategy(total, soft, player_hand, dealer_value)
+        # Draw card contours on image
+        if len(cards) != 0:
+            temp_cnts = [card.contour for card in cards]
+            cv2.drawContours(image, temp_cnts, -1, (255, 0, 0), 2)
 
-        # Apply deviations based on true count
-        deviation_key = (str(total), str(dealer_value))
-        if deviation_key in self.deviations:
-            tc_threshold, deviation_action = self.deviations[deviation_key]
-            if true_count >= tc_threshold:
-                suggestion = deviation_action
+        # Draw the suggestion on the image
+        # if suggestion:
+        #     cv2.putText(image, f"Suggestion: {suggestion}", (10, 100), self.font, 1, (0, 255, 0), 2, cv2.LINE_AA)
 
-        return suggestion
+        # Draw the green line to divide dealer and player areas
+        height, width = image.shape[:2]
+        cv2.line(image, (0, int(height / 2)), (width, int(height / 2)), (0, 255, 0), 2)
 
+        # Display 'Dealer' and 'Player' labels
+        cv2.putText(image, "Dealer", (10, int(height / 4)), self.font, 1, (255, 255, 255), 2, cv2.LINE_AA)
+        cv2.putText(image, "Player", (10, int(3 * height / 4)), self.font, 1, (255, 255, 255), 2, cv2.LINE_AA)
 
-    def basic_strategy(self, total, soft, player_hand, dealer_value):
+        # Draw framerate in the corner of the image.
+        # cv2.putText(image, "FPS: " + str(int(self.frame_rate_calc)), (10, 26), self.font, 0.7, (255, 0, 255), 2, cv2.LINE_AA)
+
+    def close(self):
         """
-        Determines the suggested action based on basic strategy rules.
+        Stops the recognition threads and the recorder, if any.
         """
-        # Map card ranks to values
-        rank_values = {
-            'Two': 2, 'Three': 3, 'Four': 4, 'Five': 5, 'Six': 6,
-            'Seven': 7, 'Eight': 8, 'Nine': 9, 'Ten': 10,
-            'Jack': 10, 'Queen': 10, 'King': 10, 'Ace': 11
-        }
+        if self.recognition_pool is not None:
+            self.recognition_pool.shutdown()
+            self.recognition_pool = None
+        if self.recorder is not None:
+            self.recorder.stop()
+            self.recorder = None
+
+    def release_frame(self):
+        """
+        Releases the frame borrowed by the last process_frame() call.
+        """
+        if self.frame_ref is not None:
+            self.frame_ref.release()
+            self.frame_ref = None
 
-        # Surrender rules
-        if total == 16 and dealer_value in [9, 10, 1]:
-            return 'Surrender'
-        if total == 15 and dealer_value == 10:
-            return 'Surrender'
-
-        # Splitting logic
-        if len(player_hand) == 2 and player_hand[0] == player_hand[1]:
-            pair_rank = player_hand[0]
-            pair_value = rank_values.get(pair_rank, 0)
-
-            # Always split aces
-            if pair_rank == 'Ace':
-                return 'Split'
-            # Never split tens
-            elif pair_value == 10:
-                return 'Stand'
-            elif pair_value == 9:
-                if dealer_value in [2, 3, 4, 5, 6, 8, 9]:
-                    return 'Split'
-                else:
-                    return 'Stand'
-            elif pair_value == 8:
-                return 'Split'
-            elif pair_value == 7:
-                if dealer_value in range(2, 8):  # Dealer 2 through 7
-                    return 'Split'
-                else:
-                    return 'Hit'
-            elif pair_value == 6:
-                if dealer_value in range(2, 7):  # Dealer 2 through 6
-                    return 'Split'
-                else:
-                    return 'Hit'
-            elif pair_value == 5:
-                if dealer_value in range(2, 10):  # Dealer 2 through 9
-                    return 'Double Down'
-                else:
-                    return 'Hit'
-            elif pair_value == 4:
-                if dealer_value in [5, 6]:
-                    return 'Split'
-                else:
-                    return 'Hit'
-            elif pair_value == 3 or pair_value == 2:
-                if dealer_value in range(2, 8):  # Dealer 2 through 7
-                    return 'Split'
-                else:
-                    return 'Hit'
-
-        # Soft totals
-        if soft:
-            if total == 20:  # Soft 20 (A,9)
-                return 'Stand'
-            elif total == 19:  # Soft 19 (A,8)
-                if dealer_value == 6:
-                    return 'Double Down'
-                else:
-                    return 'Stand'
-            elif total == 18:  # Soft 18 (A,7)
-                if dealer_value in range(3, 7):  # Dealer 3 through 6
-                    return 'Double Down'
-                elif dealer_value in [2, 7, 8]:
-                    return 'Stand'
-                else:
-                    return 'Hit'
-            elif total == 17:  # Soft 17 (A,6)
-                if dealer_value in range(3, 7):  # Dealer 3 through 6
-                    return 'Double Down'
-                else:
-                    return 'Hit'
-            elif total in [13, 14, 15, 16]:  # Soft 13 to 16 (A,2 to A,5)
-                if dealer_value in [4, 5, 6]:
-                    return 'Double Down'
-                else:
-                    return 'Hit'
-            else:
-                return 'Hit'
-        else:
-            # Hard totals
-            if total >= 17:
-                return 'Stand'
-            elif total >= 13:
-                if dealer_value in range(2, 7):  # Dealer 2 through 6
-                    return 'Stand'
-                else:
-                    return 'Hit'
-            elif total == 12:
-                if dealer_value in range(4, 7):  # Dealer 4 through 6
-                    return 'Stand'
-                else:
-                    return 'Hit'
-            elif total == 11:
-                return 'Double Down'
-            elif total == 10:
-                if dealer_value in range(2, 10):  # Dealer 2 through 9
-                    return 'Double Down'
-                else:
-                    return 'Hit'
-            elif total == 9:
-                if dealer_value in range(3, 7):  # Dealer 3 through 6
-                    return 'Double Down'
-                else:
-                    return 'Hit'
-            else:
-                return 'Hit'
+    def get_suggestion(self, player_hand, dealer_upcard, true_count):
+        """
+        Returns a suggestion ('Hit', 'Stand', 'Double Down', 'Split', 'Surrender')
+        based on the player's hand, dealer's upcard, and true count.
+        """
+        return self.strategy.suggest(player_hand, dealer_upcard, true_count)
 
 
 # Add the main block to run the detector individually
@@ -421,9 +529,11 @@ if __name__ == "__main__":
     IM_HEIGHT = 720
     FRAME_RATE = 10
 
-    # Initialize video stream
-    videostream = VideoStream.VideoStream((IM_WIDTH, IM_HEIGHT), FRAME_RATE, 2, 0).start()
-    time.sleep(1)  # Give the camera time to warm up
+    # Initialize video stream. Pass a video file or image directory to run on a recording.
+    source = sys.argv[1] if len(sys.argv) > 1 else "usb"
+    videostream = FrameSource.open_source(source, (IM_WIDTH, IM_HEIGHT), FRAME_RATE, realtime=True)
+    if isinstance(videostream, VideoStream.VideoStream):
+        time.sleep(1)  # Give the camera time to warm up
 
     # Initialize card detector
     card_detector = CardDetector(videostream, number_of_decks=1)
@@ -433,6 +543,10 @@ if __name__ == "__main__":
         while True:
             # Process a frame
             image, true_count, suggestion = card_detector.process_frame()
+            if image is None:
+                if videostream.stopped:
+                    break
+                continue
 
             # Display the image
             cv2.imshow("Card Detector", image)
@@ -447,5 +561,7 @@ if __name__ == "__main__":
 
     finally:
         # Clean up
+        card_detector.release_frame()
+        card_detector.close()
         cv2.destroyAllWindows()
         videostream.stop()
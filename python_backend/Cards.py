@@ -4,6 +4,7 @@
 import numpy as np
 import cv2
 import time
+from contextlib import nullcontext
 
 ### Constants ###
 
@@ -28,10 +29,18 @@ SUIT_HEIGHT = 100
 RANK_DIFF_MAX = 0.15  
 SUIT_DIFF_MAX = 0.15
 
+# Minimum number of ORB descriptor matches needed to accept a rank
+MIN_MATCH_COUNT_RANK = 5  # Adjust based on testing
+
 
 CARD_MAX_AREA = 120000
 CARD_MIN_AREA = 25000
 
+# Coarse card search: candidates found on the downscaled image may be this much
+# smaller or larger than the card area limits, since the full resolution check
+# after refinement is the one that decides
+COARSE_AREA_SLACK = 0.2
+
 font = cv2.FONT_HERSHEY_SIMPLEX
 
 ### Structures to hold query card and train card information ###
@@ -54,6 +63,8 @@ class Query_card:
         self.last_suit = None  # Last known suit
         self.rank_diff = 0  # Difference between rank image and best matched train rank image
         self.suit_diff = 0  # Difference between suit image and best matched train suit image
+        self.rank_score = 0.0  # Confidence of the rank match, from 0 to 1
+        self.suit_score = 0.0  # Confidence of the suit match, from 0 to 1
 
 class Train_ranks:
     """Structure to store information about train rank images."""
@@ -69,6 +80,27 @@ class Train_suits:
         self.img = [] # Thresholded, sized suit image loaded from hard drive
         self.name = "Placeholder"
 
+class Rank_index:
+    """Structure to store the ORB descriptors of all train rank images,
+    merged into a single labeled database, along with the reusable
+    ORB detector and matcher."""
+
+    def __init__(self):
+        self.orb = None  # ORB detector shared by train and query images
+        self.matcher = None  # Brute force Hamming matcher
+        self.names = []  # Rank name for each label
+        self.descriptors = None  # Stacked descriptors of all train ranks
+        self.labels = None  # Label (index into names) of each descriptor row
+
+class Template_bank:
+    """Structure to store a set of train images as a single pre-normalized
+    float32 tensor, so query images can be scored against all of them at once."""
+
+    def __init__(self):
+        self.names = []  # Name of each template row
+        self.width, self.height = 0, 0  # Size every image is resized to before scoring
+        self.templates = None  # K x (width*height) zero-mean, unit-norm template rows
+
 ### Functions ###
 def load_ranks(filepath):
     """Loads rank images from directory specified by filepath. Stores
@@ -116,6 +148,115 @@ def load_suits(filepath):
 
     return train_suits
 
+def load_rank_index(train_ranks):
+    """Computes ORB descriptors for every train rank image once and merges
+    them into a Rank_index, so query ranks can be matched against all
+    train ranks with a single matcher call."""
+
+    rank_index = Rank_index()
+    rank_index.orb, rank_index.matcher = create_orb_matcher()
+
+    all_des = []
+    all_labels = []
+
+    for Trank in train_ranks:
+        rank_index.names.append(Trank.name)
+        if Trank.img is None:
+            continue
+
+        kp_train_rank, des_train_rank = rank_index.orb.detectAndCompute(Trank.img, None)
+        if des_train_rank is not None:
+            all_des.append(des_train_rank)
+            all_labels.append(np.full(len(des_train_rank), len(rank_index.names) - 1, dtype=np.int32))
+
+    if all_des:
+        rank_index.descriptors = np.vstack(all_des)
+        rank_index.labels = np.concatenate(all_labels)
+
+    return rank_index
+
+def create_orb_matcher():
+    """Returns a new ORB detector and brute force Hamming matcher with the
+    settings used for rank matching."""
+
+    orb = cv2.ORB_create(nfeatures=1000, scaleFactor=1.2, nlevels=8)
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    return orb, matcher
+
+def copy_rank_index(rank_index):
+    """Returns a Rank_index sharing the train descriptors of rank_index but with
+    its own ORB detector and matcher, so another thread can match with it."""
+
+    copy = Rank_index()
+    copy.orb, copy.matcher = create_orb_matcher()
+    copy.names = rank_index.names
+    copy.descriptors = rank_index.descriptors
+    copy.labels = rank_index.labels
+    return copy
+
+def match_rank_orb(rank_img, rank_index):
+    """Matches a query rank image against the merged train descriptors.
+    Returns the best rank name, its number of matches, and its share of all matches."""
+
+    if rank_index.descriptors is None:
+        return "Unknown", 0, 0.0
+
+    # Compute keypoints and descriptors for query rank image
+    kp_query_rank, des_query_rank = rank_index.orb.detectAndCompute(rank_img, None)
+    if des_query_rank is None:
+        return "Unknown", 0, 0.0
+
+    # Match against every train descriptor at once, then let each match
+    # vote for the rank its train descriptor came from
+    matches = rank_index.matcher.match(des_query_rank, rank_index.descriptors)
+    if len(matches) == 0:
+        return "Unknown", 0, 0.0
+
+    train_idx = np.fromiter((m.trainIdx for m in matches), dtype=np.int32, count=len(matches))
+    votes = np.bincount(rank_index.labels[train_idx], minlength=len(rank_index.names))
+    best = int(np.argmax(votes))
+
+    return rank_index.names[best], int(votes[best]), float(votes[best] / len(matches))
+
+def normalize_for_matching(imgs, width, height):
+    """Resizes images to width x height and flattens them into the rows of an
+    N x (width*height) float32 array with zero mean and unit norm. The dot
+    product of two rows equals cv2.TM_CCOEFF_NORMED on same-sized images.
+    Missing or flat images become all-zero rows, which score 0 against anything."""
+
+    rows = np.zeros((len(imgs), width*height), dtype=np.float32)
+
+    for i, img in enumerate(imgs):
+        if img is None or img.size == 0:
+            continue
+        if img.shape[:2] != (height, width):
+            img = cv2.resize(img, (width, height))
+        rows[i] = img.reshape(-1)
+
+    rows -= rows.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    np.divide(rows, norms, out=rows, where=norms > 0)
+    rows[norms[:, 0] == 0] = 0
+
+    return rows
+
+def load_template_bank(train_imgs, width, height):
+    """Builds a Template_bank from a list of Train_ranks or Train_suits objects."""
+
+    bank = Template_bank()
+    bank.names = [Timg.name for Timg in train_imgs]
+    bank.width, bank.height = width, height
+    bank.templates = normalize_for_matching([Timg.img for Timg in train_imgs], width, height)
+
+    return bank
+
+def score_templates(imgs, bank):
+    """Scores every query image against every template in the bank with one
+    matrix product. Returns an N x K matrix of normalized correlations."""
+
+    queries = normalize_for_matching(imgs, bank.width, bank.height)
+    return np.clip(queries @ bank.templates.T, -1, 1)
+
 def preprocess_image(image):
     """Returns a grayed, blurred, and adaptively thresholded camera image."""
 
@@ -131,18 +272,31 @@ def preprocess_image(image):
     # A background pixel in the center top of the image is sampled to determine
     # its intensity. The adaptive threshold is set at 50 (THRESH_ADDER) higher
     # than that. This allows the threshold to adapt to the lighting conditions.
-    img_w, img_h = np.shape(image)[:2]
-    bkg_level = gray[int(img_h/100)][int(img_w/2)]
-    thresh_level = bkg_level + BKG_THRESH
+    thresh_level = background_threshold(gray)
 
     retval, thresh = cv2.threshold(blur,thresh_level,255,cv2.THRESH_BINARY)
     
     return thresh
 
-def find_cards(thresh_image):
+def background_threshold(image):
+    """Returns the threshold level for a camera image, BKG_THRESH above the
+    background intensity sampled near the center top of the image. Takes
+    either the grayed image or the BGR one, of which only the sampled pixel
+    is converted."""
+
+    img_w, img_h = np.shape(image)[:2]
+    row, col = int(img_h/100), int(img_w/2)
+    bkg = image[row:row+1, col:col+1]
+    if bkg.ndim == 3:
+        bkg = cv2.cvtColor(bkg, cv2.COLOR_BGR2GRAY)
+    return int(bkg[0][0]) + BKG_THRESH
+
+def find_cards(thresh_image, scale=1.0, slack=0):
     """Finds all card-sized contours in a thresholded camera image.
     Returns the number of cards, and a list of card contours sorted
-    from largest to smallest."""
+    from largest to smallest. scale is the size of thresh_image relative
+    to the camera image, and scales the card area limits to match; slack
+    widens those limits by a fraction and accepts any number of corners."""
 
     # Find contours and sort their indices by contour size
     cnts, hier = cv2.findContours(thresh_image, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
@@ -170,21 +324,135 @@ def find_cards(thresh_image):
     # 2), bigger area than the minimum card size, 3) have no parents,
     # and 4) have four corners
 
+    max_area = CARD_MAX_AREA * scale**2 * (1 + slack)
+    min_area = CARD_MIN_AREA * scale**2 * (1 - slack)
+
     for i in range(len(cnts_sort)):
         size = cv2.contourArea(cnts_sort[i])
+        if (size >= max_area) or (size <= min_area) or (hier_sort[i][3] != -1):
+            continue
+
         peri = cv2.arcLength(cnts_sort[i], True)
         approx = cv2.approxPolyDP(cnts_sort[i], 0.01 * peri, True)
 
-        if ((size < CARD_MAX_AREA) and (size > CARD_MIN_AREA)
-                and (hier_sort[i][3] == -1) and (len(approx) == 4)):
+        if (len(approx) == 4) or slack:
             cnt_is_card[i] = 1
 
     return cnts_sort, cnt_is_card
 
+def find_cards_coarse(image, scale=0.5):
+    """Coarse-to-fine version of find_cards(preprocess_image(image)). Card
+    candidates are found on a copy of the camera image downscaled by scale,
+    and each candidate's contour is then found again at full resolution, but
+    only inside its bounding box. Returns full resolution contours and flags
+    like find_cards, for the candidates only."""
+
+    if scale >= 1:
+        return find_cards(preprocess_image(image))
+
+    # Threshold the downscaled image at the level the full image would use,
+    # and search it leniently
+    thresh_level = background_threshold(image)
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+    gray_small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    retval, thresh_small = cv2.threshold(cv2.GaussianBlur(gray_small, (5,5), 0), thresh_level, 255, cv2.THRESH_BINARY)
+    cnts_small, is_candidate = find_cards(thresh_small, scale, slack=COARSE_AREA_SLACK)
+
+    cnts_sort = []
+    cnt_is_card = []
+    for i in range(len(cnts_small)):
+        if is_candidate[i] != 1:
+            continue
+        contour = refine_contour(image, cnts_small[i], scale, thresh_level)
+        if contour is None:
+            continue
+
+        # Apply the full resolution card criteria to the refined contour
+        size = cv2.contourArea(contour)
+        peri = cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, 0.01 * peri, True)
+        is_card = (size < CARD_MAX_AREA) and (size > CARD_MIN_AREA) and (len(approx) == 4)
+
+        cnts_sort.append(contour)
+        cnt_is_card.append(int(is_card))
+
+    # Keep the largest to smallest order of find_cards
+    order = sorted(range(len(cnts_sort)), key=lambda i: cv2.contourArea(cnts_sort[i]), reverse=True)
+    return [cnts_sort[i] for i in order], np.array([cnt_is_card[i] for i in order], dtype=int)
+
+def find_cards_region(image, rect):
+    """Version of find_cards(preprocess_image(image)) that only searches the
+    rectangle (x0, y0, x1, y1) of the camera image, thresholded at the level
+    the whole image would use. Returns full image contours and flags like
+    find_cards; contours cut by the edge of the rectangle are not cards."""
+
+    img_h, img_w = np.shape(image)[:2]
+    x0, y0, x1, y1 = rect
+
+    gray = cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(gray, (5,5), 0)
+    retval, thresh = cv2.threshold(blur, background_threshold(image), 255, cv2.THRESH_BINARY)
+    cnts_sort, cnt_is_card = find_cards(thresh)
+
+    for i in range(len(cnts_sort)):
+        cnts_sort[i] = cnts_sort[i] + np.array([x0, y0], dtype=cnts_sort[i].dtype)
+        if cnt_is_card[i] != 1:
+            continue
+
+        # Only the edges of the rectangle that are also edges of the image may be touched
+        x, y, w, h = cv2.boundingRect(cnts_sort[i])
+        if ((x <= x0 and x0 > 0) or (y <= y0 and y0 > 0)
+                or (x + w >= x1 and x1 < img_w) or (y + h >= y1 and y1 < img_h)):
+            cnt_is_card[i] = 0
+
+    return cnts_sort, cnt_is_card
+
+def refine_contour(image, coarse_contour, scale, thresh_level):
+    """Finds the full resolution contour of a card candidate from the downscaled
+    image, by thresholding only the region of the camera image around it.
+    Returns None if no contour covers the candidate's center."""
+
+    img_h, img_w = np.shape(image)[:2]
+
+    # Bounding box of the candidate in full resolution, with a margin for the
+    # pixels lost to downscaling and for the blur
+    margin = int(np.ceil(2 / scale)) + 4
+    x, y, w, h = cv2.boundingRect(coarse_contour)
+    x0 = max(int(x / scale) - margin, 0)
+    y0 = max(int(y / scale) - margin, 0)
+    x1 = min(int((x + w) / scale) + margin, img_w)
+    y1 = min(int((y + h) / scale) + margin, img_h)
+
+    gray = cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(gray, (5,5), 0)
+    retval, thresh = cv2.threshold(blur, thresh_level, 255, cv2.THRESH_BINARY)
+    cnts, hier = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
+
+    # A neighbouring card may reach into the region; pick the largest contour
+    # around the candidate's center
+    moments = cv2.moments(coarse_contour)
+    if moments["m00"] == 0:
+        return None
+    center = (moments["m10"] / moments["m00"] / scale, moments["m01"] / moments["m00"] / scale)
+    cnts = [cnt for cnt in cnts if cv2.pointPolygonTest(cnt, center, False) >= 0]
+    if not cnts:
+        return None
+
+    return max(cnts, key=cv2.contourArea)
+
 def preprocess_card(contour, image):
     """Uses contour to find information about the query card. Isolates rank
     and suit images from the card."""
 
+    qCard = card_geometry(contour)
+    isolate_rank_suit(qCard, image)
+
+    return qCard
+
+def card_geometry(contour):
+    """Creates a Query_card holding only the contour, corner points, size and
+    center of the card. Cheap enough to run on every card of every frame."""
+
     # Initialize new Query_card object
     qCard = Query_card()
 
@@ -206,8 +474,13 @@ def preprocess_card(contour, image):
     cent_y = int(average[0][1])
     qCard.center = [cent_x, cent_y]
 
+    return qCard
+
+def isolate_rank_suit(qCard, image):
+    """Flattens the card found by card_geometry and isolates its rank and suit images."""
+
     # Warp card into 200x300 flattened image using perspective transform
-    qCard.warp = flattener(image, pts, w, h)
+    qCard.warp = flattener(image, qCard.corner_pts, qCard.width, qCard.height)
 
     # Grab corner of warped card image and do a 4x zoom
     Qcorner = qCard.warp[0:CORNER_HEIGHT, 0:CORNER_WIDTH]
@@ -283,132 +556,129 @@ def preprocess_card(contour, image):
 
     return qCard
   
-def match_card(qCard, train_ranks, train_suits):
+def match_card(qCard, train_ranks, train_suits, rank_index=None, rank_bank=None, suit_bank=None):
     """Finds best rank and suit matches for the query card using ORB feature matching for ranks
-    and template matching for suits."""
+    and template matching for suits. Pass the Rank_index from load_rank_index and the
+    Template_banks from load_template_bank to avoid rebuilding them on every call."""
+
+    return match_card_batch([qCard], train_ranks, train_suits, rank_index, rank_bank, suit_bank)[0]
 
-    if qCard.rank_img is None or qCard.rank_img.size == 0:
-        # print("Invalid query card rank image")
-        return "Unknown", "Unknown", None, None
+def match_card_batch(qCards, train_ranks, train_suits, rank_index=None, rank_bank=None, suit_bank=None,
+                     stage_timer=None, rank_matcher=None):
+    """Finds best rank and suit matches for every query card in a frame. Ranks are
+    matched with ORB first; suits, and ranks that ORB could not identify, are scored
+    against all templates in one vectorized pass. Returns a list of
+    (rank, suit, rank_diff, suit_diff) tuples in the same order as qCards.
+    stage_timer, if given, is called with "rank_match" and "suit_match" and must
+    return a context manager timing that part of the work. rank_matcher, if given,
+    replaces the ORB loop: it is called with the list of cards and must return
+    match_rank_orb's result for each, in order."""
 
-    if qCard.suit_img is None or qCard.suit_img.size == 0:
-        # print("Invalid query card suit image")
-        return "Unknown", "Unknown", None, None
+    results = [("Unknown", "Unknown", None, None)] * len(qCards)
 
     if not train_ranks or not train_suits:
         # print("No training data available")
-        return "Unknown", "Unknown", None, None
+        return results
 
-    # Initialize ORB detector
-    orb = cv2.ORB_create(nfeatures=1000, scaleFactor=1.2, nlevels=8)
+    # Only cards with both a rank and suit image can be matched
+    valid = [i for i, qCard in enumerate(qCards)
+             if qCard.rank_img is not None and qCard.rank_img.size != 0
+             and qCard.suit_img is not None and qCard.suit_img.size != 0]
+    if not valid:
+        return results
+
+    if rank_index is None:
+        rank_index = load_rank_index(train_ranks)
+    if rank_bank is None:
+        rank_bank = load_template_bank(train_ranks, RANK_WIDTH, RANK_HEIGHT)
+    if suit_bank is None:
+        suit_bank = load_template_bank(train_suits, SUIT_WIDTH, SUIT_HEIGHT)
+    if stage_timer is None:
+        stage_timer = lambda stage: nullcontext()
+
+    with stage_timer("rank_match"):
+        match_rank_batch([qCards[i] for i in valid], rank_index, rank_bank, rank_matcher)
+
+    with stage_timer("suit_match"):
+        match_suit_batch([qCards[i] for i in valid], suit_bank)
 
-    best_rank_match_name = "Unknown"
-    max_rank_matches = 0
+    for i in valid:
+        qCard = qCards[i]
+        results[i] = (qCard.best_rank_match, qCard.best_suit_match, qCard.rank_diff, qCard.suit_diff)
+
+    return results
+
+def match_rank_batch(qCards, rank_index, rank_bank, rank_matcher=None):
+    """Sets best_rank_match of every query card, which must all have a rank image.
+    Uses ORB first and falls back to batched template matching."""
 
     # For rank matching using ORB
-    if qCard.rank_img is not None and qCard.rank_img.size != 0:
-        # Compute keypoints and descriptors for query rank image
-        kp_query_rank, des_query_rank = orb.detectAndCompute(qCard.rank_img, None)
-
-        if des_query_rank is not None:
-            for Trank in train_ranks:
-                if Trank.img is not None:
-                    # Compute keypoints and descriptors for training rank image
-                    kp_train_rank, des_train_rank = orb.detectAndCompute(Trank.img, None)
-
-                    # Check if descriptors are not None
-                    if des_train_rank is not None:
-                        # Match descriptors
-                        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-                        matches = bf.match(des_query_rank, des_train_rank)
-
-                        # Count the number of good matches
-                        num_matches = len(matches)
-
-                        if num_matches > max_rank_matches:
-                            max_rank_matches = num_matches
-                            best_rank_match_name = Trank.name
-    #     else:
-    #         print("No descriptors found in query rank image")
-    # else:
-    #     print("qCard.rank_img is not valid for ORB detection")
-
-    # Set a threshold for minimum number of matches
-    MIN_MATCH_COUNT_RANK = 5  # Adjust based on testing
-    if max_rank_matches >= MIN_MATCH_COUNT_RANK:
-        qCard.best_rank_match = best_rank_match_name
+    if rank_matcher is not None:
+        orb_matches = rank_matcher(qCards)
     else:
-        qCard.best_rank_match = "Unknown"
-
-    # If ORB matching fails, try template matching for ranks
-    if qCard.best_rank_match == "Unknown":
-        best_rank_match_diff = float('inf')
-        for Trank in train_ranks:
-            if Trank.img is not None and qCard.rank_img is not None:
-                # Resize query image to match the size of the training image
-                query_resized = cv2.resize(qCard.rank_img, (Trank.img.shape[1], Trank.img.shape[0]))
-                
-                # Ensure both images are the same type
-                query_resized = query_resized.astype(np.float32)
-                train_img = Trank.img.astype(np.float32)
-                
-                try:
-                    res = cv2.matchTemplate(query_resized, train_img, cv2.TM_CCOEFF_NORMED)
-                    _, max_val, _, _ = cv2.minMaxLoc(res)
-                    rank_diff = 1 - max_val
-                    if rank_diff < best_rank_match_diff:
-                        best_rank_match_diff = rank_diff
-                        qCard.best_rank_match = Trank.name
-                except cv2.error as e:
-                    print(f"Error in template matching for rank {Trank.name}: {str(e)}")
-                    print(f"Query image shape: {query_resized.shape}, Train image shape: {train_img.shape}")
-        
-        if best_rank_match_diff > RANK_DIFF_MAX:
-            qCard.best_rank_match = "Unknown"
+        orb_matches = [match_rank_orb(qCard.rank_img, rank_index) for qCard in qCards]
 
-    # print(f"Rank matching - Best match: {best_rank_match_name}, Matches: {max_rank_matches}")
+    for qCard, (best_rank_match_name, max_rank_matches, share) in zip(qCards, orb_matches):
+        # print(f"Rank matching - Best match: {best_rank_match_name}, Matches: {max_rank_matches}")
+
+        # Require a minimum number of matches
+        if max_rank_matches >= MIN_MATCH_COUNT_RANK:
+            qCard.best_rank_match = best_rank_match_name
+            qCard.rank_score = share
+        else:
+            qCard.best_rank_match = "Unknown"
+            qCard.rank_score = 0.0
+
+    # If ORB matching fails, fall back to template matching for ranks
+    fallback = [qCard for qCard in qCards if qCard.best_rank_match == "Unknown"]
+    if fallback:
+        rank_scores = score_templates([qCard.rank_img for qCard in fallback], rank_bank)
+        best_ranks = np.argmax(rank_scores, axis=1)
+        for row, qCard in enumerate(fallback):
+            best_rank_match_diff = 1 - rank_scores[row, best_ranks[row]]
+            if best_rank_match_diff <= RANK_DIFF_MAX:
+                qCard.best_rank_match = rank_bank.names[best_ranks[row]]
+                qCard.rank_score = float(1 - best_rank_match_diff)
+
+def match_suit_batch(qCards, suit_bank):
+    """Sets best_suit_match and suit_diff of every query card, which must all
+    have a suit image, with one batched template matching pass."""
+
+    if not qCards:
+        return
 
     # For suit matching using template matching
-    best_suit_match_diff = float('inf')
-    best_suit_match_name = "Unknown"
-
-    if qCard.suit_img is not None and qCard.suit_img.size != 0:
-        for Tsuit in train_suits:
-            if Tsuit.img is not None:
-                # Resize query image to match the size of the training image
-                query_resized = cv2.resize(qCard.suit_img, (Tsuit.img.shape[1], Tsuit.img.shape[0]))
-                
-                # Ensure both images are the same type
-                query_resized = query_resized.astype(np.float32)
-                train_img = Tsuit.img.astype(np.float32)
-                
-                try:
-                    res = cv2.matchTemplate(query_resized, train_img, cv2.TM_CCOEFF_NORMED)
-                    _, max_val, _, _ = cv2.minMaxLoc(res)
-                    suit_diff = 1 - max_val
-
-                    if suit_diff < best_suit_match_diff:
-                        best_suit_match_diff = suit_diff
-                        best_suit_match_name = Tsuit.name
-                except cv2.error as e:
-                    print(f"Error in template matching for suit {Tsuit.name}: {str(e)}")
-                    print(f"Query image shape: {query_resized.shape}, Train image shape: {train_img.shape}")
+    suit_scores = score_templates([qCard.suit_img for qCard in qCards], suit_bank)
+    best_suits = np.argmax(suit_scores, axis=1)
+
+    for row, qCard in enumerate(qCards):
+        best_suit_match_diff = float(1 - suit_scores[row, best_suits[row]])
 
         if best_suit_match_diff < SUIT_DIFF_MAX:
-            qCard.best_suit_match = best_suit_match_name
+            qCard.best_suit_match = suit_bank.names[best_suits[row]]
             qCard.suit_diff = best_suit_match_diff
+            qCard.suit_score = 1 - best_suit_match_diff
         else:
             qCard.best_suit_match = "Unknown"
             qCard.suit_diff = None
-    else:
-        # print("qCard.suit_img is not valid for template matching")
-        qCard.best_suit_match = "Unknown"
-        qCard.suit_diff = None
+            qCard.suit_score = 0.0
+
+        # Since we are using feature matching for ranks, we don't have rank_diff
+        qCard.rank_diff = None
 
-    # Since we are using feature matching for ranks, we don't have rank_diff
-    qCard.rank_diff = None
+def card_record(qCard):
+    """Returns a compact, JSON-ready description of the query card, for
+    clients that draw the results themselves."""
 
-    return qCard.best_rank_match, qCard.best_suit_match, qCard.rank_diff, qCard.suit_diff
+    return {
+        "id": qCard.id,
+        "rank": qCard.best_rank_match,
+        "suit": qCard.best_suit_match,
+        "center": [int(qCard.center[0]), int(qCard.center[1])],
+        "corners": [[int(round(x)), int(round(y))] for x, y in np.reshape(qCard.corner_pts, (-1, 2))],
+        "rank_score": round(float(qCard.rank_score), 3),
+        "suit_score": round(float(qCard.suit_score), 3),
+    }
 
 def draw_results(image, qCard):
     """Draw the card name, center point, and contour on the camera image."""
@@ -445,6 +715,21 @@ def flattener(image, pts, w, h):
     """Flattens an image of a card into a top-down 200x300 perspective.
     Returns the flattened, re-sized, grayed image.
     See www.pyimagesearch.com/2014/08/25/4-point-opencv-getperspective-transform-example/"""
+    maxWidth = 200
+    maxHeight = 300
+
+    # Create destination array, calculate perspective transform matrix,
+    # and warp card image
+    dst = np.array([[0,0],[maxWidth-1,0],[maxWidth-1,maxHeight-1],[0, maxHeight-1]], np.float32)
+    M = cv2.getPerspectiveTransform(order_corners(pts, w, h),dst)
+    warp = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
+    warp = cv2.cvtColor(warp,cv2.COLOR_BGR2GRAY)
+
+    return warp
+
+def order_corners(pts, w, h):
+    """Returns the corner points of a card in the order [top left, top right,
+    bottom right, bottom left] of its upright face, for flattener."""
     temp_rect = np.zeros((4,2), dtype = "float32")
     
     s = np.sum(pts, axis = 2)
@@ -496,16 +781,24 @@ def flattener(image, pts, w, h):
             temp_rect[1] = pts[3][0] # Top right
             temp_rect[2] = pts[2][0] # Bottom right
             temp_rect[3] = pts[1][0] # Bottom left
-            
-        
-    maxWidth = 200
-    maxHeight = 300
 
-    # Create destination array, calculate perspective transform matrix,
-    # and warp card image
-    dst = np.array([[0,0],[maxWidth-1,0],[maxWidth-1,maxHeight-1],[0, maxHeight-1]], np.float32)
-    M = cv2.getPerspectiveTransform(temp_rect,dst)
-    warp = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
-    warp = cv2.cvtColor(warp,cv2.COLOR_BGR2GRAY)
-
-    return warp
+    return temp_rect
+
+def corner_signature(qCard, image, scale=0.5):
+    """Cheap appearance signature of a card's corner, where its rank and suit
+    are: only the corner of the flattened card is warped, at scale. Returns
+    two zero-mean, unit-norm rows, for the rank (top) and suit (bottom) half
+    of the corner, so that a different suit under the same rank still shows
+    (see signature_correlation)."""
+    width, height = int(CORNER_WIDTH * scale), int(CORNER_HEIGHT * scale)
+    dst = np.array([[0,0],[200*scale-1,0],[200*scale-1,300*scale-1],[0,300*scale-1]], np.float32)
+    M = cv2.getPerspectiveTransform(order_corners(qCard.corner_pts, qCard.width, qCard.height), dst)
+    corner = cv2.cvtColor(cv2.warpPerspective(image, M, (width, height)), cv2.COLOR_BGR2GRAY)
+
+    signature = corner.astype(np.float32).reshape(2, -1)
+    signature -= signature.mean(axis=1, keepdims=True)
+    return signature / np.maximum(np.linalg.norm(signature, axis=1, keepdims=True), 1e-6)
+
+def signature_correlation(signature_a, signature_b):
+    """Correlation of two corner signatures: the lower of the rank and suit halves'."""
+    return float(np.min(np.sum(signature_a * signature_b, axis=1)))
@@ -0,0 +1,326 @@
+############## Composition dependent EV ###############
+#
+# Basic strategy assumes a full shoe, but the detector sees every card dealt,
+# so the exact cards left are known. This engine works out, for the cards
+# left in the shoe, the dealer's final total probabilities for an upcard and
+# the EV of standing, hitting, doubling, splitting and surrendering a hand.
+#
+# A composition is the number of cards left of each value (Ace, Two to Nine,
+# and all ten-valued cards together), encoded as 10 bytes. The cards on the
+# table are already taken out of it, as Shoe does.
+#
+# The dealer's probabilities are computed by drawing every possible card
+# without replacement until the dealer stands. Partial results are memoized
+# in a bounded LRU cache keyed by the composition, the upcard and the cards
+# drawn since (packed into one integer, see DRAW_CODE), so the many draw
+# orders that lead to the same cards are only worked out once, and later
+# frames with the same shoe reuse them. The recursion takes cards out of a
+# single count list and puts them back, instead of building a composition
+# per draw. The dealer is assumed to have peeked and not to have a blackjack.
+#
+# The player's hit and double EVs draw the player's cards from the
+# composition exactly, and compare the final hands with the dealer's
+# probabilities for the composition at the time of the decision, like most
+# composition dependent calculators. Splits are played once, with one card
+# on split Aces. A natural (two card 21) stands for the blackjack payout,
+# since the dealer is known not to have one; 21 after a split is not a
+# natural. Whole evaluations are cached too, keyed by the composition, the
+# hand and the upcard.
+
+# Import necessary packages
+from collections import OrderedDict
+import time
+import Strategy
+
+# Index of the card values in a composition: Ace, Two to Nine, ten-valued cards
+VALUES = range(1, 11)
+
+# Cards drawn from a composition are packed into one integer: 5 bits per card value
+DRAW_CODE = [0] + [32 ** (value - 1) for value in VALUES]
+
+# Dealer outcomes, in the order of the probability tuples
+OUTCOMES = ["17", "18", "19", "20", "21", "bust"]
+BUST = 5
+
+# Outcome probabilities of a dealer standing on 17 to 21
+STANDING = {total: tuple(1.0 if index == total - 17 else 0.0 for index in range(len(OUTCOMES)))
+            for total in range(17, 22)}
+
+
+class LRUCache:
+    """Bounded least recently used cache with hit and miss counts"""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.items.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            "size": len(self.items),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 4),
+        }
+
+
+def composition_key(remaining):
+    """
+    Encodes the remaining cards per rank and suit of a Shoe (13x4, Ace first)
+    as a composition: 10 bytes of cards left per value.
+    """
+    per_rank = remaining.sum(axis=1)
+    counts = list(per_rank[:9]) + [per_rank[9:].sum()]
+    return bytes(min(int(count), 255) for count in counts)
+
+
+def best_total(total, has_ace):
+    """Best total of a hand given its total with Aces counted as 1."""
+    return total + 10 if has_ace and total + 10 <= 21 else total
+
+
+class CompositionEV:
+    """Composition dependent dealer probabilities and decision EVs"""
+    def __init__(self, dealer_hits_soft_17=True, double_after_split=True, surrender=True,
+                 dealer_cache_size=200000, result_cache_size=4096, blackjack_pays=1.5):
+
+        self.dealer_hits_soft_17 = dealer_hits_soft_17
+        self.double_after_split = double_after_split
+        self.surrender = surrender
+        self.blackjack_pays = blackjack_pays  # Payout of a natural, per unit bet
+
+        # ((composition, upcard), DRAW_CODE of the dealer's cards drawn since) -> outcome probabilities
+        self.dealer_cache = LRUCache(dealer_cache_size)
+        self.result_cache = LRUCache(result_cache_size)  # (composition, hand, upcard) -> evaluate() result
+        self.last_ms = 0.0  # Time taken by the last evaluation that missed the result cache
+
+    def dealer_outcomes(self, base, counts, cards_left, total, has_ace, drawn):
+        """
+        Probabilities of the dealer's final outcomes (see OUTCOMES) from a
+        dealer hand, given by its total with Aces as 1, drawing from counts.
+        base is the (composition, upcard) the dealer started from, and drawn
+        the DRAW_CODE of the cards drawn since.
+        """
+        best = best_total(total, has_ace)
+        if best > 21:
+            return (0.0, 0.0, 0.0, 0.0, 0.0, 1.0)
+        soft = has_ace and total + 10 <= 21
+        if best >= 17 and not (self.dealer_hits_soft_17 and soft and best == 17):
+            return STANDING[best]
+
+        key = (base, drawn)
+        cached = self.dealer_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Sum the outcomes of every next card, weighted by its probability
+        p17 = p18 = p19 = p20 = p21 = bust = 0.0
+        for value in VALUES:
+            count = counts[value - 1]
+            if count == 0:
+                continue
+            counts[value - 1] = count - 1
+            o17, o18, o19, o20, o21, obust = self.dealer_outcomes(base, counts, cards_left - 1, total + value,
+                                                                  has_ace or value == 1, drawn + DRAW_CODE[value])
+            counts[value - 1] = count
+            weight = count / cards_left
+            p17 += weight * o17
+            p18 += weight * o18
+            p19 += weight * o19
+            p20 += weight * o20
+            p21 += weight * o21
+            bust += weight * obust
+
+        probabilities = (p17, p18, p19, p20, p21, bust)
+        self.dealer_cache.put(key, probabilities)
+        return probabilities
+
+    def dealer_probabilities(self, composition, upcard):
+        """
+        Probabilities of the dealer's final outcomes for an upcard value
+        (Ace = 1), given the dealer has no blackjack.
+        """
+        counts = list(composition)
+        base = (composition, upcard)
+
+        # Hole cards that would make a blackjack are ruled out by the peek
+        excluded = {1: 10, 10: 1}.get(upcard)
+        cards_left = sum(counts)
+        hole_cards = cards_left - (counts[excluded - 1] if excluded else 0)
+
+        probabilities = [0.0] * len(OUTCOMES)
+        for value in VALUES:
+            count = counts[value - 1]
+            if count == 0 or value == excluded:
+                continue
+            counts[value - 1] = count - 1
+            outcome = self.dealer_outcomes(base, counts, cards_left - 1, upcard + value, upcard == 1 or value == 1,
+                                           DRAW_CODE[value])
+            counts[value - 1] = count
+            weight = count / hole_cards
+            probabilities = [p + weight * o for p, o in zip(probabilities, outcome)]
+        return tuple(probabilities)
+
+    def evaluate(self, composition, player_values, upcard):
+        """
+        Returns the EV of each decision for a hand, given as card values
+        (Ace = 1), against an upcard value, drawing from composition (see
+        composition_key). The result is a dict with the EVs of 'Stand',
+        'Hit', 'Double Down', 'Split' and 'Surrender' (None where not
+        allowed), the best action and the dealer's probabilities.
+        """
+        key = (composition, tuple(sorted(player_values)), upcard)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            return cached
+
+        t_start = time.perf_counter()
+        dealer = self.dealer_probabilities(composition, upcard)
+
+        # EV of standing on every final total
+        stand_ev = [self.stand_ev(dealer, total) for total in range(32)]
+
+        counts = list(composition)
+        cards_left = sum(counts)
+        total = sum(player_values)
+        has_ace = 1 in player_values
+        two_cards = len(player_values) == 2
+        natural = two_cards and has_ace and total == 11
+
+        # A natural stands for the blackjack payout, and a busted hand (total
+        # over 21) stands on -1 whatever it does
+        evs = {
+            "Stand": self.blackjack_pays if natural else stand_ev[min(best_total(total, has_ace), 31)],
+            "Hit": self.hit_ev(counts, cards_left, total, has_ace, 0, stand_ev, {}),
+            "Double Down": self.double_ev(counts, cards_left, total, has_ace, stand_ev) if two_cards else None,
+            "Split": None,
+            "Surrender": -0.5 if two_cards and self.surrender else None,
+        }
+        if two_cards and player_values[0] == player_values[1]:
+            evs["Split"] = self.split_ev(counts, cards_left, player_values[0], stand_ev)
+
+        best = max((ev, action) for action, ev in evs.items() if ev is not None)[1]
+        result = {
+            "evs": {action: (round(ev, 4) if ev is not None else None) for action, ev in evs.items()},
+            "best": best,
+            "dealer": dict(zip(OUTCOMES, (round(p, 4) for p in dealer))),
+        }
+
+        self.last_ms = (time.perf_counter() - t_start) * 1000
+        self.result_cache.put(key, result)
+        return result
+
+    def stand_ev(self, dealer, total):
+        # EV of standing on a total against the dealer's outcome probabilities
+        if total > 21:
+            return -1.0
+        ev = dealer[BUST]
+        for index in range(BUST):
+            dealer_total = 17 + index
+            if total > dealer_total:
+                ev += dealer[index]
+            elif total < dealer_total:
+                ev -= dealer[index]
+        return ev
+
+    def play_ev(self, counts, cards_left, total, has_ace, drawn, stand_ev, memo):
+        # EV of playing on from a hand, standing or hitting, whichever is better
+        best = best_total(total, has_ace)
+        if best > 21:
+            return -1.0
+        if best == 21:
+            return stand_ev[21]
+        return max(stand_ev[best], self.hit_ev(counts, cards_left, total, has_ace, drawn, stand_ev, memo))
+
+    def hit_ev(self, counts, cards_left, total, has_ace, drawn, stand_ev, memo):
+        # EV of taking a card and then playing on, averaged over the card.
+        # memo holds the results for one starting hand, by the cards drawn since.
+        ev = memo.get(drawn)
+        if ev is not None:
+            return ev
+
+        ev = 0.0
+        for value in VALUES:
+            count = counts[value - 1]
+            if count == 0:
+                continue
+            new_total = total + value
+            new_ace = has_ace or value == 1
+            best = new_total + 10 if new_ace and new_total <= 11 else new_total
+
+            # Play on from the new hand, as in play_ev (inlined, this is the innermost loop)
+            if best > 21:
+                card_ev = -1.0
+            elif best == 21:
+                card_ev = stand_ev[21]
+            else:
+                counts[value - 1] = count - 1
+                card_ev = max(stand_ev[best], self.hit_ev(counts, cards_left - 1, new_total, new_ace,
+                                                          drawn + DRAW_CODE[value], stand_ev, memo))
+                counts[value - 1] = count
+            ev += count / cards_left * card_ev
+        memo[drawn] = ev
+        return ev
+
+    def double_ev(self, counts, cards_left, total, has_ace, stand_ev):
+        # Twice the EV of standing after exactly one more card
+        ev = 0.0
+        for value in VALUES:
+            count = counts[value - 1]
+            if count == 0:
+                continue
+            ev += count / cards_left * stand_ev[min(best_total(total + value, has_ace or value == 1), 31)]
+        return 2 * ev
+
+    def split_ev(self, counts, cards_left, value, stand_ev):
+        # Twice the EV of one hand started from one card of the pair
+        memo = {}
+        ev = 0.0
+        for drawn in VALUES:
+            count = counts[drawn - 1]
+            if count == 0:
+                continue
+            counts[drawn - 1] = count - 1
+            total, has_ace = value + drawn, value == 1 or drawn == 1
+            if value == 1:
+                # Split Aces get one card each
+                hand_ev = stand_ev[best_total(total, has_ace)]
+            else:
+                hand_ev = self.play_ev(counts, cards_left - 1, total, has_ace, DRAW_CODE[drawn], stand_ev, memo)
+                if self.double_after_split:
+                    hand_ev = max(hand_ev, self.double_ev(counts, cards_left - 1, total, has_ace, stand_ev))
+            counts[drawn - 1] = count
+            ev += count / cards_left * hand_ev
+        return 2 * ev
+
+    def stats(self):
+        return {
+            "last_ms": round(self.last_ms, 2),
+            "results": self.result_cache.stats(),
+            "dealer": self.dealer_cache.stats(),
+        }
+
+
+def hand_values(player_hand):
+    """Card values (Ace = 1) of a hand given as rank names."""
+    return [1 if rank == 'Ace' else Strategy.RANK_VALUES[rank] for rank in player_hand if rank in Strategy.RANK_VALUES]
@@ -0,0 +1,141 @@
+############## Card counting systems ###############
+#
+# Every counting system is a row of tags, one per rank (Ace first, as in
+# Shoe.RANKS), so adding a system only takes adding its tags to SYSTEMS.
+#
+# Counter keeps the running count of every enabled system in one array. The
+# cards counted in a frame are added in a single pass: their ranks are binned
+# into a per-rank histogram and multiplied by the systems' tag matrix, so the
+# cost per card is the same however many systems are enabled.
+#
+# Balanced systems start at 0 and have a true count (running count per deck
+# remaining, truncated toward zero, as the strategy's deviation indices are
+# played). Unbalanced systems (KO) start at their initial running count and
+# are played on the running count, so they have no true count.
+#
+# Side counts of Aces, which some Ace-neutral systems use, are not kept.
+
+# Import necessary packages
+import numpy as np
+
+# Tags per rank: Ace, Two to Ten, Jack, Queen, King
+SYSTEMS = {
+    "hi_lo": {
+        "name": "Hi-Lo",
+        "tags": [-1, 1, 1, 1, 1, 1, 0, 0, 0, -1, -1, -1, -1],
+        "balanced": True,
+    },
+    "ko": {
+        "name": "KO",
+        "tags": [-1, 1, 1, 1, 1, 1, 1, 0, 0, -1, -1, -1, -1],
+        "balanced": False,
+        "initial_per_deck": -4,  # Initial running count: 4 - 4 per deck
+        "initial_offset": 4,
+    },
+    "hi_opt_1": {
+        "name": "Hi-Opt I",
+        "tags": [0, 0, 1, 1, 1, 1, 0, 0, 0, -1, -1, -1, -1],
+        "balanced": True,
+    },
+    "hi_opt_2": {
+        "name": "Hi-Opt II",
+        "tags": [0, 1, 1, 2, 2, 1, 1, 0, 0, -2, -2, -2, -2],
+        "balanced": True,
+    },
+    "omega_2": {
+        "name": "Omega II",
+        "tags": [0, 1, 1, 2, 2, 2, 1, 0, -1, -2, -2, -2, -2],
+        "balanced": True,
+    },
+    "zen": {
+        "name": "Zen Count",
+        "tags": [-1, 1, 1, 2, 2, 2, 1, 0, 0, -2, -2, -2, -2],
+        "balanced": True,
+    },
+    "wong_halves": {
+        "name": "Wong Halves",
+        "tags": [-1, 0.5, 1, 1, 1.5, 1, 0.5, 0, -0.5, -1, -1, -1, -1],
+        "balanced": True,
+    },
+}
+
+NUM_RANKS = 13
+
+# The strategy's true count deviations are Hi-Lo indices, so Hi-Lo is always counted
+PRIMARY_SYSTEM = "hi_lo"
+
+
+def parse_systems(text):
+    """Returns the system names in a comma separated list, such as 'hi_lo,ko'."""
+    systems = [name.strip().lower() for name in text.split(",") if name.strip()]
+    for name in systems:
+        if name not in SYSTEMS:
+            raise ValueError("Unknown counting system: %s (known: %s)" % (name, ", ".join(SYSTEMS)))
+    return systems
+
+
+class Counter:
+    """Running and true counts of several counting systems at once"""
+    def __init__(self, systems=(PRIMARY_SYSTEM,), number_of_decks=1):
+
+        self.systems = [PRIMARY_SYSTEM] + [name for name in systems if name != PRIMARY_SYSTEM]
+        for name in self.systems:
+            if name not in SYSTEMS:
+                raise ValueError("Unknown counting system: %s" % name)
+        self.enabled = list(dict.fromkeys(systems))  # Systems reported by counts(), in the order given
+
+        # Tag matrix: one row per system, one column per rank
+        self.tags = np.array([SYSTEMS[name]["tags"] for name in self.systems], dtype=np.float64)
+        self.balanced = np.array([SYSTEMS[name]["balanced"] for name in self.systems])
+        self.initial = np.array([SYSTEMS[name].get("initial_offset", 0) +
+                                 SYSTEMS[name].get("initial_per_deck", 0) * number_of_decks
+                                 for name in self.systems], dtype=np.float64)
+        self.index = {name: index for index, name in enumerate(self.systems)}
+
+        self.running = self.initial.copy()
+        self.cards_counted = 0
+
+    def reset(self):
+        # Start a new shoe
+        self.running[:] = self.initial
+        self.cards_counted = 0
+
+    def update(self, rank_indices):
+        """
+        Adds the cards with the given rank indices (Ace = 0) to every system's
+        running count in one pass.
+        """
+        if len(rank_indices) == 0:
+            return
+        histogram = np.bincount(np.asarray(rank_indices, dtype=np.intp), minlength=NUM_RANKS)
+        self.running += self.tags @ histogram
+        self.cards_counted += len(rank_indices)
+
+    def running_count(self, system=PRIMARY_SYSTEM):
+        return float(self.running[self.index[system]])
+
+    def true_counts(self, decks_remaining):
+        # Running counts per deck remaining, truncated; 0 once the shoe is used up, NaN for unbalanced systems
+        if decks_remaining <= 0:
+            return np.where(self.balanced, 0.0, np.nan)
+        return np.where(self.balanced, np.trunc(self.running / decks_remaining), np.nan)
+
+    def true_count(self, decks_remaining, system=PRIMARY_SYSTEM):
+        # True count of one balanced system, as an int
+        return int(self.true_counts(decks_remaining)[self.index[system]])
+
+    def counts(self, decks_remaining):
+        """
+        Returns the running and true count (None for unbalanced systems) of
+        each enabled system, by system name.
+        """
+        true_counts = self.true_counts(decks_remaining)
+        counts = {}
+        for name in self.enabled:
+            index = self.index[name]
+            true_count = true_counts[index]
+            counts[name] = {
+                "running": round(float(self.running[index]), 1),
+                "true": None if np.isnan(true_count) else int(true_count),
+            }
+        return counts
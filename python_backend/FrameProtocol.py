@@ -0,0 +1,95 @@
+############## Websocket frame protocol ###############
+#
+# Every processed frame goes to a client as one binary websocket message, so
+# the count, the suggestion, the card results and the image always arrive
+# together:
+#
+#   header   fixed size, little-endian (see HEADER below)
+#   meta     UTF-8 JSON of CardDetector.last_result, meta_length bytes
+#   payload  JPEG frame, payload_length bytes
+#
+# Header fields:
+#   version          PROTOCOL_VERSION
+#   flags            FLAG_ANNOTATED if the results are drawn on the frame
+#   header_length    size of the header, so fields can be appended later
+#   frame_id         sequence number of the camera frame
+#   capture_time_ms  wall clock time the frame was captured, ms since the epoch
+#   true_count       true count, clamped to a signed 16-bit integer
+#   suggestion       index in SUGGESTIONS, or SUGGESTION_OTHER
+#   meta_length, payload_length
+#
+# The payload is empty when the client already has the current JPEG (the
+# frame has not changed) or video is off; the client keeps showing the last
+# image. src/components/Socket.vue decodes the message with a DataView.
+
+# Import necessary packages
+import json
+import struct
+import time
+import Strategy
+
+PROTOCOL_VERSION = 1
+
+HEADER = struct.Struct("<BBHIdhBxII")
+
+FLAG_ANNOTATED = 1
+
+# Suggestion codes are Strategy's action codes; the client has the same table
+SUGGESTIONS = Strategy.ACTIONS
+SUGGESTION_OTHER = 255  # Not in the table; the text is in the meta JSON
+
+SUGGESTION_CODES = {suggestion: code for code, suggestion in enumerate(SUGGESTIONS)}
+
+
+def pack(result, with_jpeg=True):
+    """
+    Returns the message for a FrameResult, with or without its JPEG.
+    Both variants are built at most once per result and shared by all clients.
+    """
+    message = result.messages.get(with_jpeg)
+    if message is not None:
+        return message
+
+    detections = result.detections or {"true_count": result.true_count, "suggestion": result.suggestion}
+    meta = json.dumps(detections, separators=(",", ":")).encode("utf-8")
+    payload = result.jpeg if with_jpeg else b""
+
+    # The capture time is on the perf_counter clock; the client needs wall clock time
+    capture_time_ms = (time.time() - (time.perf_counter() - result.capture_time)) * 1000
+
+    header = HEADER.pack(
+        PROTOCOL_VERSION,
+        FLAG_ANNOTATED if detections.get("annotated") else 0,
+        HEADER.size,
+        result.frame_seq & 0xFFFFFFFF,
+        capture_time_ms,
+        max(-32768, min(32767, int(result.true_count))),
+        SUGGESTION_CODES.get(result.suggestion, SUGGESTION_OTHER),
+        len(meta),
+        len(payload),
+    )
+
+    message = b"".join((header, meta, payload))
+    result.messages[with_jpeg] = message
+    return message
+
+
+def unpack(message):
+    """
+    Splits a message into its header fields (a dict), the meta dict and the JPEG bytes.
+    """
+    (version, flags, header_length, frame_id, capture_time_ms, true_count,
+     suggestion, meta_length, payload_length) = HEADER.unpack_from(message)
+    if version != PROTOCOL_VERSION:
+        raise ValueError("Unsupported frame protocol version %d" % version)
+
+    meta_end = header_length + meta_length
+    header = {
+        "flags": flags,
+        "frame_id": frame_id,
+        "capture_time_ms": capture_time_ms,
+        "true_count": true_count,
+        "suggestion": SUGGESTIONS[suggestion] if suggestion < len(SUGGESTIONS) else None,
+    }
+    meta = json.loads(message[header_length:meta_end].decode("utf-8"))
+    return header, meta, message[meta_end:meta_end + payload_length]
@@ -0,0 +1,264 @@
+############## Recorded and synthetic frame sources ###############
+#
+# Frame sources that can stand in for VideoStream wherever a camera is
+# expected: CardDetector, main.py and the benchmarks only use start(),
+# stop(), read(), read_new(), borrow() and stats(), which every source here
+# implements.
+#
+# Each source runs in one of two modes:
+#   realtime=False  Frames are produced on demand, as fast as the consumer
+#                   asks for them. Nothing is ever dropped, so throughput is
+#                   limited only by the pipeline.
+#   realtime=True   A thread produces frames at the source's frame rate, like
+#                   a camera would. Frames the consumer is too slow for are
+#                   dropped.
+#
+# Frames handed out are private to the consumer (it may draw on them), so
+# release() on the returned FrameRef is a no-op.
+
+# Import the necessary packages
+from abc import ABC, abstractmethod
+from threading import Thread, Condition
+import os
+import time
+import cv2
+import VideoStream
+from VideoStream import FrameRef
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class FrameSource(ABC):
+    """Base class of the recorded and synthetic frame sources"""
+    def __init__(self, realtime=False, fps=30, loop=False):
+
+        self.realtime = realtime
+        self.fps = fps
+        self.loop = loop  # Start over at the end instead of stopping
+
+        # Current frame and its stamps, as in VideoStream
+        self.frame = None
+        self.frame_seq = 0
+        self.frame_time = 0.0
+        self.last_read_seq = 0
+        self.frames_captured = 0
+        self.frames_dropped = 0
+
+        self.condition = Condition()
+        self.stopped = False
+        self.exhausted = False  # Set when the last frame has been produced
+
+    ### Implemented by subclasses ###
+    @abstractmethod
+    def next_frame(self):
+        # Return the next frame, or None at the end of the source
+        pass
+
+    @abstractmethod
+    def rewind(self):
+        # Go back to the first frame
+        pass
+
+    def close(self):
+        # Release any resources held by the source
+        pass
+
+    ### Shared implementation ###
+    def start(self):
+        if self.realtime:
+            Thread(target=self.update, args=(), daemon=True).start()
+        return self
+
+    def produce(self):
+        # Get the next frame, starting over if looping
+        frame = self.next_frame()
+        if frame is None and self.loop:
+            self.rewind()
+            frame = self.next_frame()
+        if frame is None:
+            self.exhausted = True
+        return frame
+
+    def update(self):
+        # Realtime mode: produce frames at the source frame rate
+        period = 1 / self.fps if self.fps > 0 else 0
+        next_time = time.perf_counter()
+
+        while not self.stopped:
+            frame = self.produce()
+            if frame is None:
+                break
+            self.publish(frame)
+
+            next_time += period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.perf_counter()
+
+        self.close()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def publish(self, frame):
+        # Store a newly produced frame and wake up any waiting readers
+        with self.condition:
+            if self.frame_seq > self.last_read_seq:
+                # The previous frame was never read
+                self.frames_dropped += 1
+            self.frame = frame
+            self.frame_seq += 1
+            self.frame_time = time.perf_counter()
+            self.frames_captured += 1
+            self.condition.notify_all()
+
+    def read(self):
+        # Return the most recent frame
+        if not self.realtime and self.frame_seq == self.last_read_seq:
+            self.read_new()
+        with self.condition:
+            self.last_read_seq = self.frame_seq
+            return self.frame
+
+    def read_new(self, timeout=None):
+        # Return (frame, sequence number, capture time) of a frame newer than
+        # the last one read. frame is None at the end of the source, or if no
+        # new frame arrived within timeout seconds in realtime mode.
+        if not self.realtime:
+            if self.stopped or self.exhausted:
+                return None, self.frame_seq, self.frame_time
+            frame = self.produce()
+            if frame is None:
+                # The end of the source stops it, as in realtime mode, so the
+                # loops reading it see stopped and end
+                self.close()
+                with self.condition:
+                    self.stopped = True
+                    self.condition.notify_all()
+                return None, self.frame_seq, self.frame_time
+            self.publish(frame)
+
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame_seq > self.last_read_seq or self.stopped, timeout)
+            if self.frame_seq <= self.last_read_seq:
+                return None, self.frame_seq, self.frame_time
+            self.last_read_seq = self.frame_seq
+            return self.frame, self.frame_seq, self.frame_time
+
+    def borrow(self, timeout=None):
+        # Same as read_new(), wrapped in a FrameRef
+        frame, seq, timestamp = self.read_new(timeout)
+        if frame is None:
+            return None
+        return FrameRef(frame, seq, timestamp)
+
+    def stats(self):
+        # Return a snapshot of the source statistics
+        with self.condition:
+            return {
+                "frames_captured": self.frames_captured,
+                "frames_dropped": self.frames_dropped,
+                "realtime": self.realtime,
+                "fps": self.fps,
+            }
+
+    def stop(self):
+        # Indicate that the source should be stopped
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if not self.realtime:
+            self.close()
+
+
+class VideoFileSource(FrameSource):
+    """Frames decoded from a video file"""
+    def __init__(self, path, realtime=False, fps=None, loop=False):
+
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise IOError(f"Could not open video file: {path}")
+
+        # Default to the frame rate stored in the file
+        if fps is None:
+            fps = self.capture.get(cv2.CAP_PROP_FPS) or 30
+
+        super().__init__(realtime, fps, loop)
+
+    def next_frame(self):
+        grabbed, frame = self.capture.read()
+        return frame if grabbed else None
+
+    def rewind(self):
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def close(self):
+        self.capture.release()
+
+
+class ImageDirectorySource(FrameSource):
+    """Still images from a directory, in file name order"""
+    def __init__(self, path, realtime=False, fps=10, loop=False):
+
+        self.path = path
+        self.files = sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not self.files:
+            raise IOError(f"No images found in directory: {path}")
+        self.index = 0
+
+        super().__init__(realtime, fps, loop)
+
+    def next_frame(self):
+        while self.index < len(self.files):
+            frame = cv2.imread(self.files[self.index])
+            self.index += 1
+            if frame is not None:
+                return frame
+            print(f"Error loading image: {self.files[self.index - 1]}")
+        return None
+
+    def rewind(self):
+        self.index = 0
+
+
+class ArraySource(FrameSource):
+    """Frames from a list of in-memory images. Each frame handed out is a
+    copy, so consumers drawing on it do not alter the source images."""
+    def __init__(self, frames, realtime=False, fps=30, loop=False):
+
+        self.frames = list(frames)
+        self.index = 0
+
+        super().__init__(realtime, fps, loop)
+
+    def next_frame(self):
+        if self.index >= len(self.frames):
+            return None
+        frame = self.frames[self.index].copy()
+        self.index += 1
+        return frame
+
+    def rewind(self):
+        self.index = 0
+
+
+def open_source(spec, resolution=(1280,720), framerate=10, realtime=False, loop=False):
+    """Opens a frame source from a short description:
+    "usb" or "usb:N" for USB camera N, "picamera" for the PiCamera, a directory
+    of still images, or a video file. Camera sources are started."""
+
+    if spec == "picamera":
+        return VideoStream.VideoStream(resolution, framerate, 1, 0).start()
+    if spec == "usb" or spec.startswith("usb:"):
+        src = int(spec.split(":")[1]) if ":" in spec else 0
+        return VideoStream.VideoStream(resolution, framerate, 2, src).start()
+    if os.path.isdir(spec):
+        return ImageDirectorySource(spec, realtime, framerate, loop).start()
+    if os.path.isfile(spec):
+        return VideoFileSource(spec, realtime, None, loop).start()
+
+    raise ValueError(f"Unknown frame source: {spec}")
@@ -0,0 +1,162 @@
+############## Detection worker thread ###############
+#
+# Runs CardDetector.process_frame and the VideoEncoder in a dedicated thread,
+# so the CV pipeline never blocks the asyncio event loop. Each result is
+# published once, on the event loop, to a BroadcastHub that fans it out to
+# the connected clients. Detection pauses while nobody is subscribed.
+#
+# With video off (no encoder), no frame is encoded and only the structured
+# results of CardDetector.last_result are published. Otherwise the encoder
+# adapts its level to the hub's send pressure once per frame.
+
+# Import necessary packages
+from threading import Thread, Lock
+import time
+import traceback
+
+
+class FrameResult:
+    """Structure to store one processed frame, ready to send."""
+
+    def __init__(self):
+        self.jpeg = b""  # JPEG-encoded frame, empty when video is off
+        self.jpeg_seq = 0  # Sequence number of the JPEG; unchanged frames reuse the last one
+        self.detections = None  # CardDetector.last_result of the frame
+        self.true_count = 0
+        self.suggestion = ""
+        self.frame_seq = 0  # Sequence number of the camera frame
+        self.capture_time = 0.0  # time.perf_counter() when the frame was captured
+        self.produced_at = 0.0  # time.perf_counter() when the result was ready
+        self.messages = {}  # Websocket messages of the result, by whether they carry the JPEG (see FrameProtocol)
+
+
+class FrameWorker:
+    """Detection and encoding thread publishing to a BroadcastHub"""
+    def __init__(self, card_detector, hub, max_fps=0, encoder=None):
+
+        self.card_detector = card_detector
+        self.hub = hub
+
+        # VideoEncoder for the frames sent, or None to send only the structured results
+        self.encoder = encoder
+
+        # Upper bound on detection rate. 0 runs as fast as the pipeline allows.
+        self.max_fps = max_fps
+
+        self.loop = None
+
+        self.stopped = False
+        self.thread = None
+
+        # Statistics, guarded by stats_lock
+        self.stats_lock = Lock()
+        self.frames_processed = 0
+        self.frames_failed = 0  # Frames that raised an error and were skipped
+        self.detection_fps = 0.0  # Exponential moving averages
+        self.process_ms = 0.0
+        self.encode_ms = 0.0
+        self.capture_to_result_ms = 0.0
+
+    def start(self, loop):
+        # Start the worker thread. Results are published on the given event loop.
+        self.loop = loop
+        self.stopped = False
+        self.thread = Thread(target=self.update, args=(), daemon=True)
+        self.thread.start()
+        return self
+
+    def update(self):
+        last_start = None
+
+        while not self.stopped:
+            # Idle while no client is watching
+            if self.hub.subscriber_count() == 0:
+                last_start = None
+                time.sleep(0.05)
+                continue
+
+            t_start = time.perf_counter()
+
+            # Process a frame. An error fails only this frame, not the worker.
+            try:
+                image, true_count, suggestion = self.card_detector.process_frame()
+            except Exception:
+                traceback.print_exc()
+                self.card_detector.release_frame()
+                with self.stats_lock:
+                    self.frames_failed += 1
+                continue
+            if image is None:
+                # No new frame from the camera, or the recording has ended
+                if self.card_detector.videostream.stopped:
+                    return
+                continue
+            t_processed = time.perf_counter()
+
+            result = FrameResult()
+
+            # Convert frame to JPEG, unless it has not changed
+            if self.encoder is not None:
+                try:
+                    self.encoder.adapt(*self.hub.pressure())
+                    result.jpeg, result.jpeg_seq = self.encoder.encode(image, self.card_detector.frame_changed)
+                except Exception:
+                    traceback.print_exc()
+                    with self.stats_lock:
+                        self.frames_failed += 1
+                    continue
+            t_encoded = time.perf_counter()
+
+            result.detections = self.card_detector.last_result
+            result.true_count = true_count
+            result.suggestion = suggestion
+            result.frame_seq = self.card_detector.frame_seq
+            result.capture_time = self.card_detector.capture_time
+            result.produced_at = t_encoded
+
+            with self.stats_lock:
+                self.frames_processed += 1
+                self.process_ms = ema(self.process_ms, (t_processed - t_start) * 1000)
+                self.encode_ms = ema(self.encode_ms, (t_encoded - t_processed) * 1000)
+                self.capture_to_result_ms = ema(self.capture_to_result_ms, (t_encoded - result.capture_time) * 1000)
+                if last_start is not None:
+                    self.detection_fps = ema(self.detection_fps, 1 / max(t_start - last_start, 1e-6))
+            last_start = t_start
+
+            try:
+                self.loop.call_soon_threadsafe(self.hub.publish, result)
+            except RuntimeError:
+                # Event loop is closed
+                return
+
+            # Pace detection if a maximum rate is set
+            if self.max_fps > 0:
+                remaining = (1 / self.max_fps) - (time.perf_counter() - t_start)
+                if remaining > 0:
+                    time.sleep(remaining)
+
+    def stats(self):
+        # Return a snapshot of the worker statistics
+        with self.stats_lock:
+            return {
+                "max_fps": self.max_fps,
+                "frames_processed": self.frames_processed,
+                "frames_failed": self.frames_failed,
+                "detection_fps": round(self.detection_fps, 2),
+                "process_ms": round(self.process_ms, 2),
+                "encode_ms": round(self.encode_ms, 2),
+                "capture_to_result_ms": round(self.capture_to_result_ms, 2),
+            }
+
+    def stop(self):
+        # Indicate that the thread should be stopped, and wait for the current frame
+        self.stopped = True
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+
+def ema(average, value, alpha=0.1):
+    """Exponential moving average, seeded with the first value."""
+    if average == 0:
+        return value
+    return average + alpha * (value - average)
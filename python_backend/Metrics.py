@@ -0,0 +1,204 @@
+############## Pipeline metrics ###############
+#
+# Low-overhead timers, counters and gauges for the detection pipeline, and
+# rendering to the Prometheus text exposition format for the /metrics
+# endpoint.
+#
+# Histograms keep cumulative Prometheus buckets, plus a fixed-size window of
+# the most recent samples from which rolling quantiles are computed at scrape
+# time. Observing a sample is a few list operations under a lock, so timers
+# can wrap every pipeline stage on every frame.
+#
+# Usage:
+#   t = time.perf_counter()
+#   ... work ...
+#   Metrics.STAGE_SECONDS.observe(time.perf_counter() - t, "preprocess")
+# or
+#   with Metrics.timer("preprocess"):
+#       ... work ...
+
+# Import necessary packages
+from threading import Lock
+import bisect
+import time
+import numpy as np
+
+PREFIX = "deckdetective_"
+
+# Bucket upper bounds in seconds, from 0.1 ms to 1 s
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Quantiles reported from the rolling window
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """Cumulative histogram with a rolling window of recent samples, per label value"""
+    def __init__(self, name, help, label=None, buckets=TIME_BUCKETS, window=1000):
+        self.name = PREFIX + name
+        self.help = help
+        self.label = label  # Name of the single label, or None
+        self.buckets = buckets
+        self.window = window
+        self.lock = Lock()
+        self.series = {}  # Label value -> [bucket counts, sum, count, window samples, window index]
+
+    def observe(self, value, label_value=""):
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0, 0, [], 0]
+                self.series[label_value] = series
+
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+            # Overwrite the oldest sample once the window is full
+            samples = series[3]
+            if len(samples) < self.window:
+                samples.append(value)
+            else:
+                samples[series[4]] = value
+                series[4] = (series[4] + 1) % self.window
+
+    def quantiles(self, label_value=""):
+        # Return {quantile: value} over the rolling window
+        with self.lock:
+            series = self.series.get(label_value)
+            samples = list(series[3]) if series is not None else []
+        if not samples:
+            return {}
+        return dict(zip(QUANTILES, np.quantile(samples, QUANTILES)))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        recent = [f"# HELP {self.name}_recent {self.help} (rolling window of the last {self.window} samples)",
+                  f"# TYPE {self.name}_recent summary"]
+
+        with self.lock:
+            snapshot = {key: (list(s[0]), s[1], s[2]) for key, s in self.series.items()}
+
+        for label_value, (counts, total, count) in sorted(snapshot.items()):
+            labels = label_pairs(self.label, label_value)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{join_labels(labels, ("le", repr(float(bound))))}}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{join_labels(labels, ("le", "+Inf"))}}} {count}')
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+
+            for quantile, value in self.quantiles(label_value).items():
+                recent.append(f'{self.name}_recent{{{join_labels(labels, ("quantile", str(quantile)))}}} {value}')
+
+        return lines + recent
+
+
+class Counter:
+    """Monotonically increasing count, per label value"""
+    def __init__(self, name, help, label=None):
+        self.name = PREFIX + name
+        self.help = help
+        self.label = label
+        self.lock = Lock()
+        self.values = {}
+
+    def inc(self, amount=1, label_value=""):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_value, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(label_pairs(self.label, label_value))} {value}")
+        return lines
+
+
+class Gauge:
+    """Value that can go up and down, either set directly or read from a callback at scrape time"""
+    def __init__(self, name, help, callback=None):
+        self.name = PREFIX + name
+        self.help = help
+        self.callback = callback
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        value = self.callback() if self.callback is not None else self.value
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        # Registering a name again replaces the old metric
+        self.metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name, help, label=None, buckets=TIME_BUCKETS, window=1000):
+        return self.register(Histogram(name, help, label, buckets, window))
+
+    def counter(self, name, help, label=None):
+        return self.register(Counter(name, help, label))
+
+    def gauge(self, name, help, callback=None):
+        return self.register(Gauge(name, help, callback))
+
+    def render(self):
+        # Return all metrics in the Prometheus text exposition format
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class timer:
+    """Context manager that adds the time spent in its block to a stage"""
+    def __init__(self, stage, histogram=None):
+        self.stage = stage
+        self.histogram = histogram if histogram is not None else STAGE_SECONDS
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.stage)
+        return False
+
+
+def label_pairs(label, label_value):
+    return [(label, label_value)] if label is not None else []
+
+
+def join_labels(labels, extra):
+    return ",".join(f'{key}="{value}"' for key, value in labels + [extra])
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+### Default registry and pipeline metrics ###
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_seconds", "Time spent in each stage of the detection pipeline", label="stage")
+FRAME_SECONDS = REGISTRY.histogram(
+    "frame_seconds", "Time to process one frame once grabbed, up to the drawn overlay "
+    "(the wait for the frame is the grab stage of stage_seconds)")
+CARDS_PER_FRAME = REGISTRY.histogram(
+    "cards_per_frame", "Number of cards detected in a frame",
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20))
+FRAMES_PROCESSED = REGISTRY.counter(
+    "frames_processed_total", "Frames run through the detection pipeline")
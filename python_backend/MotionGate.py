@@ -0,0 +1,120 @@
+############## Motion gate ###############
+#
+# Most frames during a hand look exactly like the one before, so running the
+# whole detection pipeline on each of them is wasted work. The motion gate
+# runs before Cards.preprocess_image and compares a cheap signature of the
+# frame with the last processed one: the mean gray level of every block of a
+# coarse grid, computed from a bilinear thumbnail.
+#
+# Each frame gets one of three decisions:
+#   - "static": no block changed, so the previous detections, count and
+#     suggestion are reused as they are
+#   - "partial": some blocks changed, so only the cards in those regions are
+#     detected and recognized again
+#   - "full": too much changed (or it is time for a refresh), so the whole
+#     frame is processed
+#
+# The reference signature is only updated for blocks that were reprocessed,
+# so slow drifts below the threshold still add up and trigger eventually.
+
+# Import necessary packages
+import numpy as np
+import cv2
+import Metrics
+
+GATE_FRAMES = Metrics.REGISTRY.counter(
+    "motion_gate_frames_total", "Frames by motion gate decision", label="result")
+
+
+class MotionGate:
+    """Block-wise change detector between consecutive frames"""
+    def __init__(self, threshold=8, block_size=32, max_changed_fraction=0.5, refresh_interval=30):
+
+        self.threshold = threshold  # Change of a block's mean gray level that counts as motion
+        self.block_size = block_size  # Approximate block size, in pixels
+        self.max_changed_fraction = max_changed_fraction  # Above this, process the whole frame
+        self.refresh_interval = refresh_interval  # Process the whole frame at least this often, in frames
+
+        self.reference = None  # Block means of the processed frames
+        self.frame_shape = None
+        self.grid = (0, 0)  # Blocks across and down
+        self.changed = None  # Blocks that changed in the last checked frame
+        self.frames_since_full = 0
+
+        # Decision counts
+        self.static_frames = 0
+        self.partial_frames = 0
+        self.full_frames = 0
+
+    def signature(self, image):
+        # Mean gray level of every block, from a bilinear thumbnail with 4x4 samples per block
+        grid_w, grid_h = self.grid
+        thumb = cv2.resize(image, (grid_w * 4, grid_h * 4), interpolation=cv2.INTER_LINEAR)
+        if thumb.ndim == 3:
+            thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(thumb, (grid_w, grid_h), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def check(self, image):
+        # Return "static", "partial" or "full" for this frame, and update the reference
+        if image.shape != self.frame_shape:
+            # First frame, or the frame size changed
+            self.frame_shape = image.shape
+            img_h, img_w = image.shape[:2]
+            self.grid = (max(1, round(img_w / self.block_size)), max(1, round(img_h / self.block_size)))
+            self.reference = None
+
+        current = self.signature(image)
+        self.frames_since_full += 1
+
+        if self.reference is None or self.frames_since_full >= self.refresh_interval:
+            decision = "full"
+            self.changed = np.ones(current.shape, dtype=bool)
+        else:
+            self.changed = np.abs(current - self.reference) > self.threshold
+            changed_fraction = self.changed.mean()
+            if changed_fraction == 0:
+                decision = "static"
+            elif changed_fraction > self.max_changed_fraction:
+                decision = "full"
+            else:
+                decision = "partial"
+
+        if decision == "full":
+            self.reference = current
+            self.frames_since_full = 0
+            self.full_frames += 1
+        elif decision == "partial":
+            self.reference[self.changed] = current[self.changed]
+            self.partial_frames += 1
+        else:
+            self.static_frames += 1
+
+        GATE_FRAMES.inc(1, decision)
+        return decision
+
+    def block_rect(self, col0, row0, col1, row1):
+        # Pixel rectangle (x0, y0, x1, y1) covering blocks col0..col1-1 and row0..row1-1
+        img_h, img_w = self.frame_shape[:2]
+        grid_w, grid_h = self.grid
+        return (int(col0 * img_w / grid_w), int(row0 * img_h / grid_h),
+                int(np.ceil(col1 * img_w / grid_w)), int(np.ceil(row1 * img_h / grid_h)))
+
+    def changed_rect(self):
+        # Pixel rectangle (x0, y0, x1, y1) around every block that changed in the last frame, or None
+        rows, cols = np.nonzero(self.changed)
+        if len(rows) == 0:
+            return None
+        return self.block_rect(cols.min(), rows.min(), cols.max() + 1, rows.max() + 1)
+
+    def skip_ratio(self):
+        total = self.static_frames + self.partial_frames + self.full_frames
+        return self.static_frames / total if total else 0.0
+
+    def stats(self):
+        return {
+            "threshold": self.threshold,
+            "static_frames": self.static_frames,
+            "partial_frames": self.partial_frames,
+            "full_frames": self.full_frames,
+            "skip_ratio": round(self.skip_ratio(), 4),
+        }
@@ -1,8 +1,26 @@
 ### Takes a card picture and creates a top-down 200x300 flattened image
 ### of it. Isolates the suit and rank and saves the isolated images.
 ### Runs through A - K ranks and then the 4 suits.
+###
+### Interactive mode (the default) takes the pictures with a camera, one
+### rank or suit at a time. Batch mode builds the whole template set from a
+### directory of labeled card photos or videos, in parallel:
+###   python Rank_Suit_Isolator.py --batch photos/ --output Card_Imgs/
+### A file is labeled by its name and the names of the directories it is in,
+### e.g. photos/Ace/01.jpg, photos/Ace_of_Spades.jpg or photos/Hearts.mp4. A
+### card labeled with both a rank and a suit is a sample of each; a file
+### labeled with two ranks or two suits is reported as mislabeled and
+### skipped. Every sample goes through the same flatten, corner zoom,
+### threshold and crop steps as in interactive mode, the samples of each
+### rank and suit are combined into one template by a pixelwise median, and
+### quality stats of every template are written to quality.json next to them.
 
 # Import necessary packages
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import re
+import sys
 import cv2
 import numpy as np
 import time
@@ -23,208 +41,379 @@ SUIT_HEIGHT = 100
 # If using a USB Camera instead of a PiCamera, change PiOrUSB to 2
 PiOrUSB = 2
 
-if PiOrUSB == 1:
-    # Import packages from picamera library
-    from picamera.array import PiRGBArray
-    from picamera import PiCamera
+RANKS = ['Ace','Two','Three','Four','Five','Six','Seven','Eight',
+         'Nine','Ten','Jack','Queen','King']
+SUITS = ['Spades','Diamonds','Clubs','Hearts']
 
-    # Initialize PiCamera and grab reference to the raw capture
-    camera = PiCamera()
-    camera.resolution = (IM_WIDTH,IM_HEIGHT)
-    camera.framerate = 10
-    rawCapture = PiRGBArray(camera, size=(IM_WIDTH,IM_HEIGHT))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+# Label of each lowercase name a file or directory name can contain
+LABELS = {name.lower(): name for name in RANKS + SUITS}
+
+
+### ---- ISOLATION STEPS ---- ###
+def find_card(image):
+    """Finds the largest contour in the picture, assumed to be the card.
+    Returns its corner points, bounding width and height, or None."""
+
+    # Pre-process image
+    gray = cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(gray,(5,5),0)
+    retval, thresh = cv2.threshold(blur,100,255,cv2.THRESH_BINARY)
+
+    # Find contours and sort them by size
+    cnts,hier = cv2.findContours(thresh,cv2.RETR_TREE,cv2.CHAIN_APPROX_SIMPLE)
+    if len(cnts) == 0:
+        return None
+    card = max(cnts, key=cv2.contourArea)
+
+    # Approximate the corner points of the card
+    peri = cv2.arcLength(card,True)
+    approx = cv2.approxPolyDP(card,0.01*peri,True)
+    pts = np.float32(approx)
+
+    x,y,w,h = cv2.boundingRect(card)
+    return pts, w, h
+
+def corner_threshold(image, pts, w, h):
+    """Flattens the card and returns the thresholded, 4x zoomed corner."""
+
+    # Flatten the card and convert it to 200x300
+    warp = Cards.flattener(image,pts,w,h)
+
+    # Increase the width and height to capture more of the corner
+    corner = warp[0:100, 0:50]
+
+    corner_zoom = cv2.resize(corner, (0,0), fx=4, fy=4)
+    corner_blur = cv2.GaussianBlur(corner_zoom,(5, 5),0)
+    retval, corner_thresh = cv2.threshold(corner_blur, 155, 255, cv2. THRESH_BINARY_INV)
+
+    # Apply morphological opening to remove noise
+    kernel = np.ones((3, 3), np.uint8)
+    return cv2.morphologyEx(corner_thresh, cv2.MORPH_OPEN, kernel)
+
+def crop_largest(region, width, height):
+    """Crops the largest contour of a thresholded region and resizes it to
+    width x height. Returns the normalized image, or None if there is none."""
+
+    cnts, hier = cv2.findContours(region, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if len(cnts) == 0:
+        return None
+    x, y, w, h = cv2.boundingRect(max(cnts, key=cv2.contourArea))
+    sized = cv2.resize(region[y:y+h, x:x+w], (width, height), 0, 0)
+
+    # Normalize before saving
+    return cv2.normalize(sized, None, 0, 255, cv2.NORM_MINMAX)
+
+def isolate_rank(corner_thresh):
+    height, width = corner_thresh.shape[:2]
+    start_row = int(0.05 * height)
+    end_row = int(0.75 * height)
+    return crop_largest(corner_thresh[start_row:end_row, 0:width], RANK_WIDTH, RANK_HEIGHT)
+
+def isolate_suit(corner_thresh):
+    return crop_largest(corner_thresh[200:400, 0:200], SUIT_WIDTH, SUIT_HEIGHT) # Adjust these indices if necessary
+
+def isolate_label(corner_thresh, name):
+    """Crops the rank (if name is a rank) or suit from a thresholded corner.
+    Returns the isolated image, or None and the reason it failed."""
+
+    final_img = isolate_rank(corner_thresh) if name in RANKS else isolate_suit(corner_thresh)
+    if final_img is None:
+        return None, 'no contour in the %s image' % ('rank' if name in RANKS else 'suit')
+    return final_img, None
+
+def isolate(image, name):
+    """Runs all the steps on a picture of a card. Returns the isolated rank
+    (if name is a rank) or suit image, and the thresholded corner, or None
+    and the reason it failed."""
+
+    card = find_card(image)
+    if card is None:
+        return None, 'no card contour'
+    corner_thresh = corner_threshold(image, *card)
+    final_img, reason = isolate_label(corner_thresh, name)
+    if final_img is None:
+        return None, reason
+    return final_img, corner_thresh
+
+
+### ---- BATCH MODE ---- ###
+def file_labels(path, root):
+    """Ranks and suits a file is labeled with, by its name and the names of
+    the directories under root it is in. Raises ValueError if it is labeled
+    with more than one rank or more than one suit."""
+
+    relative = os.path.splitext(os.path.relpath(path, root))[0]
+    labels = []
+    for token in re.split(r'[\\/_\-\s.]+', relative.lower()):
+        label = LABELS.get(token)
+        if label is not None and label not in labels:
+            labels.append(label)
+
+    for kind, names in (('ranks', RANKS), ('suits', SUITS)):
+        conflicting = [label for label in labels if label in names]
+        if len(conflicting) > 1:
+            raise ValueError('labeled with more than one of the %s: %s' % (kind, ', '.join(conflicting)))
+    return labels
+
+def find_samples(root):
+    """Returns (path, labels) for every labeled photo and video under root,
+    and (path, reason) for every mislabeled one."""
+
+    samples = []
+    mislabeled = []
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for filename in sorted(files):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                labels = file_labels(path, root)
+            except ValueError as e:
+                mislabeled.append((path, str(e)))
+                continue
+            if labels:
+                samples.append((path, labels))
+    return samples, mislabeled
+
+def read_frames(path, video_step=10):
+    """Yields the picture of a photo, or every video_step-th frame of a video."""
+
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        image = cv2.imread(path)
+        if image is not None:
+            yield image
+        return
+
+    cap = cv2.VideoCapture(path)
+    index = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if index % video_step == 0:
+            yield frame
+        index += 1
+    cap.release()
 
-if PiOrUSB == 2:
-    # Initialize USB camera
-    cap = cv2.VideoCapture(0)
+def process_file(path, labels, video_step=10):
+    """Isolates the labeled ranks and suits in every frame of a file. The
+    card and its corner are found once per frame, then each label is cropped
+    from the same corner. Runs in a worker process. Returns a list of
+    (name, image or None, reason)."""
+
+    results = []
+    for image in read_frames(path, video_step):
+        card = find_card(image)
+        if card is None:
+            results += [(name, None, 'no card contour') for name in labels]
+            continue
+        corner_thresh = corner_threshold(image, *card)
+        for name in labels:
+            final_img, reason = isolate_label(corner_thresh, name)
+            results.append((name, final_img, reason))
+    if not results:
+        results = [(name, None, 'unreadable file') for name in labels]
+    return results
+
+def combine_samples(samples):
+    """Combines the isolated images of one rank or suit into a template:
+    the pixelwise median, thresholded and normalized like a single sample."""
+
+    median = np.median(np.stack(samples), axis=0).astype(np.uint8)
+    retval, template = cv2.threshold(median, 127, 255, cv2.THRESH_BINARY)
+    return cv2.normalize(template, None, 0, 255, cv2.NORM_MINMAX)
+
+def template_quality(names, templates, samples, width, height):
+    """Quality stats of a set of templates (ranks or suits). consistency is
+    the mean correlation of a template's samples with it; separation is how
+    much better its samples match it than the closest other template."""
+
+    rows = Cards.normalize_for_matching([templates.get(name) for name in names], width, height)
+    quality = {}
+    for index, name in enumerate(names):
+        if name not in templates:
+            continue
+        scores = np.clip(Cards.normalize_for_matching(samples[name], width, height) @ rows.T, -1, 1)
+        own = scores[:, index]
+        others = np.delete(scores, index, axis=1)
+        closest = int(np.argmax(others.mean(axis=0))) if others.shape[1] else None
+        quality[name] = {
+            'samples': len(samples[name]),
+            'consistency': round(float(own.mean()), 4),
+            'worst_sample': round(float(own.min()), 4),
+            'separation': round(float(np.mean(own - others.max(axis=1))), 4) if closest is not None else None,
+            'closest': [other for other in names if other != name][closest] if closest is not None else None,
+        }
+    return quality
+
+def build_templates(root, output, workers=None, video_step=10, min_samples=1):
+    """Builds the rank and suit templates from the labeled photos and videos
+    under root, on up to workers processes (one per CPU by default). Writes
+    them, and quality.json, to output. Returns the quality report."""
+
+    files, mislabeled = find_samples(root)
+    workers = workers or os.cpu_count() or 1
+
+    t_start = time.perf_counter()
+    jobs = [(path, labels, video_step) for path, labels in files]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            results = list(executor.map(process_file, *zip(*jobs), chunksize=max(1, len(jobs) // (4 * workers))))
+    else:
+        results = [process_file(*job) for job in jobs]
+    elapsed = time.perf_counter() - t_start
+
+    # Group the isolated images by rank and suit
+    samples = {name: [] for name in RANKS + SUITS}
+    failures = {name: {} for name in RANKS + SUITS}
+    for (path, labels), file_results in zip(files, results):
+        for name, final_img, reason in file_results:
+            if final_img is not None:
+                samples[name].append(final_img)
+            else:
+                failures[name][reason] = failures[name].get(reason, 0) + 1
+
+    templates = {name: combine_samples(imgs) for name, imgs in samples.items() if len(imgs) >= min_samples and imgs}
+
+    quality = template_quality(RANKS, templates, samples, RANK_WIDTH, RANK_HEIGHT)
+    quality.update(template_quality(SUITS, templates, samples, SUIT_WIDTH, SUIT_HEIGHT))
+    for name in RANKS + SUITS:
+        if name not in quality:
+            quality[name] = {'samples': len(samples[name])}
+        quality[name]['failed'] = failures[name]
+
+    os.makedirs(output, exist_ok=True)
+    for name, template in templates.items():
+        cv2.imwrite(os.path.join(output, name + '.jpg'), template)
+
+    report = {
+        'files': len(files),
+        'seconds': round(elapsed, 2),
+        'missing': [name for name in RANKS + SUITS if name not in templates],
+        'mislabeled': dict(mislabeled),
+        'templates': quality,
+    }
+    with open(os.path.join(output, 'quality.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+### ---- INTERACTIVE MODE ---- ###
+def interactive():
+    """Takes a picture of every rank and suit with the camera, one at a time."""
+
+    if PiOrUSB == 1:
+        # Import packages from picamera library
+        from picamera.array import PiRGBArray
+        from picamera import PiCamera
+
+        # Initialize PiCamera and grab reference to the raw capture
+        camera = PiCamera()
+        camera.resolution = (IM_WIDTH,IM_HEIGHT)
+        camera.framerate = 10
+        rawCapture = PiRGBArray(camera, size=(IM_WIDTH,IM_HEIGHT))
+
+    if PiOrUSB == 2:
+        # Initialize USB camera
+        cap = cv2.VideoCapture(0)
+
+    def close():
+        cv2.destroyAllWindows()
+        if PiOrUSB == 2:
+            cap.release()
+        if PiOrUSB == 1:
+            camera.close()
+
+    for Name in RANKS + SUITS:
+
+        filename = Name + '.jpg'
+        capture_successful = False  # Flag to indicate successful capture
+
+        while not capture_successful:
+            print('Press "p" to take a picture of ' + filename)
+
+            if PiOrUSB == 1: # PiCamera
+                rawCapture.truncate(0)
+                # Press 'p' to take a picture
+                for frame in camera.capture_continuous(rawCapture, format="bgr",use_video_port=True):
 
-# Use counter variable to switch from isolating Rank to isolating Suit
-i = 1
+                    image = frame.array
+                    cv2.imshow("Card",image)
+                    key = cv2.waitKey(1) & 0xFF
+                    if key == ord("p"):
+                        break
 
-for Name in ['Ace','Two','Three','Four','Five','Six','Seven','Eight',
-             'Nine','Ten','Jack','Queen','King','Spades','Diamonds',
-             'Clubs','Hearts']:
+                    rawCapture.truncate(0)
 
-    filename = Name + '.jpg'
-    capture_successful = False  # Flag to indicate successful capture
+            if PiOrUSB == 2: # USB camera
+                # Press 'p' to take a picture
+                while(True):
 
-    while not capture_successful:
-        print('Press "p" to take a picture of ' + filename)
+                    ret, frame = cap.read()
+                    cv2.imshow("Card",frame)
+                    key = cv2.waitKey(1) & 0xFF
+                    if key == ord("p"):
+                        image = frame
+                        break
 
-        if PiOrUSB == 1: # PiCamera
-            rawCapture.truncate(0)
-            # Press 'p' to take a picture
-            for frame in camera.capture_continuous(rawCapture, format="bgr",use_video_port=True):
+            # Flatten the card, then isolate the rank or suit
+            final_img, detail = isolate(image, Name)
 
-                image = frame.array
-                cv2.imshow("Card",image)
-                key = cv2.waitKey(1) & 0xFF
-                if key == ord("p"):
-                    break
+            if final_img is None:
+                print(f"Failed to isolate {filename}: {detail}!")
+                print('Press "r" to retry, or "q" to quit.')
+                key = cv2.waitKey(0) & 0xFF
+                if key == ord('q'):
+                    close()
+                    exit()
+                continue  # Retry capturing the image
 
-                rawCapture.truncate(0)
+            # Visualize the thresholded corner
+            cv2.imshow("Corner Threshold", detail)
+            cv2.imshow("Final Image",final_img)
 
-        if PiOrUSB == 2: # USB camera
-            # Press 'p' to take a picture
-            while(True):
-
-                ret, frame = cap.read()
-                cv2.imshow("Card",frame)
-                key = cv2.waitKey(1) & 0xFF
-                if key == ord("p"):
-                    image = frame
-                    break
-
-        # Pre-process image
-        gray = cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
-        blur = cv2.GaussianBlur(gray,(5,5),0)
-        retval, thresh = cv2.threshold(blur,100,255,cv2.THRESH_BINARY)
-
-        # Find contours and sort them by size
-        cnts,hier = cv2.findContours(thresh,cv2.RETR_TREE,cv2.CHAIN_APPROX_SIMPLE)
-        cnts = sorted(cnts, key=cv2.contourArea,reverse=True)
-
-        # Assume largest contour is the card. If there are no contours, print an error
-        flag = 0
-        image2 = image.copy()
-
-        if len(cnts) == 0:
-            print('No contours found!')
-            print('Press "r" to retry, or "q" to quit.')
+            # Save image, retry or quit
+            print('Press "c" to continue and save the image, "r" to retry, or "q" to quit.')
             key = cv2.waitKey(0) & 0xFF
-            if key == ord('r'):
-                continue  # Retry capturing the image
+            if key == ord('c'):
+                # Save image
+                cv2.imwrite(img_path + filename, final_img)
+                capture_successful = True  # Exit the while loop
             elif key == ord('q'):
-                cv2.destroyAllWindows()
-                if PiOrUSB == 2:
-                    cap.release()
-                if PiOrUSB == 1:
-                    camera.close()
+                close()
                 exit()
             else:
+                # Any other key, default to retry
                 continue
 
-        card = cnts[0]
-
-        # Approximate the corner points of the card
-        peri = cv2.arcLength(card,True)
-        approx = cv2.approxPolyDP(card,0.01*peri,True)
-        pts = np.float32(approx)
-
-        x,y,w,h = cv2.boundingRect(card)
-
-        # Flatten the card and convert it to 200x300
-        warp = Cards.flattener(image,pts,w,h)
-
-        # Increase the width and height to capture more of the corner
-        corner = warp[0:100, 0:50]
-
-        #corner_gray = cv2.cvtColor(corner,cv2.COLOR_BGR2GRAY)
-        corner_zoom = cv2.resize(corner, (0,0), fx=4, fy=4)
-        corner_blur = cv2.GaussianBlur(corner_zoom,(5, 5),0)
-        retval, corner_thresh = cv2.threshold(corner_blur, 155, 255, cv2. THRESH_BINARY_INV)
-
-        # Apply morphological opening to remove noise
-        kernel = np.ones((3, 3), np.uint8)
-        corner_thresh = cv2.morphologyEx(corner_thresh, cv2.MORPH_OPEN, kernel)
-
-        # Visualize the thresholded corner
-        cv2.imshow("Corner Threshold", corner_thresh)
-        # cv2.waitKey(0)
-
-        # Isolate suit or rank
-        if i <= 13: # Isolate rank
-            height, width = corner_thresh.shape[:2]
-            start_row = int(0.05 * height)
-            end_row = int(0.75 * height)
-            rank = corner_thresh[start_row:end_row, 0:width]
-            cv2.imshow("Rank Image", rank)
-            # cv2.waitKey(0)
-            rank_cnts, hier = cv2.findContours(rank, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-            rank_cnts = sorted(rank_cnts, key=cv2.contourArea, reverse=True)
-            if len(rank_cnts) > 0:
-                x, y, w, h = cv2.boundingRect(rank_cnts[0])
-                rank_roi = rank[y:y+h, x:x+w]
-                rank_sized = cv2.resize(rank_roi, (RANK_WIDTH, RANK_HEIGHT), 0, 0)
-                final_img = rank_sized
-                # Normalize before saving
-                final_img = cv2.normalize(final_img, None, 0, 255, cv2.NORM_MINMAX)
-            else:
-                print(f"No contours found in rank image for {filename}!")
-                print('Press "r" to retry, or "q" to quit.')
-                key = cv2.waitKey(0) & 0xFF
-                if key == ord('r'):
-                    continue  # Retry capturing the image
-                elif key == ord('q'):
-                    cv2.destroyAllWindows()
-                    if PiOrUSB == 2:
-                        cap.release()
-                    if PiOrUSB == 1:
-                        camera.close()
-                    exit()
-                else:
-                    continue
-
-        if i > 13: # Isolate suit
-            suit = corner_thresh[200:400, 0:200] # Adjust these indices if necessary
-            cv2.imshow("Suit Image", suit)
-            # cv2.waitKey(0)
-            suit_cnts, hier = cv2.findContours(suit, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-            suit_cnts = sorted(suit_cnts, key=cv2.contourArea, reverse=True)
-            if len(suit_cnts) > 0:
-                x, y, w, h = cv2.boundingRect(suit_cnts[0])
-                suit_roi = suit[y:y+h, x:x+w]
-                suit_sized = cv2.resize(suit_roi, (SUIT_WIDTH, SUIT_HEIGHT), 0, 0)
-                final_img = suit_sized
-                # Normalize before saving
-                final_img = cv2.normalize(final_img, None, 0, 255, cv2.NORM_MINMAX)
-            else:
-                print(f"No contours found in rank image for {filename}!")
-                print('Press "r" to retry, or "q" to quit.')
-                key = cv2.waitKey(0) & 0xFF
-                if key == ord('r'):
-                    continue  # Retry capturing the image
-                elif key == ord('q'):
-                    cv2.destroyAllWindows()
-                    if PiOrUSB == 2:
-                        cap.release()
-                    if PiOrUSB == 1:
-                        camera.close()
-                    exit()
-                else:
-                    continue
+    close()
 
 
-        cv2.imshow("Final Image",final_img)
+def main():
+    parser = argparse.ArgumentParser(description="Isolate the rank and suit train images, interactively with a camera "
+                                                 "or in batch from labeled photos and videos.")
+    parser.add_argument("--batch", metavar="DIR", help="directory of labeled card photos and videos to build the templates from")
+    parser.add_argument("--output", default=img_path, help="directory to write the templates and quality.json to (batch mode)")
+    parser.add_argument("--workers", type=int, help="processes to isolate the samples on; one per CPU by default")
+    parser.add_argument("--video-step", type=int, default=10, help="use every this many frames of a video as a sample")
+    parser.add_argument("--min-samples", type=int, default=1, help="fewest samples a template is built from")
+    args = parser.parse_args()
 
-        # Save image, retry or quit
-        print('Press "c" to continue and save the image, "r" to retry, or "q" to quit.')
-        key = cv2.waitKey(0) & 0xFF
-        if key == ord('c'):
-            # Save image
-            cv2.imwrite(img_path + filename, final_img)
-            capture_successful = True  # Exit the while loop
-        elif key == ord('r'):
-            # Retry: Go back to the start of the while loop
-            continue
-        elif key == ord('q'):
-            cv2.destroyAllWindows()
-            if PiOrUSB == 2:
-                cap.release()
-            if PiOrUSB == 1:
-                camera.close()
-            exit()
-        else:
-            # Any other key, default to retry
-            continue
+    if args.batch is None:
+        interactive()
+        return
 
-    i = i + 1
+    report = build_templates(args.batch, args.output, args.workers, args.video_step, args.min_samples)
+    print(json.dumps(report, indent=2))
 
-cv2.destroyAllWindows()
+    # Not every rank and suit got a template, or some files are mislabeled
+    if report['missing'] or report['mislabeled']:
+        sys.exit(1)
 
-# Release cap for USB cam
-if PiOrUSB == 2:
-    cap.release()
 
-if PiOrUSB == 1:
-    camera.close()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
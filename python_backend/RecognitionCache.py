@@ -0,0 +1,161 @@
+############## Per-track recognition cache ###############
+#
+# A card lying on the felt never changes identity, so once a track has been
+# recognized as the same rank and suit on a few frames in a row there is no
+# need to warp and match it again on every frame. The cache stores the
+# confirmed rank and suit of each track ID with a confidence score, and tells
+# CardDetector which cards can skip Cards.isolate_rank_suit and matching.
+#
+# A confirmed card is still re-verified every verify_interval frames, and
+# immediately if its contour moved or changed size noticeably since it was
+# last matched (picked up or flipped), or if its corner no longer looks like
+# it did then (a different card put in its place; see Cards.corner_signature).
+# CardDetector also drops the entries of tracks the tracker picked up again
+# after losing them, since a new card dealt where an old one lay takes its ID.
+# The frame clock advances on every processed frame, including the frames the
+# motion gate found unchanged, and CardDetector forces a re-match of the cards
+# in the changed part of a partially changed frame.
+
+# Import necessary packages
+import numpy as np
+import cv2
+import Cards
+import Metrics
+
+CACHE_LOOKUPS = Metrics.REGISTRY.counter(
+    "recognition_cache_total", "Recognition cache lookups of tracked cards", label="result")
+
+
+class CachedRecognition:
+    """Structure to store the recognition state of one track."""
+
+    def __init__(self):
+        self.rank = "Unknown"
+        self.suit = "Unknown"
+        self.suit_diff = None
+        self.rank_score = 0.0
+        self.suit_score = 0.0
+        self.streak = 0  # Consecutive matches agreeing with rank and suit
+        self.agree = 0  # Matches agreeing with the cached identity
+        self.disagree = 0  # Matches contradicting it, or unknown
+        self.confirmed = False
+        self.verified_frame = 0  # Frame number of the last match
+        self.center = (0, 0)  # Card center at the last match
+        self.area = 0.0  # Contour area at the last match
+        self.corner = None  # Corner signature at the last match
+
+    @property
+    def confidence(self):
+        # Fraction of matches that agreed with the cached identity
+        total = self.agree + self.disagree
+        return self.agree / total if total else 0.0
+
+
+class RecognitionCache:
+    """Confirmed rank and suit of each card track"""
+    def __init__(self, confirm_frames=3, verify_interval=15, max_shift=10, max_area_change=0.1,
+                 min_corner_correlation=0.85):
+
+        self.confirm_frames = confirm_frames  # Agreeing matches needed to confirm a track
+        self.verify_interval = verify_interval  # Re-match confirmed tracks this often, in frames
+        self.max_shift = max_shift  # Re-match if the center moved more than this, in pixels
+        self.max_area_change = max_area_change  # or if the area changed by more than this fraction
+        self.min_corner_correlation = min_corner_correlation  # or if its corner correlates less than this
+
+        self.entries = {}  # Track ID -> CachedRecognition
+        self.frame = 0
+
+    def next_frame(self):
+        # Advance the frame counter, once per processed frame
+        self.frame += 1
+
+    def is_due(self, track_id):
+        # True if the track is not confirmed, or its confirmed identity is due for re-verification
+        entry = self.entries.get(track_id)
+        return entry is None or not entry.confirmed or self.frame - entry.verified_frame >= self.verify_interval
+
+    def forget(self, track_ids):
+        # Drop the entries of tracks the tracker deleted
+        for track_id in track_ids:
+            self.entries.pop(track_id, None)
+
+    def lookup(self, qCard, image, force=False):
+        # Return the cached entry if qCard can skip matching this frame, else None.
+        # force re-verifies a confirmed card whatever its state.
+        entry = self.entries.get(qCard.id)
+        if entry is None or not entry.confirmed:
+            CACHE_LOOKUPS.inc(1, "miss")
+            return None
+
+        moved = np.hypot(qCard.center[0] - entry.center[0], qCard.center[1] - entry.center[1]) > self.max_shift
+        area = cv2.contourArea(qCard.contour)
+        resized = abs(area - entry.area) > self.max_area_change * max(entry.area, 1)
+        due = self.frame - entry.verified_frame >= self.verify_interval
+
+        if force or moved or resized or due:
+            CACHE_LOOKUPS.inc(1, "verify")
+            return None
+
+        # Checked last, as it is the only check that reads the image
+        if Cards.signature_correlation(entry.corner, Cards.corner_signature(qCard, image)) < self.min_corner_correlation:
+            CACHE_LOOKUPS.inc(1, "verify")
+            return None
+
+        CACHE_LOOKUPS.inc(1, "hit")
+        return entry
+
+    def confidence(self, track_id):
+        # Confidence of the track's identity, 0 for unknown tracks
+        entry = self.entries.get(track_id)
+        return entry.confidence if entry is not None else 0.0
+
+    def is_confirmed(self, track_id):
+        # True if the track's identity is confirmed
+        entry = self.entries.get(track_id)
+        return entry is not None and entry.confirmed
+
+    def identity(self, track_id):
+        # Confirmed (rank, suit) of the track, or None if it is not confirmed
+        entry = self.entries.get(track_id)
+        if entry is None or not entry.confirmed:
+            return None
+        return entry.rank, entry.suit
+
+    def update(self, qCard, image, rank, suit, suit_diff):
+        # Record a fresh match of qCard
+        entry = self.entries.get(qCard.id)
+        if entry is None:
+            entry = CachedRecognition()
+            self.entries[qCard.id] = entry
+
+        entry.verified_frame = self.frame
+        entry.center = tuple(qCard.center)
+        entry.area = cv2.contourArea(qCard.contour)
+        entry.corner = Cards.corner_signature(qCard, image)
+
+        if rank == "Unknown" or suit == "Unknown":
+            # Inconclusive; a confirmed track keeps its identity
+            entry.disagree += 1
+            if not entry.confirmed:
+                entry.streak = 0
+            return
+
+        if (rank, suit) == (entry.rank, entry.suit):
+            entry.agree += 1
+            entry.streak += 1
+        else:
+            # A different card: start over with the new identity
+            entry.rank, entry.suit = rank, suit
+            entry.agree, entry.disagree = 1, 0
+            entry.streak = 1
+            entry.confirmed = False
+
+        entry.suit_diff = suit_diff
+        entry.rank_score = qCard.rank_score
+        entry.suit_score = qCard.suit_score
+        if entry.streak >= self.confirm_frames:
+            entry.confirmed = True
+
+    def stats(self):
+        confirmed = sum(1 for entry in self.entries.values() if entry.confirmed)
+        return {"tracks": len(self.entries), "confirmed": confirmed}
@@ -0,0 +1,63 @@
+############## Parallel card recognition ###############
+#
+# Once a card's contour is known, warping it and matching its rank do not
+# depend on any other card, so the cards of a frame can be recognized at the
+# same time on several cores. The heavy work is inside OpenCV calls
+# (warpPerspective, findContours, ORB detectAndCompute, BFMatcher.match),
+# which release the GIL, so a thread pool is enough and the cards and the
+# frame are shared without copying.
+#
+# Each worker thread gets its own ORB detector and matcher (see
+# Cards.copy_rank_index); the train descriptors are shared. Results come back
+# in the order of the cards, so the output is the same as recognizing them
+# one after another.
+
+# Import necessary packages
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import os
+import Cards
+
+
+def cpu_count():
+    """Number of CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class RecognitionPool:
+    """Thread pool for the per-card warp and rank matching"""
+    def __init__(self, rank_index, workers=None):
+
+        # One thread per CPU unless told otherwise
+        self.workers = max(1, workers if workers is not None else cpu_count())
+        self.rank_index = rank_index
+        self.local = threading.local()  # Per-thread copy of the rank index
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="recognition")
+
+    def map(self, function, cards):
+        # Apply function to every card and return the results in order.
+        # A single card is not worth handing to another thread.
+        if len(cards) <= 1 or self.workers == 1:
+            return [function(card) for card in cards]
+        return list(self.executor.map(function, cards))
+
+    def isolate(self, cards, image):
+        # Cards.isolate_rank_suit on every card, in parallel
+        self.map(lambda card: Cards.isolate_rank_suit(card, image), cards)
+
+    def match_ranks(self, cards):
+        # Cards.match_rank_orb on every card, in parallel; usable as the
+        # rank_matcher of Cards.match_card_batch
+        return self.map(self.match_rank, cards)
+
+    def match_rank(self, card):
+        rank_index = getattr(self.local, "rank_index", None)
+        if rank_index is None:
+            rank_index = Cards.copy_rank_index(self.rank_index)
+            self.local.rank_index = rank_index
+        return Cards.match_rank_orb(card.rank_img, rank_index)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
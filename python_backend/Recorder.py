@@ -0,0 +1,401 @@
+############## Session recorder ###############
+#
+# Records what CardDetector.process_frame saw and decided, frame by frame, so
+# a session whose count went wrong can be read back and replayed.
+#
+# A session is a directory with up to three files:
+#
+#   records.log   append-only log: LOG_HEADER, then one record per frame.
+#                 A record is RECORD followed by one CARD per card on the table
+#   records.idx   one INDEX entry per record: frame id, ring slot of its frame
+#                 (-1 for none), offset of the record in the log, capture time
+#   frames.ring   optional memory-mapped ring of frames: RING_HEADER, then a
+#                 fixed number of slots, each SLOT_HEADER and the pixels of one
+#                 (downscaled) frame. The number of slots follows from the size
+#                 budget, and the oldest frames are overwritten first
+#
+# All integers are little-endian. Frame ids are the camera frame sequence
+# numbers, which only increase, so a record is found by binary search of the
+# index. Capture times are time.perf_counter() seconds; LOG_HEADER keeps the
+# wall clock and perf_counter time the session started, to convert them.
+#
+# The detection thread only copies (and downscales) the frame and queues it
+# with the frame's result. A background thread packs and writes the records,
+# and copies the frames into the ring. When the queue is full the record is
+# dropped and counted, rather than blocking detection.
+
+# Import necessary packages
+from threading import Thread
+import mmap
+import os
+import queue
+import struct
+import time
+import cv2
+import numpy as np
+import Metrics
+import FrameProtocol
+import Tracker
+from Shoe import RANKS, SUITS, RANK_INDEX, SUIT_INDEX
+
+FORMAT_VERSION = 1
+
+LOG_FILE = "records.log"
+INDEX_FILE = "records.idx"
+RING_FILE = "frames.ring"
+
+# magic, version, flags, number of decks, session start (wall clock), session start (perf_counter)
+LOG_MAGIC = b"DDRL"
+LOG_HEADER = struct.Struct("<4sBBHdd")
+
+# record length (with its cards), frame id, capture time, true count, running count,
+# suggestion code (FrameProtocol.SUGGESTIONS), flags, number of cards
+RECORD = struct.Struct("<IIdhhBBH")
+RECORD_ANNOTATED = 1
+
+# track id, rank index, suit index (Shoe.RANKS, Shoe.SUITS; UNKNOWN if not known),
+# track state (TRACK_STATES), identity confidence in 1/255, center x, center y
+CARD = struct.Struct("<IBBBBhh")
+UNKNOWN = 255
+TRACK_STATES = [None, Tracker.TENTATIVE, Tracker.CONFIRMED, Tracker.LOST]
+TRACK_STATE_CODES = {state: code for code, state in enumerate(TRACK_STATES)}
+
+# frame id, ring slot (-1 for none), record offset in the log, capture time
+INDEX = struct.Struct("<IiQd")
+INDEX_DTYPE = np.dtype([("frame_id", "<u4"), ("slot", "<i4"), ("offset", "<u8"), ("capture_time", "<f8")])
+
+# magic, version, number of slots, frame height, width, channels
+RING_MAGIC = b"DDFR"
+RING_HEADER = struct.Struct("<4sB3xIIII")
+
+# frame id, valid flag, capture time
+SLOT_HEADER = struct.Struct("<IB3xd")
+
+RECORDS_WRITTEN = Metrics.REGISTRY.counter(
+    "recorder_records_total", "Frame records handled by the session recorder", label="result")
+
+
+class Recorder:
+    """Background writer of a session's frame records and, optionally, frames"""
+    def __init__(self, directory, number_of_decks=1, frame_budget_mb=0, frame_width=640, queue_size=256,
+                 flush_interval=1.0):
+
+        self.directory = directory
+        self.number_of_decks = number_of_decks
+
+        # Size of the frame ring in MB, 0 to record no frames. Frames are
+        # downscaled to frame_width, or recorded at full size if it is 0.
+        self.frame_budget = int(frame_budget_mb * 1024 * 1024)
+        self.frame_width = frame_width
+
+        # Seconds between flushes of the log and index to disk
+        self.flush_interval = flush_interval
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stopped = False
+        self.thread = None
+
+        self.log_file = None
+        self.index_file = None
+        self.log_offset = 0
+
+        # Frame ring, created when the first frame arrives
+        self.ring_file = None
+        self.ring = None
+        self.slots = 0
+        self.slot_shape = None
+        self.slot_size = 0
+
+        # Statistics
+        self.records_written = 0
+        self.records_dropped = 0
+        self.frames_written = 0
+        self.bytes_written = 0
+
+    def start(self):
+        # Create the session files and start the writer thread
+        os.makedirs(self.directory, exist_ok=True)
+        self.log_file = open(os.path.join(self.directory, LOG_FILE), "xb")
+        self.index_file = open(os.path.join(self.directory, INDEX_FILE), "xb")
+        header = LOG_HEADER.pack(LOG_MAGIC, FORMAT_VERSION, 0, self.number_of_decks, time.time(), time.perf_counter())
+        self.log_file.write(header)
+        self.log_offset = len(header)
+
+        self.stopped = False
+        self.thread = Thread(target=self.update, args=(), daemon=True)
+        self.thread.start()
+        return self
+
+    def snapshot(self, image):
+        """
+        Returns the copy of a frame to record with its result, downscaled to
+        frame_width, or None if frames are not recorded. Called on the
+        detection thread, before anything is drawn on the frame.
+        """
+        if self.frame_budget <= 0:
+            return None
+        height, width = image.shape[:2]
+        if not self.frame_width or self.frame_width >= width:
+            return image.copy()
+        scale = self.frame_width / width
+        return cv2.resize(image, (self.frame_width, max(1, int(round(height * scale)))), interpolation=cv2.INTER_AREA)
+
+    def record(self, result, capture_time, frame=None):
+        """
+        Queues a frame result (CardDetector.last_result), its capture time and
+        its frame (see snapshot) for writing. Never blocks.
+        """
+        try:
+            self.queue.put_nowait((result, capture_time, frame))
+        except queue.Full:
+            self.records_dropped += 1
+            RECORDS_WRITTEN.inc(1, "dropped")
+
+    def update(self):
+        # Writer thread: write the queued records, flushing now and then
+        last_flush = time.perf_counter()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+
+            if item is not None:
+                self.write(*item)
+
+            now = time.perf_counter()
+            if now - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = now
+
+            if self.stopped and self.queue.empty():
+                break
+
+        self.flush()
+
+    def write(self, result, capture_time, frame):
+        # Append one record to the log and the index, and its frame to the ring
+        slot = -1
+        if frame is not None:
+            slot = self.write_frame(result["frame_seq"], capture_time, frame)
+
+        record = pack_record(result, capture_time)
+        self.log_file.write(record)
+        self.index_file.write(INDEX.pack(result["frame_seq"] & 0xFFFFFFFF, slot, self.log_offset, capture_time))
+        self.log_offset += len(record)
+
+        self.records_written += 1
+        self.bytes_written += len(record) + INDEX.size
+        RECORDS_WRITTEN.inc(1, "written")
+
+    def write_frame(self, frame_id, capture_time, frame):
+        # Copy a frame into the next ring slot and return the slot, or -1 if it does not fit
+        if self.ring is None and not self.open_ring(frame.shape):
+            self.frame_budget = 0  # Not even one frame fits the budget
+            return -1
+
+        if frame.shape != self.slot_shape:
+            frame = cv2.resize(frame, (self.slot_shape[1], self.slot_shape[0]), interpolation=cv2.INTER_AREA)
+            if frame.ndim == 2:
+                frame = frame[:, :, None]
+
+        slot = self.frames_written % self.slots
+        start = RING_HEADER.size + slot * self.slot_size
+        pixels = start + SLOT_HEADER.size
+
+        # Invalidate the slot while it is being overwritten
+        self.ring[start:pixels] = SLOT_HEADER.pack(0, 0, 0.0)
+        self.ring[pixels:pixels + frame.nbytes] = np.ascontiguousarray(frame).tobytes()
+        self.ring[start:pixels] = SLOT_HEADER.pack(frame_id & 0xFFFFFFFF, 1, capture_time)
+
+        self.frames_written += 1
+        return slot
+
+    def open_ring(self, shape):
+        # Create the frame ring with as many slots of the given frame shape as the budget allows
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) > 2 else 1
+        self.slot_shape = (height, width, channels) if len(shape) > 2 else (height, width)
+        self.slot_size = SLOT_HEADER.size + height * width * channels
+        self.slots = (self.frame_budget - RING_HEADER.size) // self.slot_size
+        if self.slots <= 0:
+            return False
+
+        size = RING_HEADER.size + self.slots * self.slot_size
+        self.ring_file = open(os.path.join(self.directory, RING_FILE), "x+b")
+        self.ring_file.truncate(size)
+        self.ring = mmap.mmap(self.ring_file.fileno(), size)
+        self.ring[:RING_HEADER.size] = RING_HEADER.pack(RING_MAGIC, FORMAT_VERSION, self.slots, height, width, channels)
+        return True
+
+    def flush(self):
+        if self.log_file is not None:
+            self.log_file.flush()
+            self.index_file.flush()
+
+    def stop(self):
+        # Write what is queued, then close the files
+        self.stopped = True
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        if self.ring is not None:
+            self.ring.flush()
+            self.ring.close()
+            self.ring_file.close()
+            self.ring = None
+        if self.log_file is not None:
+            self.log_file.close()
+            self.index_file.close()
+            self.log_file = None
+
+    def stats(self):
+        return {
+            "directory": self.directory,
+            "records_written": self.records_written,
+            "records_dropped": self.records_dropped,
+            "frames_written": self.frames_written,
+            "frame_slots": self.slots,
+            "bytes_written": self.bytes_written,
+            "queued": self.queue.qsize(),
+        }
+
+
+def pack_record(result, capture_time):
+    """Packs a frame result (CardDetector.last_result) as a log record."""
+    cards = result.get("cards", [])
+    suggestion = FrameProtocol.SUGGESTION_CODES.get(result.get("suggestion", ""), FrameProtocol.SUGGESTION_OTHER)
+    parts = [RECORD.pack(
+        RECORD.size + len(cards) * CARD.size,
+        result["frame_seq"] & 0xFFFFFFFF,
+        capture_time,
+        clamp16(result.get("true_count", 0)),
+        clamp16(result.get("running_count", 0)),
+        suggestion,
+        RECORD_ANNOTATED if result.get("annotated") else 0,
+        len(cards),
+    )]
+    for card in cards:
+        x, y = card["center"]
+        parts.append(CARD.pack(
+            card["id"] & 0xFFFFFFFF,
+            RANK_INDEX.get(card["rank"], UNKNOWN),
+            SUIT_INDEX.get(card["suit"], UNKNOWN),
+            TRACK_STATE_CODES.get(card.get("state"), 0),
+            int(round(min(max(card.get("confidence", 0.0), 0.0), 1.0) * 255)),
+            clamp16(x),
+            clamp16(y),
+        ))
+    return b"".join(parts)
+
+
+def unpack_record(data, offset=0):
+    """Returns the frame result dict of the record at offset in data."""
+    (length, frame_id, capture_time, true_count, running_count,
+     suggestion, flags, card_count) = RECORD.unpack_from(data, offset)
+    cards = []
+    for position in range(offset + RECORD.size, offset + RECORD.size + card_count * CARD.size, CARD.size):
+        track_id, rank, suit, state, confidence, x, y = CARD.unpack_from(data, position)
+        cards.append({
+            "id": track_id,
+            "rank": RANKS[rank] if rank < len(RANKS) else "Unknown",
+            "suit": SUITS[suit] if suit < len(SUITS) else "Unknown",
+            "state": TRACK_STATES[state] if state < len(TRACK_STATES) else None,
+            "confidence": round(confidence / 255, 3),
+            "center": [x, y],
+        })
+    return {
+        "frame_seq": frame_id,
+        "capture_time": capture_time,
+        "annotated": bool(flags & RECORD_ANNOTATED),
+        "cards": cards,
+        "running_count": running_count,
+        "true_count": true_count,
+        "suggestion": FrameProtocol.SUGGESTIONS[suggestion] if suggestion < len(FrameProtocol.SUGGESTIONS) else "",
+    }
+
+
+def clamp16(value):
+    return max(-32768, min(32767, int(value)))
+
+
+class Recording:
+    """Read access to a recorded session, by frame id or in order"""
+    def __init__(self, directory):
+
+        self.directory = directory
+
+        # The log is memory-mapped, so only the records read are loaded
+        with open(os.path.join(directory, LOG_FILE), "rb") as log_file:
+            self.log = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.number_of_decks, self.started_wall, self.started_perf = LOG_HEADER.unpack_from(self.log)
+        if magic != LOG_MAGIC or version != FORMAT_VERSION:
+            raise ValueError("%s is not a version %d session log" % (directory, FORMAT_VERSION))
+
+        # Index entries whose record was not completely written (the recorder
+        # stopped abruptly) are ignored
+        index = np.fromfile(os.path.join(directory, INDEX_FILE), dtype=INDEX_DTYPE)
+        complete = len(index)
+        while complete > 0 and not self.is_complete(int(index["offset"][complete - 1])):
+            complete -= 1
+        self.index = index[:complete]
+
+        # Frame ids are increasing, so lookups are a binary search
+        self.frame_ids = self.index["frame_id"]
+        if np.any(np.diff(self.frame_ids.astype(np.int64)) <= 0):
+            raise ValueError("%s has frame ids out of order" % directory)
+
+        self.frames = None
+        ring_path = os.path.join(directory, RING_FILE)
+        if os.path.exists(ring_path):
+            with open(ring_path, "rb") as ring_file:
+                magic, version, slots, height, width, channels = RING_HEADER.unpack(ring_file.read(RING_HEADER.size))
+            if magic != RING_MAGIC or version != FORMAT_VERSION:
+                raise ValueError("%s is not a version %d frame ring" % (ring_path, FORMAT_VERSION))
+            self.frame_shape = (height, width, channels) if channels > 1 else (height, width)
+            self.frames = np.memmap(ring_path, dtype=np.uint8, mode="r", offset=RING_HEADER.size,
+                                    shape=(slots, SLOT_HEADER.size + height * width * channels))
+
+    def is_complete(self, offset):
+        # True if the whole record at offset is in the log
+        if offset + RECORD.size > len(self.log):
+            return False
+        return offset + RECORD.unpack_from(self.log, offset)[0] <= len(self.log)
+
+    def __len__(self):
+        return len(self.index)
+
+    def position(self, frame_id):
+        # Position of a frame id in the index
+        position = int(np.searchsorted(self.frame_ids, frame_id))
+        if position == len(self.frame_ids) or self.frame_ids[position] != frame_id:
+            raise KeyError(frame_id)
+        return position
+
+    def record(self, frame_id):
+        """Returns the frame result recorded for a frame id."""
+        return unpack_record(self.log, int(self.index["offset"][self.position(frame_id)]))
+
+    def frame(self, frame_id):
+        """
+        Returns the recorded frame of a frame id, or None if no frame was
+        recorded or it has been overwritten in the ring since.
+        """
+        slot = int(self.index["slot"][self.position(frame_id)])
+        if slot < 0 or self.frames is None:
+            return None
+        data = self.frames[slot]
+        slot_frame_id, valid, _ = SLOT_HEADER.unpack(data[:SLOT_HEADER.size].tobytes())
+        if not valid or slot_frame_id != frame_id:
+            return None
+        return np.array(data[SLOT_HEADER.size:]).reshape(self.frame_shape)
+
+    def __iter__(self):
+        # Frame results in the order they were recorded
+        for offset in self.index["offset"]:
+            yield unpack_record(self.log, int(offset))
+
+    def wall_time(self, capture_time):
+        # Wall clock time of a recorded capture time
+        return self.started_wall + (capture_time - self.started_perf)
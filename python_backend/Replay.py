@@ -0,0 +1,311 @@
+############## Session replay and regression check ###############
+#
+# Feeds the frames of recorded sessions (see Recorder) through CardDetector
+# again and compares the results, frame by frame, with golden results: the
+# cards found (by rank and suit), the true and running count, and the
+# suggestion. Throughput is reported with the differences, so a change to
+# the matching or its thresholds in Cards.py can be checked for accuracy and
+# speed on real footage.
+#
+# Replays are deterministic: frames are read on demand, never dropped, and
+# stamped with their recorded frame ids and capture times instead of the
+# clock, and cards are recognized on the calling thread.
+#
+# The golden results of a session are kept in its golden/ directory, in the
+# Recorder log format, with the throughput in golden/summary.json. Write them
+# with --update-golden. Sessions without golden results are compared with
+# the results recorded live, so a session where the count went wrong can be
+# checked for the frames that differ.
+#
+# Only frames still in the session's frame ring are replayed. Cards.py
+# expects full size frames, so sessions to replay should be recorded with
+# DD_RECORD_FRAME_WIDTH=0; downscaled frames are scaled back up to --width.
+#
+# Run from the python_backend directory:
+#   python Replay.py recordings/ --workers 4 --tolerance 0.01
+#
+# Exits with status 1 if any session regressed: a larger fraction of frames
+# differs than --tolerance, or, with --speed-tolerance, the frame rate fell by
+# more than that fraction of the golden frame rate.
+
+# Import necessary packages
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import cv2
+import FrameSource
+import Recorder
+from CardDetector import CardDetector
+
+GOLDEN_DIR = "golden"
+GOLDEN_SUMMARY = "summary.json"
+
+# Frames with differences listed in a session's report, at most
+MAX_EXAMPLES = 10
+
+
+class RecordingSource(FrameSource.FrameSource):
+    """Frames of a recorded session, stamped with their recorded frame ids and capture times"""
+    def __init__(self, recording, size=None):
+
+        self.recording = recording
+        self.size = size  # (width, height) to scale the frames to, or None to keep them
+        self.frame_ids = [int(frame_id) for frame_id in recording.frame_ids]
+        self.index = 0
+        self.current_id = 0
+
+        super().__init__(realtime=False)
+
+    def next_frame(self):
+        # Next recorded frame still in the ring
+        frame = None
+        while frame is None:
+            if self.index >= len(self.frame_ids):
+                return None
+            self.current_id = self.frame_ids[self.index]
+            self.index += 1
+            frame = self.recording.frame(self.current_id)
+        if self.size is not None and (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_LINEAR)
+        return frame
+
+    def rewind(self):
+        self.index = 0
+
+    def publish(self, frame):
+        # Deterministic clock: the recorded frame id and capture time, not the current time
+        with self.condition:
+            self.frame = frame
+            self.frame_seq = self.current_id
+            self.frame_time = float(self.recording.index["capture_time"][self.recording.position(self.current_id)])
+            self.frames_captured += 1
+            self.condition.notify_all()
+
+
+def normalize(result, capture_time):
+    # Round trip a frame result through the log format, so it compares with recorded ones
+    return Recorder.unpack_record(Recorder.pack_record(result, capture_time))
+
+
+def compare_frame(golden, replayed):
+    """
+    Returns the differences between a golden and a replayed frame result,
+    as a dict (empty if they match).
+    """
+    differences = {}
+
+    golden_cards = Counter((card["rank"], card["suit"]) for card in golden["cards"])
+    replayed_cards = Counter((card["rank"], card["suit"]) for card in replayed["cards"])
+    missing = golden_cards - replayed_cards
+    extra = replayed_cards - golden_cards
+    if missing:
+        differences["missing_cards"] = sorted("%s of %s" % card for card in missing.elements())
+    if extra:
+        differences["extra_cards"] = sorted("%s of %s" % card for card in extra.elements())
+
+    for key in ("true_count", "running_count", "suggestion"):
+        if golden[key] != replayed[key]:
+            differences[key] = [golden[key], replayed[key]]
+    return differences
+
+
+def replay_session(directory, size=(1280, 720), detect_scale=1.0):
+    """
+    Replays the recorded frames of a session through CardDetector. Returns
+    the normalized frame results, by frame id, and the replay's frame rate.
+    """
+    recording = Recorder.Recording(directory)
+    source = RecordingSource(recording, size).start()
+    card_detector = CardDetector(source, IM_WIDTH=size[0], IM_HEIGHT=size[1],
+                                 number_of_decks=recording.number_of_decks, detect_scale=detect_scale)
+
+    results = {}
+    frame_seconds = 0.0
+    try:
+        while True:
+            t_start = time.perf_counter()
+            image, _, _ = card_detector.process_frame()
+            if image is None:
+                break
+            frame_seconds += time.perf_counter() - t_start
+            results[card_detector.frame_seq] = normalize(card_detector.last_result, card_detector.capture_time)
+            card_detector.release_frame()
+    finally:
+        card_detector.close()
+        source.stop()
+
+    fps = len(results) / frame_seconds if frame_seconds > 0 else 0.0
+    return results, fps
+
+
+def load_golden(directory):
+    # Golden results of a session and their summary, or the recorded results if it has none
+    golden_path = os.path.join(directory, GOLDEN_DIR)
+    if not os.path.isdir(golden_path):
+        return Recorder.Recording(directory), {}, "recording"
+
+    summary = {}
+    summary_path = os.path.join(golden_path, GOLDEN_SUMMARY)
+    if os.path.exists(summary_path):
+        with open(summary_path) as f:
+            summary = json.load(f)
+    return Recorder.Recording(golden_path), summary, "golden"
+
+
+def save_golden(directory, results, fps, number_of_decks):
+    # Replace the golden results of a session with the replayed ones
+    golden_path = os.path.join(directory, GOLDEN_DIR)
+    temporary_path = golden_path + ".tmp"
+    shutil.rmtree(temporary_path, ignore_errors=True)
+
+    recorder = Recorder.Recorder(temporary_path, number_of_decks, queue_size=len(results) + 1).start()
+    for frame_id in sorted(results):
+        result = results[frame_id]
+        recorder.record(result, result["capture_time"])
+    recorder.stop()
+    with open(os.path.join(temporary_path, GOLDEN_SUMMARY), "w") as f:
+        json.dump({"frames": len(results), "fps": round(fps, 2)}, f, indent=2)
+
+    shutil.rmtree(golden_path, ignore_errors=True)
+    os.replace(temporary_path, golden_path)
+
+
+def check_session(directory, size=(1280, 720), detect_scale=1.0, tolerance=0.0, speed_tolerance=None,
+                  update_golden=False):
+    """
+    Replays a session and compares it with its golden results. Returns the
+    session's report as a dict; "regression" is True if it got worse beyond
+    the tolerances.
+    """
+    recording = Recorder.Recording(directory)
+    results, fps = replay_session(directory, size, detect_scale)
+
+    if update_golden:
+        save_golden(directory, results, fps, recording.number_of_decks)
+
+    golden, summary, golden_source = load_golden(directory)
+
+    differing = 0
+    card_errors = 0
+    golden_cards = 0
+    mismatches = Counter()
+    examples = []
+    compared = 0
+    for frame_id in sorted(results):
+        try:
+            expected = golden.record(frame_id)
+        except KeyError:
+            continue
+        compared += 1
+        golden_cards += len(expected["cards"])
+
+        differences = compare_frame(expected, results[frame_id])
+        if not differences:
+            continue
+        differing += 1
+        card_errors += len(differences.get("missing_cards", [])) + len(differences.get("extra_cards", []))
+        mismatches.update(differences.keys())
+        if len(examples) < MAX_EXAMPLES:
+            examples.append(dict(frame_id=frame_id, **differences))
+
+    differing_fraction = differing / compared if compared else 0.0
+    golden_fps = summary.get("fps")
+
+    regression = differing_fraction > tolerance
+    if speed_tolerance is not None and golden_fps:
+        regression = regression or fps < golden_fps * (1 - speed_tolerance)
+
+    return {
+        "session": directory,
+        "golden": golden_source,
+        "frames_recorded": len(recording),
+        "frames_replayed": len(results),
+        "frames_compared": compared,
+        "frames_differing": differing,
+        "differing_fraction": round(differing_fraction, 4),
+        "card_errors": card_errors,
+        "card_error_rate": round(card_errors / golden_cards, 4) if golden_cards else 0.0,
+        "mismatches": dict(mismatches),
+        "fps": round(fps, 2),
+        "golden_fps": golden_fps,
+        "regression": regression,
+        "examples": examples,
+    }
+
+
+def find_sessions(paths):
+    """Session directories among the given paths, searching directories recursively."""
+    sessions = []
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(name for name in dirs if name not in (GOLDEN_DIR, GOLDEN_DIR + ".tmp"))
+            if Recorder.LOG_FILE in files and Recorder.RING_FILE in files:
+                sessions.append(root)
+    return sessions
+
+
+def run_corpus(paths, workers=None, **options):
+    """
+    Checks every session found in paths, on up to workers processes (one
+    per CPU by default). Returns the reports of all sessions as a dict.
+    """
+    sessions = find_sessions(paths)
+    workers = workers or os.cpu_count() or 1
+
+    t_start = time.perf_counter()
+    if workers > 1 and len(sessions) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(sessions))) as executor:
+            futures = [executor.submit(check_session, session, **options) for session in sessions]
+            reports = [future.result() for future in futures]
+    else:
+        reports = [check_session(session, **options) for session in sessions]
+    elapsed = time.perf_counter() - t_start
+
+    frames = sum(report["frames_replayed"] for report in reports)
+    return {
+        "sessions": len(reports),
+        "regressions": sum(report["regression"] for report in reports),
+        "frames_replayed": frames,
+        "frames_differing": sum(report["frames_differing"] for report in reports),
+        "seconds": round(elapsed, 2),
+        "frames_per_second": round(frames / elapsed, 2) if elapsed > 0 else 0.0,
+        "reports": reports,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded sessions and compare them with their golden results.")
+    parser.add_argument("paths", nargs="+", help="session directories, or directories to search for sessions")
+    parser.add_argument("--workers", type=int, help="processes to replay the sessions on; one per CPU by default")
+    parser.add_argument("--width", type=int, default=1280, help="frame width the detector runs at")
+    parser.add_argument("--height", type=int, default=720, help="frame height the detector runs at")
+    parser.add_argument("--detect-scale", type=float, default=1.0, help="search for cards on the frame downscaled by this factor")
+    parser.add_argument("--tolerance", type=float, default=0.0,
+                        help="largest fraction of frames that may differ from the golden results")
+    parser.add_argument("--speed-tolerance", type=float,
+                        help="largest fraction the frame rate may fall below the golden frame rate; not checked by default")
+    parser.add_argument("--update-golden", action="store_true", help="store the replayed results as the golden results")
+    parser.add_argument("--output", help="file to write the JSON results to")
+    args = parser.parse_args()
+
+    results = run_corpus(args.paths, args.workers, size=(args.width, args.height), detect_scale=args.detect_scale,
+                         tolerance=args.tolerance, speed_tolerance=args.speed_tolerance,
+                         update_golden=args.update_golden)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+    if results["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
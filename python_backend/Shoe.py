@@ -0,0 +1,124 @@
+############## Shoe composition ###############
+#
+# Keeps track of the cards left in the shoe as a 13x4 integer array of
+# remaining cards per rank and suit, with decks remaining, penetration and
+# the count of every enabled counting system (see Counting). Counting a card
+# is O(1): the cards counted during a frame are queued and added to the counts
+# in one pass by update_counts().
+#
+# Cards are counted once per tracker ID and identity, so in a multi-deck shoe
+# every copy of a card counts, each under its own ID. The tracker can pick up
+# a card dealt where an old one lay under the old card's ID, so a track that
+# comes to show a different rank or suit is counted again. A card is only
+# counted while its rank and suit are left in the shoe: once all copies of,
+# say, the Ace of Spades are counted, another one is taken for a card that
+# lost its track and came back under a new ID, and is not counted again.
+#
+# The IDs of tracks the tracker deleted are forgotten (IDs are never reused),
+# so the counted IDs stay as few as the cards on the table. reset() starts a
+# new shoe after a reshuffle.
+
+# Import necessary packages
+import numpy as np
+from Counting import Counter, PRIMARY_SYSTEM
+
+RANKS = ['Ace', 'Two', 'Three', 'Four', 'Five', 'Six', 'Seven',
+         'Eight', 'Nine', 'Ten', 'Jack', 'Queen', 'King']
+SUITS = ['Spades', 'Diamonds', 'Clubs', 'Hearts']
+
+RANK_INDEX = {rank: index for index, rank in enumerate(RANKS)}
+SUIT_INDEX = {suit: index for index, suit in enumerate(SUITS)}
+
+
+class Shoe:
+    """Remaining cards of the shoe, and the count"""
+    def __init__(self, number_of_decks=1, counting_systems=(PRIMARY_SYSTEM,)):
+
+        self.number_of_decks = number_of_decks
+        self.total_cards = number_of_decks * len(RANKS) * len(SUITS)
+        self.remaining = np.zeros((len(RANKS), len(SUITS)), dtype=np.int16)  # Cards left per rank and suit
+        self.counted = {}  # Tracker ID -> (rank, suit) the card on the table was counted as
+        self.counter = Counter(counting_systems, number_of_decks)
+        self.new_ranks = []  # Rank indices of the cards counted since the last update_counts()
+        self.shoes_started = 0
+        self.reset()
+
+    def reset(self):
+        # Start a new shoe, after a reshuffle
+        self.remaining[:] = self.number_of_decks
+        self.counted.clear()
+        self.counter.reset()
+        self.new_ranks.clear()
+        self.cards_seen = 0
+        self.duplicates = 0  # Cards not counted because none of them were left
+        self.shoes_started += 1
+
+    def count_card(self, track_id, rank, suit):
+        """
+        Counts the card with the given tracker ID, rank and suit, unless its
+        track was counted already as this rank and suit or no card of its rank
+        and suit is left. Returns True if the card was counted.
+        """
+        if self.counted.get(track_id) == (rank, suit):
+            return False
+        rank_index = RANK_INDEX.get(rank)
+        suit_index = SUIT_INDEX.get(suit)
+        if rank_index is None or suit_index is None:
+            return False
+
+        self.counted[track_id] = (rank, suit)
+        if self.remaining[rank_index, suit_index] == 0:
+            self.duplicates += 1
+            return False
+
+        self.remaining[rank_index, suit_index] -= 1
+        self.new_ranks.append(rank_index)
+        self.cards_seen += 1
+        return True
+
+    def update_counts(self):
+        # Add the cards counted since the last call to every system's count
+        self.counter.update(self.new_ranks)
+        self.new_ranks.clear()
+
+    @property
+    def running_count(self):
+        # Hi-Lo running count, which the strategy's deviations go by
+        return int(self.counter.running_count())
+
+    def forget(self, track_ids):
+        # Drop the IDs of deleted tracks; they will not be seen again
+        for track_id in track_ids:
+            self.counted.pop(track_id, None)
+
+    def decks_remaining(self):
+        return (self.total_cards - self.cards_seen) / 52
+
+    def true_count(self):
+        # Hi-Lo true count, as reported in counts(); 0 once the shoe is used up
+        return self.counter.true_count(self.decks_remaining())
+
+    def penetration(self):
+        # Fraction of the shoe dealt
+        return self.cards_seen / self.total_cards
+
+    def counts(self):
+        # Running and true counts of the enabled counting systems
+        return self.counter.counts(self.decks_remaining())
+
+    def snapshot(self):
+        # Copy of the remaining cards per rank and suit
+        return self.remaining.copy()
+
+    def stats(self):
+        return {
+            "number_of_decks": self.number_of_decks,
+            "running_count": self.running_count,
+            "true_count": self.true_count(),
+            "cards_seen": self.cards_seen,
+            "decks_remaining": round(self.decks_remaining(), 3),
+            "penetration": round(self.penetration(), 4),
+            "duplicates": self.duplicates,
+            "shoes_started": self.shoes_started,
+            "counts": self.counts(),
+        }
@@ -0,0 +1,393 @@
+############## Monte Carlo blackjack simulator ###############
+#
+# Plays the project's strategy (Strategy.py and strategy_rules.json, with the
+# true count deviations) against simulated shoes and reports what it is
+# worth: the expected value and variance per round, the EV at each true
+# count, and how often each action is taken.
+#
+# Rounds are played on many independent shoes at once, one NumPy array
+# element per shoe, so a step of the game (deal, one decision, one dealer
+# draw) is a handful of array operations for all of them. The true count is
+# kept with Hi-Lo like CardDetector: running count over decks remaining,
+# truncated to an integer.
+#
+# Game rules: one player, flat bets of one unit, dealer peeks for blackjack,
+# blackjack pays 3:2, double on the first two cards, split once (split Aces
+# get one card each), late surrender. A double that is not allowed falls back
+# to stand on soft 18 or more and hit otherwise; a surrender that is not
+# allowed falls back to hit.
+#
+# Work is split into shards with independent random streams, spawned from
+# one np.random.SeedSequence, and the shards can run in several processes.
+# The results depend on the seed and the number of shards only, not on the
+# number of processes.
+#
+# Run from the python_backend directory:
+#   python Simulator.py --rounds 1000000 --decks 6 --penetration 0.75 --workers 4
+
+# Import necessary packages
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+import time
+import numpy as np
+import Strategy
+from Strategy import HIT, STAND, DOUBLE, SPLIT, SURRENDER
+
+# Card values, Ace = 1, and their Hi-Lo tags
+DECK = np.concatenate([np.repeat(np.arange(1, 10), 4), np.repeat(10, 16)]).astype(np.int8)
+HI_LO = np.array([0, -1, 1, 1, 1, 1, 1, 0, 0, 0, -1], dtype=np.int64)
+
+# EV is reported per true count from -MAX_TRUE_COUNT to MAX_TRUE_COUNT; beyond that they are merged
+MAX_TRUE_COUNT = 10
+
+# Hand slots per round: the hand dealt, and the second hand of a split
+SLOTS = 2
+
+# Fewest rounds each shoe of a batch plays, so the shoes go through several
+# reshuffles and the partly dealt last one hardly weighs on the results
+MIN_ROUNDS_PER_SHOE = 400
+
+
+class Shoes:
+    """Batch of independent shoes with their Hi-Lo running counts"""
+    def __init__(self, rng, count, number_of_decks=6, penetration=0.75):
+
+        self.rng = rng
+        self.size = len(DECK) * number_of_decks  # Cards in a shoe
+        self.cut = int(self.size * penetration)  # Reshuffle once this many cards are dealt
+        self.shoe = np.tile(np.tile(DECK, number_of_decks), (count, 1))
+
+        # A spare shuffled deck after every shoe, for the rare round that runs past its end
+        self.cards = np.empty((count, self.size + len(DECK)), dtype=np.int8)
+        self.position = np.zeros(count, dtype=np.intp)
+        self.running_count = np.zeros(count, dtype=np.int64)
+        self.shuffle(np.arange(count))
+
+    def shuffle(self, rows):
+        self.cards[rows, :self.size] = self.rng.permuted(self.shoe[rows], axis=1)
+        self.cards[rows, self.size:] = self.rng.permuted(self.shoe[rows, :len(DECK)], axis=1)
+        self.position[rows] = 0
+        self.running_count[rows] = 0
+
+    def shuffle_if_needed(self):
+        rows = np.nonzero(self.position >= self.cut)[0]
+        if len(rows):
+            self.shuffle(rows)
+
+    def draw(self, rows, counted=True):
+        # Deal the next card of the given shoes
+        cards = self.cards[rows, self.position[rows]]
+        self.position[rows] += 1
+        if counted:
+            self.count(rows, cards)
+        return cards
+
+    def count(self, rows, cards):
+        self.running_count[rows] += HI_LO[cards]
+
+    def true_count(self, rows):
+        # Running count over decks remaining, truncated like CardDetector; 0 if no decks remain
+        decks_remaining = (self.size - self.position[rows]) / len(DECK)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            true_count = np.trunc(self.running_count[rows] / decks_remaining)
+        return np.where(decks_remaining > 0, true_count, 0)
+
+
+class Table:
+    """One round on each shoe of a Shoes batch, played with a Strategy"""
+    def __init__(self, strategy, shoes):
+
+        self.strategy = strategy
+        self.shoes = shoes
+        self.hits_soft_17 = strategy.rules.get("dealer_hits_soft_17", True)
+        self.double_after_split = strategy.rules.get("double_after_split", True)
+        self.surrender = strategy.rules.get("surrender", True)
+
+        # Actions taken, by action code
+        self.decisions = np.zeros(len(Strategy.ACTIONS), dtype=np.int64)
+
+    def play_round(self):
+        """
+        Plays one round on every shoe. Returns the net result of each round in
+        units, and the true count the round started at.
+        """
+        shoes = self.shoes
+        shoes.shuffle_if_needed()
+        n = len(shoes.position)
+        everyone = np.arange(n)
+        start_count = shoes.true_count(everyone)
+
+        # Hands, one column per slot. Totals count Aces as 1.
+        total = np.zeros((n, SLOTS), dtype=np.int64)
+        has_ace = np.zeros((n, SLOTS), dtype=bool)
+        cards = np.zeros((n, SLOTS), dtype=np.int64)  # Cards in the hand
+        first = np.zeros((n, SLOTS), dtype=np.int64)  # Value of the first card, for pairs
+        second = np.zeros((n, SLOTS), dtype=np.int64)
+        bet = np.ones((n, SLOTS))
+        in_play = np.zeros((n, SLOTS), dtype=bool)
+        done = np.zeros((n, SLOTS), dtype=bool)
+        surrendered = np.zeros((n, SLOTS), dtype=bool)
+        split = np.zeros(n, dtype=bool)
+        split_aces = np.zeros(n, dtype=bool)
+        self.hand = (total, has_ace, cards, first, second)
+
+        # Deal: player, dealer upcard, player, dealer hole card (counted when turned over)
+        in_play[:, 0] = True
+        self.add_card(everyone, 0, shoes.draw(everyone))
+        upcard = shoes.draw(everyone).astype(np.int64)
+        self.add_card(everyone, 0, shoes.draw(everyone))
+        hole = shoes.draw(everyone, counted=False).astype(np.int64)
+
+        # Blackjacks end the round at once
+        player_blackjack = has_ace[:, 0] & (total[:, 0] == 11)
+        dealer_blackjack = ((upcard == 1) & (hole == 10)) | ((upcard == 10) & (hole == 1))
+        natural = player_blackjack | dealer_blackjack
+        done[natural, 0] = True
+
+        # Player's hands, one slot after the other
+        for slot in range(SLOTS):
+            if slot > 0:
+                # Second card of the split hand
+                rows = np.nonzero(in_play[:, slot])[0]
+                self.add_card(rows, slot, shoes.draw(rows))
+                done[rows[split_aces[rows]], slot] = True
+
+            while True:
+                rows = np.nonzero(in_play[:, slot] & ~done[:, slot])[0]
+                if len(rows) == 0:
+                    break
+
+                best = best_total(total[rows, slot], has_ace[rows, slot])
+                is_pair = (cards[rows, slot] == 2) & (first[rows, slot] == second[rows, slot]) & ~split[rows]
+                pair_value = np.where(is_pair, np.where(first[rows, slot] == 1, 11, first[rows, slot]), 0)
+                states = Strategy.hand_states(total[rows, slot], has_ace[rows, slot], pair_value)
+                action = self.strategy.evaluate_batch(states, upcard[rows], shoes.true_count(rows))
+
+                # Fall back when the rules do not allow the action here
+                two_cards = cards[rows, slot] == 2
+                can_surrender = two_cards & ~split[rows] & self.surrender
+                action = np.where((action == SURRENDER) & ~can_surrender, HIT, action)
+                can_double = two_cards & (~split[rows] | self.double_after_split)
+                soft = has_ace[rows, slot] & (total[rows, slot] + 10 <= 21)
+                action = np.where((action == DOUBLE) & ~can_double, np.where(soft & (best >= 18), STAND, HIT), action)
+                action = np.where((action == SPLIT) & ~is_pair, HIT, action)
+                self.decisions += np.bincount(action, minlength=len(Strategy.ACTIONS))
+
+                # Stand
+                done[rows[action == STAND], slot] = True
+
+                # Surrender
+                surrendering = rows[action == SURRENDER]
+                surrendered[surrendering, slot] = True
+                done[surrendering, slot] = True
+
+                # Double: one card, then stand
+                doubling = rows[action == DOUBLE]
+                bet[doubling, slot] = 2
+                self.add_card(doubling, slot, shoes.draw(doubling))
+                done[doubling, slot] = True
+
+                # Split: the second card starts the hand in the next slot
+                splitting = rows[action == SPLIT]
+                if len(splitting):
+                    split[splitting] = True
+                    split_aces[splitting] = first[splitting, slot] == 1
+                    in_play[splitting, slot + 1] = True
+                    self.reset_hand(splitting, slot + 1)
+                    self.add_card(splitting, slot + 1, second[splitting, slot])
+                    kept = first[splitting, slot]
+                    self.reset_hand(splitting, slot)
+                    self.add_card(splitting, slot, kept)
+                    self.add_card(splitting, slot, shoes.draw(splitting))
+                    done[splitting[split_aces[splitting]], slot] = True
+
+                # Hit
+                hitting = rows[action == HIT]
+                self.add_card(hitting, slot, shoes.draw(hitting))
+
+                # Hands that reached 21 or busted are finished
+                rows = np.nonzero(in_play[:, slot] & ~done[:, slot])[0]
+                finished = best_total(total[rows, slot], has_ace[rows, slot]) >= 21
+                done[rows[finished], slot] = True
+
+        # Dealer turns the hole card over, and draws if any hand is still standing
+        shoes.count(everyone, hole)
+        player_best = best_total(total, has_ace)
+        live = in_play & ~surrendered & (player_best <= 21)
+        dealer_total = upcard + hole
+        dealer_ace = (upcard == 1) | (hole == 1)
+        drawing = live.any(axis=1) & ~natural
+        while True:
+            dealer_best = best_total(dealer_total, dealer_ace)
+            dealer_soft = dealer_ace & (dealer_total + 10 <= 21)
+            must_hit = (dealer_best < 17) | (self.hits_soft_17 & dealer_soft & (dealer_best == 17))
+            rows = np.nonzero(drawing & must_hit)[0]
+            if len(rows) == 0:
+                break
+            card = shoes.draw(rows)
+            dealer_total[rows] += card
+            dealer_ace[rows] |= card == 1
+        dealer_best = best_total(dealer_total, dealer_ace)[:, None]
+
+        # Settle every hand
+        won = (player_best <= 21) & ((dealer_best > 21) | (player_best > dealer_best))
+        lost = (player_best > 21) | ((dealer_best <= 21) & (player_best < dealer_best))
+        net = np.where(won, bet, np.where(lost, -bet, 0.0))
+        net = np.where(surrendered, -0.5, net)
+        net = np.where(in_play, net, 0.0).sum(axis=1)
+
+        # Blackjacks
+        net = np.where(player_blackjack & ~dealer_blackjack, 1.5, net)
+        net = np.where(dealer_blackjack & ~player_blackjack, -1.0, net)
+        net = np.where(player_blackjack & dealer_blackjack, 0.0, net)
+
+        return net, start_count
+
+    def add_card(self, rows, slot, values):
+        total, has_ace, cards, first, second = self.hand
+        total[rows, slot] += values
+        has_ace[rows, slot] |= values == 1
+        cards[rows, slot] += 1
+        first[rows, slot] = np.where(cards[rows, slot] == 1, values, first[rows, slot])
+        second[rows, slot] = np.where(cards[rows, slot] == 2, values, second[rows, slot])
+
+    def reset_hand(self, rows, slot):
+        for column in self.hand:
+            column[rows, slot] = 0
+
+
+def best_total(total, has_ace):
+    """Best total of hands given by their totals with Aces counted as 1."""
+    return np.where(has_ace & (total + 10 <= 21), total + 10, total)
+
+
+def run_shard(seed, rounds, number_of_decks=6, penetration=0.75, batch_size=10000,
+              rules_path=Strategy.DEFAULT_RULES_PATH, rules=None):
+    """
+    Plays rounds on up to batch_size shoes at a time with one random stream,
+    and returns the sums the results are built from.
+    """
+    strategy = Strategy.Strategy(rules_path, **(rules or {}))
+    rng = np.random.default_rng(seed)
+    shoes = Shoes(rng, max(1, min(batch_size, rounds // MIN_ROUNDS_PER_SHOE)), number_of_decks, penetration)
+    table = Table(strategy, shoes)
+
+    buckets = 2 * MAX_TRUE_COUNT + 1
+    sums = {
+        "rounds": 0,
+        "net": 0.0,
+        "net_squared": 0.0,
+        "count_rounds": np.zeros(buckets, dtype=np.int64),
+        "count_net": np.zeros(buckets),
+    }
+
+    played = 0
+    while played < rounds:
+        net, true_count = table.play_round()
+        net = net[:rounds - played]
+        bucket = np.clip(true_count[:len(net)], -MAX_TRUE_COUNT, MAX_TRUE_COUNT).astype(np.intp) + MAX_TRUE_COUNT
+        sums["rounds"] += len(net)
+        sums["net"] += net.sum()
+        sums["net_squared"] += np.square(net).sum()
+        sums["count_rounds"] += np.bincount(bucket, minlength=buckets)
+        sums["count_net"] += np.bincount(bucket, weights=net, minlength=buckets)
+        played += len(net)
+
+    sums["decisions"] = table.decisions
+    return sums
+
+
+def simulate(rounds, number_of_decks=6, penetration=0.75, seed=0, shards=None, workers=None,
+             batch_size=10000, rules_path=Strategy.DEFAULT_RULES_PATH, **rules):
+    """
+    Plays the given number of rounds, split into shards with independent
+    random streams, on up to workers processes (one per CPU by default).
+    Returns the results as a dict.
+    """
+    workers = workers or os.cpu_count() or 1
+    shards = shards or workers
+    seeds = np.random.SeedSequence(seed).spawn(shards)
+    shard_rounds = [rounds // shards + (1 if shard < rounds % shards else 0) for shard in range(shards)]
+
+    t_start = time.perf_counter()
+    jobs = [(seeds[shard], shard_rounds[shard], number_of_decks, penetration, batch_size, rules_path, rules)
+            for shard in range(shards) if shard_rounds[shard] > 0]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            results = list(executor.map(run_shard, *zip(*jobs)))
+    else:
+        results = [run_shard(*job) for job in jobs]
+    elapsed = time.perf_counter() - t_start
+
+    # Merge the shards
+    total = {key: sum(result[key] for result in results) for key in results[0]}
+    played = total["rounds"]
+    ev = total["net"] / played
+    variance = total["net_squared"] / played - ev ** 2
+    decisions = total["decisions"]
+
+    return {
+        "rounds": int(played),
+        "number_of_decks": number_of_decks,
+        "penetration": penetration,
+        "rules": Strategy.Strategy(rules_path, **rules).rules,
+        "seed": seed,
+        "shards": shards,
+        "workers": workers,
+        "ev": round(float(ev), 6),
+        "variance": round(float(variance), 6),
+        "standard_error": round(float(np.sqrt(variance / played)), 6),
+        "rounds_per_second": round(played / elapsed),
+        "decisions": {
+            Strategy.ACTIONS[code]: round(float(decisions[code] / decisions.sum()), 6)
+            for code in range(1, len(Strategy.ACTIONS))
+        },
+        "true_counts": [
+            {
+                "true_count": bucket - MAX_TRUE_COUNT,
+                "rounds": int(total["count_rounds"][bucket]),
+                "ev": round(float(total["count_net"][bucket] / total["count_rounds"][bucket]), 6),
+            }
+            for bucket in range(2 * MAX_TRUE_COUNT + 1) if total["count_rounds"][bucket] > 0
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate blackjack rounds played with the strategy rules.")
+    parser.add_argument("--rounds", type=int, default=1000000, help="number of rounds to play")
+    parser.add_argument("--decks", type=int, default=6, help="number of decks in the shoe")
+    parser.add_argument("--penetration", type=float, default=0.75, help="fraction of the shoe dealt before reshuffling")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random streams")
+    parser.add_argument("--shards", type=int, help="independent random streams; one per worker by default")
+    parser.add_argument("--workers", type=int, help="processes to run the shards on; one per CPU by default")
+    parser.add_argument("--batch-size", type=int, default=10000, help="most shoes played at once in each shard")
+    parser.add_argument("--rules", default=Strategy.DEFAULT_RULES_PATH, help="strategy rules file")
+    parser.add_argument("--s17", action="store_true", help="dealer stands on soft 17")
+    parser.add_argument("--no-das", action="store_true", help="no double after split")
+    parser.add_argument("--no-surrender", action="store_true", help="no surrender")
+    parser.add_argument("--output", help="file to write the JSON results to")
+    args = parser.parse_args()
+
+    rules = {}
+    if args.s17:
+        rules["dealer_hits_soft_17"] = False
+    if args.no_das:
+        rules["double_after_split"] = False
+    if args.no_surrender:
+        rules["surrender"] = False
+
+    results = simulate(args.rounds, args.decks, args.penetration, args.seed, args.shards, args.workers,
+                       args.batch_size, args.rules, **rules)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
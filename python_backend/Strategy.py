@@ -0,0 +1,222 @@
+############## Blackjack strategy engine ###############
+#
+# Basic strategy compiled from a rules file (strategy_rules.json) into dense
+# lookup arrays, so a suggestion is a few array reads instead of a chain of
+# comparisons, and thousands of decisions can be evaluated in one call.
+#
+# A hand is reduced to a state code:
+#   HARD + total   hard totals, busted totals clamped to MAX_TOTAL
+#   SOFT + total   soft totals (an Ace still counted as 11)
+#   PAIR + value   two cards of the same rank, by card value (Ace = 11)
+#
+# Each state's row in the action table holds the action against every dealer
+# upcard. Surrender and the true count deviations go by the hand's total,
+# whatever its kind: surrender replaces the table action, and a deviation
+# replaces both once the true count reaches its index.
+#
+# The rules file holds the tables for its default rules. Variants patch rows
+# for other rules (dealer stands on soft 17, no double after split, no
+# surrender), and apply when all of their "when" conditions hold.
+
+# Import necessary packages
+import json
+import os
+import numpy as np
+
+# Action codes. Code 0 is no suggestion; FrameProtocol sends the same codes.
+ACTIONS = ["", "Hit", "Stand", "Double Down", "Split", "Surrender"]
+NONE, HIT, STAND, DOUBLE, SPLIT, SURRENDER = range(len(ACTIONS))
+
+# Letters used in the rules file
+ACTION_LETTERS = {"H": HIT, "S": STAND, "D": DOUBLE, "P": SPLIT, "R": SURRENDER}
+
+RANK_VALUES = {
+    'Two': 2, 'Three': 3, 'Four': 4, 'Five': 5, 'Six': 6,
+    'Seven': 7, 'Eight': 8, 'Nine': 9, 'Ten': 10,
+    'Jack': 10, 'Queen': 10, 'King': 10, 'Ace': 11
+}
+
+# Dealer upcard columns: 2 to 10, then Ace
+DEALER_UPCARDS = ["2", "3", "4", "5", "6", "7", "8", "9", "10", "A"]
+
+# Column of each dealer upcard value; an Ace may be given as 1 or 11
+DEALER_COLUMN = np.array([0, 9, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9], dtype=np.intp)
+
+# State codes
+MAX_TOTAL = 31
+HARD = 0
+SOFT = HARD + MAX_TOTAL + 1
+PAIR = SOFT + MAX_TOTAL + 1
+NUM_STATES = PAIR + 12
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "strategy_rules.json")
+
+
+def hand_state(player_hand):
+    """
+    Returns the state code and total of a hand, given as a list of rank names.
+    """
+    # Convert player's hand to numerical values
+    player_values = [RANK_VALUES.get(rank, 0) for rank in player_hand]
+
+    # Count Aces as 1 until the hand is no longer busted
+    total = sum(player_values)
+    num_aces = player_values.count(11)
+    while total > 21 and num_aces > 0:
+        total -= 10
+        num_aces -= 1
+
+    if len(player_hand) == 2 and player_hand[0] == player_hand[1]:
+        return PAIR + player_values[0], total
+    if num_aces > 0:
+        # An Ace still counts as 11. A hand whose Aces all had to count as 1
+        # (A,2,10 is hard 13) is hard: it cannot take another card without risk.
+        return SOFT + total, total
+    return HARD + min(total, MAX_TOTAL), total
+
+
+def hand_states(hard_totals, has_ace, pair_values):
+    """
+    Vectorized hand_state: returns the state codes of hands given by arrays of
+    their totals with Aces counted as 1, whether they hold an Ace, and the card
+    value of the pairs (Ace = 11; 0 for hands that are not a pair).
+    """
+    soft_totals = hard_totals + 10
+    soft = has_ace & (soft_totals <= 21)
+    states = np.where(soft, SOFT + soft_totals, HARD + np.minimum(hard_totals, MAX_TOTAL))
+    return np.where(pair_values > 0, PAIR + pair_values, states)
+
+
+def state_total(state):
+    """Returns the total of the hands with the given state code."""
+    if state >= PAIR:
+        value = state - PAIR
+        return 12 if value == 11 else 2 * value
+    if state >= SOFT:
+        return state - SOFT
+    return state - HARD
+
+
+class Strategy:
+    """Table-driven basic strategy with count based deviations"""
+    def __init__(self, rules_path=DEFAULT_RULES_PATH, **rules):
+
+        with open(rules_path) as rules_file:
+            config = json.load(rules_file)
+
+        # Rules of the game: the file's defaults, overridden by keyword arguments
+        self.rules = dict(config.get("rules", {}))
+        for name in rules:
+            if name not in self.rules:
+                raise ValueError("Unknown strategy rule: %s" % name)
+        self.rules.update(rules)
+
+        # Patch the tables with every variant that applies to these rules
+        tables = {kind: dict(config.get(kind, {})) for kind in ("hard", "soft", "pairs", "surrender")}
+        deviations = list(config.get("deviations", []))
+        for variant in config.get("variants", []):
+            if all(self.rules.get(name) == value for name, value in variant["when"].items()):
+                for kind in tables:
+                    tables[kind].update(variant.get(kind, {}))
+                deviations += variant.get("deviations", [])
+
+        self.compile(tables, deviations)
+
+    def compile(self, tables, deviations):
+        # Build the dense lookup arrays from the rows of the rules file
+        columns = len(DEALER_UPCARDS)
+
+        # Action of every state against every dealer upcard
+        self.table = np.full((NUM_STATES, columns), HIT, dtype=np.uint8)
+        fill_rows(self.table, HARD, {int(total): row for total, row in tables["hard"].items()}, MAX_TOTAL)
+        fill_rows(self.table, SOFT, {int(total): row for total, row in tables["soft"].items()}, 21)
+        pairs = {11 if rank == "A" else int(rank): row for rank, row in tables["pairs"].items()}
+        for value, row in pairs.items():
+            self.table[PAIR + value] = parse_row(row)
+
+        # Total of every state, which surrender and the deviations go by
+        self.state_total = np.array([state_total(state) for state in range(NUM_STATES)], dtype=np.intp)
+
+        # Surrender, by total and dealer upcard
+        self.surrender = np.zeros((MAX_TOTAL + 1, columns), dtype=bool)
+        for total, row in tables["surrender"].items():
+            self.surrender[int(total)] = [letter == "R" for letter in row]
+
+        # Deviations: the action replaces the strategy at or above a minimum
+        # true count, or at or below a maximum one
+        self.deviation_min = np.full((MAX_TOTAL + 1, columns), np.inf)
+        self.deviation_min_action = np.zeros((MAX_TOTAL + 1, columns), dtype=np.uint8)
+        self.deviation_max = np.full((MAX_TOTAL + 1, columns), -np.inf)
+        self.deviation_max_action = np.zeros((MAX_TOTAL + 1, columns), dtype=np.uint8)
+        for deviation in deviations:
+            total = deviation["total"]
+            column = DEALER_UPCARDS.index(deviation["dealer"])
+            action = ACTION_LETTERS[deviation["action"]]
+            if "min_true_count" in deviation:
+                self.deviation_min[total, column] = deviation["min_true_count"]
+                self.deviation_min_action[total, column] = action
+            if "max_true_count" in deviation:
+                self.deviation_max[total, column] = deviation["max_true_count"]
+                self.deviation_max_action[total, column] = action
+
+    def evaluate(self, state, upcard, true_count):
+        """
+        Returns the action code for one state code, dealer upcard value
+        (2 to 10, Ace as 1 or 11) and true count.
+        """
+        column = DEALER_COLUMN[upcard]
+        total = self.state_total[state]
+
+        if true_count >= self.deviation_min[total, column]:
+            return int(self.deviation_min_action[total, column])
+        if true_count <= self.deviation_max[total, column]:
+            return int(self.deviation_max_action[total, column])
+        if self.surrender[total, column]:
+            return SURRENDER
+        return int(self.table[state, column])
+
+    def evaluate_batch(self, states, upcards, true_counts):
+        """
+        Vectorized evaluate(): returns the action codes for arrays of state
+        codes, dealer upcard values and true counts (or a single true count).
+        """
+        states = np.asarray(states, dtype=np.intp)
+        columns = DEALER_COLUMN[np.asarray(upcards, dtype=np.intp)]
+        true_counts = np.asarray(true_counts, dtype=np.float64)
+        totals = self.state_total[states]
+
+        actions = self.table[states, columns]
+        actions = np.where(self.surrender[totals, columns], SURRENDER, actions)
+        actions = np.where(true_counts <= self.deviation_max[totals, columns],
+                           self.deviation_max_action[totals, columns], actions)
+        actions = np.where(true_counts >= self.deviation_min[totals, columns],
+                           self.deviation_min_action[totals, columns], actions)
+        return actions.astype(np.uint8)
+
+    def suggest(self, player_hand, dealer_upcard, true_count):
+        """
+        Returns a suggestion ('Hit', 'Stand', 'Double Down', 'Split', 'Surrender')
+        for a hand and dealer upcard given as rank names, or None if either is missing.
+        """
+        if not player_hand or not dealer_upcard:
+            return None
+
+        state, _ = hand_state(player_hand)
+        return ACTIONS[self.evaluate(state, RANK_VALUES.get(dealer_upcard, 0), true_count)]
+
+
+def parse_row(row):
+    """Action codes of one row of the rules file."""
+    if len(row) != len(DEALER_UPCARDS):
+        raise ValueError("Strategy row %r does not have one action per dealer upcard" % row)
+    return [ACTION_LETTERS[letter] for letter in row]
+
+
+def fill_rows(table, base, rows, last):
+    # Fill the rows of one hand kind. Totals below the lowest row take the
+    # lowest row, and totals above the highest row (up to last) the highest.
+    lowest, highest = min(rows), max(rows)
+    for total in range(0, last + 1):
+        row = rows.get(min(max(total, lowest), highest))
+        if row is not None:
+            table[base + total] = parse_row(row)
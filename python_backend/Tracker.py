@@ -0,0 +1,258 @@
+############## Card tracker ###############
+#
+# Gives every card a stable ID across frames, so the recognition cache and
+# the count can tell a card they have already seen from a new one.
+#
+# Each frame, every track predicts where its card is now from its last
+# position and a constant velocity. The detected cards are then assigned to
+# the tracks one-to-one, minimizing the total distance between predicted and
+# detected centers (Hungarian algorithm on a NumPy distance matrix). Pairs
+# whose bounding boxes barely overlap, or whose centers are too far apart,
+# are not allowed.
+#
+# Track states:
+#   - tentative: seen for fewer than confirm_hits frames; deleted on the first miss
+#   - confirmed: seen for at least confirm_hits frames
+#   - lost: a confirmed track missed on its last frames. It keeps its ID and
+#     can be picked up again for max_lost frames, then it is deleted. The IDs
+#     picked up again on a frame are kept in revived, as the card may be a
+#     different one dealt in the same spot.
+
+# Import necessary packages
+import numpy as np
+import cv2
+
+TENTATIVE = "tentative"
+CONFIRMED = "confirmed"
+LOST = "lost"
+
+# Cost of a pair the gate rules out; far above any real distance
+GATED_COST = 1e6
+
+
+class Track:
+    """Structure to store the state of one tracked card."""
+
+    def __init__(self, track_id, card, frame):
+        self.id = track_id
+        self.state = TENTATIVE
+        self.card = card  # Query_card from the last frame the track was seen in
+        self.center = np.array(card.center, dtype=np.float64)
+        self.velocity = np.zeros(2)  # Pixels per frame
+        self.size = np.zeros(2)  # Width and height of the bounding box
+        self.hits = 1  # Frames the track was seen in
+        self.misses = 0  # Consecutive frames the track was not seen in
+        self.last_frame = frame  # Frame number the track was last seen in
+        self.set_box(card)
+
+    def set_box(self, card):
+        x, y, w, h = cv2.boundingRect(card.contour)
+        self.size = np.array([w, h], dtype=np.float64)
+
+    def predict(self, frame):
+        # Predicted center of the card in the given frame
+        return self.center + self.velocity * (frame - self.last_frame)
+
+
+class Tracker:
+    """One-to-one card tracker with constant velocity prediction"""
+    def __init__(self, max_distance=80, min_iou=0.1, confirm_hits=3, max_lost=10, velocity_smoothing=0.5):
+
+        self.max_distance = max_distance  # Largest distance between a prediction and a detection, in pixels
+        self.min_iou = min_iou  # Smallest overlap of their bounding boxes
+        self.confirm_hits = confirm_hits  # Frames a track needs to be seen in to be confirmed
+        self.max_lost = max_lost  # Frames a lost track is kept for
+        self.velocity_smoothing = velocity_smoothing  # Weight of the newest velocity measurement
+
+        self.tracks = {}  # Track ID -> Track
+        self.next_id = 1
+        self.frame = 0
+        self.revived = []  # IDs of the lost tracks picked up again on the last frame
+
+        # Statistics
+        self.tracks_created = 0
+        self.tracks_deleted = 0
+
+    def update(self, cards, held_cards=()):
+        """
+        Assigns an ID to each detected card, creating tracks for new cards.
+        held_cards already have IDs and are known not to have moved (the motion
+        gate kept them), so their tracks count as seen in place.
+        Returns the IDs of the tracks deleted this frame.
+        """
+        self.frame += 1
+        self.revived = []
+
+        held_ids = set()
+        for card in held_cards:
+            track = self.tracks.get(card.id)
+            if track is not None:
+                self.observe(track, card, moved=False)
+                held_ids.add(card.id)
+
+        candidates = [track for track in self.tracks.values() if track.id not in held_ids]
+        rows, cols = self.assign(candidates, cards)
+
+        matched_tracks = set()
+        matched_cards = set()
+        for row, col in zip(rows, cols):
+            track, card = candidates[row], cards[col]
+            card.id = track.id
+            card.last_rank = track.card.last_rank
+            card.last_suit = track.card.last_suit
+            if track.state == LOST:
+                self.revived.append(track.id)
+            self.observe(track, card, moved=True)
+            matched_tracks.add(track.id)
+            matched_cards.add(col)
+
+        # Start a tentative track for every card that matched none
+        for col, card in enumerate(cards):
+            if col not in matched_cards:
+                card.id = self.next_id
+                self.tracks[card.id] = Track(card.id, card, self.frame)
+                self.next_id += 1
+                self.tracks_created += 1
+
+        # Tracks that were not seen
+        deleted = []
+        for track in candidates:
+            if track.id in matched_tracks:
+                continue
+            track.misses += 1
+            if track.state == TENTATIVE or track.misses > self.max_lost:
+                deleted.append(track.id)
+            else:
+                track.state = LOST
+
+        for track_id in deleted:
+            del self.tracks[track_id]
+        self.tracks_deleted += len(deleted)
+
+        return deleted
+
+    def observe(self, track, card, moved):
+        # Update a track with the card it was matched to this frame
+        if moved:
+            gap = max(self.frame - track.last_frame, 1)
+            measured = (np.array(card.center, dtype=np.float64) - track.center) / gap
+        else:
+            measured = np.zeros(2)
+        track.velocity += self.velocity_smoothing * (measured - track.velocity)
+        track.center = np.array(card.center, dtype=np.float64)
+        track.set_box(card)
+        track.card = card
+        track.hits += 1
+        track.misses = 0
+        track.last_frame = self.frame
+        if track.hits >= self.confirm_hits:
+            track.state = CONFIRMED
+        elif track.state == LOST:
+            track.state = TENTATIVE
+
+    def assign(self, tracks, cards):
+        # Return the row (track) and column (card) indices of the gated optimal assignment
+        if not tracks or not cards:
+            return [], []
+
+        predicted = np.array([track.predict(self.frame) for track in tracks])
+        track_sizes = np.array([track.size for track in tracks])
+        centers = np.array([card.center for card in cards], dtype=np.float64)
+        boxes = np.array([cv2.boundingRect(card.contour) for card in cards], dtype=np.float64)
+
+        # Distances between every predicted and detected center
+        delta = predicted[:, None, :] - centers[None, :, :]
+        dist = np.hypot(delta[..., 0], delta[..., 1])
+
+        # Overlap of every predicted box, centered on its prediction, with every detected box
+        pred_lo = predicted - track_sizes / 2
+        pred_hi = predicted + track_sizes / 2
+        det_lo = boxes[:, :2]
+        det_hi = boxes[:, :2] + boxes[:, 2:]
+        overlap = np.clip(np.minimum(pred_hi[:, None], det_hi[None]) - np.maximum(pred_lo[:, None], det_lo[None]), 0, None)
+        inter = overlap[..., 0] * overlap[..., 1]
+        union = (track_sizes.prod(axis=1)[:, None] + boxes[:, 2:].prod(axis=1)[None]) - inter
+        iou = inter / np.maximum(union, 1e-9)
+
+        allowed = (dist <= self.max_distance) & (iou >= self.min_iou)
+        cost = np.where(allowed, dist, GATED_COST)
+
+        rows, cols = linear_assignment(cost)
+        keep = allowed[rows, cols]
+        return rows[keep], cols[keep]
+
+    def state_of(self, track_id):
+        track = self.tracks.get(track_id)
+        return track.state if track is not None else None
+
+    def stats(self):
+        states = [track.state for track in self.tracks.values()]
+        return {
+            "tentative": states.count(TENTATIVE),
+            "confirmed": states.count(CONFIRMED),
+            "lost": states.count(LOST),
+            "tracks_created": self.tracks_created,
+            "tracks_deleted": self.tracks_deleted,
+        }
+
+
+def linear_assignment(cost):
+    """Minimum cost one-to-one assignment between the rows and columns of a
+    cost matrix (Hungarian algorithm with potentials, O(n^2 m)). Every row of
+    the smaller dimension is assigned. Returns the row and column index arrays
+    of the assigned pairs, sorted by row."""
+
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    # Index 0 is a virtual column; rows are numbered from 1
+    u = np.zeros(n + 1)  # Row potentials
+    v = np.zeros(m + 1)  # Column potentials
+    assigned_row = np.zeros(m + 1, dtype=int)  # Row assigned to each column, 0 for none
+    way = np.zeros(m + 1, dtype=int)  # Previous column on the augmenting path
+
+    for i in range(1, n + 1):
+        assigned_row[0] = i
+        j0 = 0
+        min_reduced = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+
+        # Grow a tree of tight edges from row i until it reaches a free column
+        while True:
+            used[j0] = True
+            i0 = assigned_row[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < min_reduced[1:])
+            min_reduced[1:][better] = reduced[better]
+            way[1:][better] = j0
+
+            candidates = np.where(free, min_reduced[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+
+            u[assigned_row[used]] += delta
+            v[used] -= delta
+            min_reduced[1:][free] -= delta
+
+            j0 = j1
+            if assigned_row[j0] == 0:
+                break
+
+        # Flip the assignments along the augmenting path
+        while j0 != 0:
+            j1 = way[j0]
+            assigned_row[j0] = assigned_row[j1]
+            j0 = j1
+
+    cols = np.nonzero(assigned_row[1:])[0]
+    rows = assigned_row[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
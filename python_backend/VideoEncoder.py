@@ -0,0 +1,138 @@
+############## Adaptive preview encoder ###############
+#
+# JPEG-encodes the frames sent to the clients. Encoding the full 1280x720
+# frame at OpenCV's default quality is one of the largest per-frame costs,
+# and the UI shows the video scaled down anyway, so frames are encoded at a
+# preview width and quality instead.
+#
+# Frames the detector reports as unchanged (the motion gate found nothing
+# new and the results are the same) are not encoded again; the last JPEG is
+# reused, and clients that already have it are not sent it again.
+#
+# An adaptive controller watches the clients' send latency and the results
+# they had to skip. While either stays too high it steps down a ladder of
+# (width, quality) levels, alternating lower quality and lower resolution;
+# after a stretch without pressure it steps back up.
+
+# Import necessary packages
+import time
+import cv2
+import Metrics
+from FrameWorker import ema
+
+ENCODED_BYTES = Metrics.REGISTRY.histogram(
+    "encoded_frame_bytes", "Size of the JPEG frames sent to the clients",
+    buckets=(10000, 20000, 40000, 60000, 80000, 120000, 160000, 240000, 320000, 480000))
+ENCODES = Metrics.REGISTRY.counter(
+    "video_encodes_total", "Frames encoded or skipped because they had not changed", label="result")
+
+
+class VideoEncoder:
+    """JPEG preview encoder with frame skipping and adaptive quality"""
+    def __init__(self, width=960, quality=80, adaptive=True, min_width=320, min_quality=40,
+                 quality_step=15, target_latency_ms=100, patience=5, recovery=60):
+
+        self.width = width  # Preview width in pixels; None keeps the frame width
+        self.quality = quality  # JPEG quality, 0 to 100
+        self.adaptive = adaptive
+
+        # Levels from best to cheapest, alternating lower quality and lower resolution
+        self.levels = [(width, quality)]
+        while True:
+            level_width, level_quality = self.levels[-1]
+            can_lower_quality = level_quality - quality_step >= min_quality
+            can_lower_width = level_width is not None and int(level_width * 0.75) >= min_width
+            if can_lower_quality and (len(self.levels) % 2 == 1 or not can_lower_width):
+                self.levels.append((level_width, level_quality - quality_step))
+            elif can_lower_width:
+                self.levels.append((int(level_width * 0.75), level_quality))
+            else:
+                break
+        self.level = 0
+
+        # Controller settings
+        self.target_latency_ms = target_latency_ms  # Send latency above this is pressure
+        self.patience = patience  # Frames of pressure before stepping down
+        self.recovery = recovery  # Frames without pressure before stepping up
+        self.pressured_frames = 0
+        self.relaxed_frames = 0
+        self.last_dropped = 0
+
+        # Last encoded frame, reused while frames are unchanged
+        self.jpeg = b""
+        self.jpeg_seq = 0  # Incremented for every new JPEG
+
+        # Statistics
+        self.frames_encoded = 0
+        self.frames_skipped = 0
+        self.encode_ms = 0.0  # Exponential moving averages
+        self.frame_bytes = 0.0
+
+    def encode(self, image, changed=True):
+        """
+        Returns the JPEG of the image at the current level, and its sequence number.
+        If the frame has not changed since the last one, the last JPEG is returned.
+        """
+        if not changed and self.jpeg:
+            self.frames_skipped += 1
+            ENCODES.inc(1, "skipped")
+            return self.jpeg, self.jpeg_seq
+
+        t_start = time.perf_counter()
+        width, quality = self.levels[self.level]
+
+        # Scale down to the preview width
+        img_h, img_w = image.shape[:2]
+        if width is not None and width < img_w:
+            image = cv2.resize(image, (width, int(img_h * width / img_w)), interpolation=cv2.INTER_LINEAR)
+
+        _, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        self.jpeg = jpeg.tobytes()
+        self.jpeg_seq += 1
+
+        elapsed = time.perf_counter() - t_start
+        Metrics.STAGE_SECONDS.observe(elapsed, "encode")
+        ENCODED_BYTES.observe(len(self.jpeg))
+        ENCODES.inc(1, "encoded")
+
+        self.frames_encoded += 1
+        self.encode_ms = ema(self.encode_ms, elapsed * 1000)
+        self.frame_bytes = ema(self.frame_bytes, len(self.jpeg))
+
+        return self.jpeg, self.jpeg_seq
+
+    def adapt(self, send_latency_ms, frames_dropped):
+        """
+        Steps the level down or up from the clients' worst send latency and
+        their total count of skipped results. Call once per frame.
+        """
+        dropped = frames_dropped - self.last_dropped
+        self.last_dropped = frames_dropped
+        if not self.adaptive:
+            return
+
+        if send_latency_ms > self.target_latency_ms or dropped > 0:
+            self.pressured_frames += 1
+            self.relaxed_frames = 0
+            if self.pressured_frames >= self.patience and self.level < len(self.levels) - 1:
+                self.level += 1
+                self.pressured_frames = 0
+        else:
+            self.relaxed_frames += 1
+            self.pressured_frames = 0
+            if self.relaxed_frames >= self.recovery and self.level > 0:
+                self.level -= 1
+                self.relaxed_frames = 0
+
+    def stats(self):
+        width, quality = self.levels[self.level]
+        return {
+            "width": width,
+            "quality": quality,
+            "level": self.level,
+            "levels": len(self.levels),
+            "frames_encoded": self.frames_encoded,
+            "frames_skipped": self.frames_skipped,
+            "encode_ms": round(self.encode_ms, 2),
+            "frame_bytes": int(self.frame_bytes),
+        }
@@ -17,19 +17,72 @@
 # https://www.pyimagesearch.com/2015/12/28/increasing-raspberry-pi-fps-with-python-and-opencv/
 # https://www.pyimagesearch.com/2015/12/21/increasing-webcam-fps-with-python-and-opencv/
 
+# Every frame is stamped with a monotonically increasing sequence number and
+# its capture time (time.perf_counter()). read_new() and borrow() block until
+# a frame newer than the last one handed out is available, so consumers never
+# process the same frame twice. Frames that are overwritten, or skipped because
+# every buffer is in use, before anyone reads them are counted as dropped.
+#
+# Frames are captured in place into a fixed ring of preallocated buffers, so
+# the capture loop does not allocate a new image for every grab. borrow()
+# hands out a reference to a buffer without copying it; the buffer is not
+# reused until the FrameRef is released. read() and read_new() return copies.
+
 # Import the necessary packages
-from threading import Thread
+from threading import Thread, Condition
+import time
+import numpy as np
 import cv2
 
 
+class FrameRef:
+    """Borrowed reference to a captured frame. The image is not overwritten
+    until release() is called."""
+
+    def __init__(self, image, seq, timestamp, owner=None, slot=None):
+        self.image = image  # The frame itself, not a copy
+        self.seq = seq  # Sequence number of the frame
+        self.timestamp = timestamp  # time.perf_counter() when the frame was captured
+        self.owner = owner  # Stream that owns the buffer
+        self.slot = slot  # Index of the buffer in the owner's ring
+        self.released = False
+
+    def release(self):
+        # Give the buffer back to its stream. Safe to call more than once.
+        if not self.released:
+            self.released = True
+            if self.owner is not None:
+                self.owner.release_slot(self.slot)
+
+
 class VideoStream:
     """Camera object"""
-    def __init__(self, resolution=(640,480),framerate=30,PiOrUSB=1,src=0):
+    def __init__(self, resolution=(640,480),framerate=30,PiOrUSB=1,src=0,ring_depth=4):
 
         # Create a variable to indicate if it's a USB camera or PiCamera.
         # PiOrUSB = 1 will use PiCamera. PiOrUSB = 2 will use USB camera.
         self.PiOrUSB = PiOrUSB
 
+        # Ring of preallocated frame buffers, allocated when the first frame
+        # arrives. One buffer is being written, one holds the latest frame and
+        # the rest can be borrowed, so the depth should be at least 3.
+        self.ring_depth = max(ring_depth, 3)
+        self.ring = None
+        self.ring_refs = [0] * self.ring_depth  # Number of borrows of each buffer
+        self.latest_slot = None  # Buffer holding the most recent frame
+        self.writing_slot = None  # Buffer the capture thread is writing into
+
+        # Sequence number and capture time of the current frame, and the
+        # sequence number of the last frame handed to a consumer
+        self.frame_seq = 0
+        self.frame_time = 0.0
+        self.last_read_seq = 0
+        self.frames_captured = 0
+        self.frames_dropped = 0
+
+        # Guards the ring and the frame stamps, and signals new frames
+        self.condition = Condition()
+
         if self.PiOrUSB == 1: # PiCamera
             # Import packages from picamera library
             from picamera.array import PiRGBArray
@@ -43,9 +96,6 @@ class VideoStream:
             self.stream = self.camera.capture_continuous(
                 self.rawCapture, format = "bgr", use_video_port = True)
 
-            # Initialize variable to store the camera frame
-            self.frame = []
-
         if self.PiOrUSB == 2: # USB camera
             # Initialize the USB camera and the camera image stream
             self.stream = cv2.VideoCapture(src)
@@ -53,12 +103,21 @@ class VideoStream:
             ret = self.stream.set(4,resolution[1])
             #ret = self.stream.set(5,framerate) #Doesn't seem to do anything so it's commented out
 
-            # Read first frame from the stream
-            (self.grabbed, self.frame) = self.stream.read()
+            # Read first frame from the stream and size the ring after it
+            (self.grabbed, frame) = self.stream.read()
+            if self.grabbed:
+                self.allocate_ring(frame)
+                slot = self.acquire_slot()
+                np.copyto(self.ring[slot], frame)
+                self.publish(slot)
 
 	# Create a variable to control when the camera is stopped
         self.stopped = False
 
+    def allocate_ring(self, frame):
+        # Preallocate every buffer of the ring with the shape of the given frame
+        self.ring = [np.empty_like(frame) for _ in range(self.ring_depth)]
+
     def start(self):
 	# Start the thread to read frames from the video stream
         Thread(target=self.update,args=()).start()
@@ -70,9 +129,17 @@ class VideoStream:
             
             # Keep looping indefinitely until the thread is stopped
             for f in self.stream:
-                # Grab the frame from the stream and clear the stream
-                # in preparation for the next frame
-                self.frame = f.array
+                # Copy the frame into a free buffer and clear the stream in
+                # preparation for the next frame. PiRGBArray reuses its own
+                # array, so this copy cannot be avoided.
+                if self.ring is None:
+                    self.allocate_ring(f.array)
+                slot = self.acquire_slot()
+                if slot is None:
+                    self.count_drop()
+                else:
+                    np.copyto(self.ring[slot], f.array)
+                    self.publish(slot)
                 self.rawCapture.truncate(0)
 
                 if self.stopped:
@@ -80,6 +147,8 @@ class VideoStream:
                     self.stream.close()
                     self.rawCapture.close()
                     self.camera.close()
+                    self.wake_readers()
+                    return
 
         if self.PiOrUSB == 2: # USB camera
 
@@ -89,15 +158,133 @@ class VideoStream:
                 if self.stopped:
                     # Close camera resources
                     self.stream.release()
+                    self.wake_readers()
                     return
 
-                # Otherwise, grab the next frame from the stream
-                (self.grabbed, self.frame) = self.stream.read()
+                if self.ring is None:
+                    # The first frame sizes the ring, then goes into it like any other
+                    (self.grabbed, frame) = self.stream.read()
+                    if self.grabbed:
+                        self.allocate_ring(frame)
+                        slot = self.acquire_slot()
+                        np.copyto(self.ring[slot], frame)
+                        self.publish(slot)
+                    continue
+
+                # Every buffer is borrowed; grab the frame without decoding it
+                slot = self.acquire_slot()
+                if slot is None:
+                    self.stream.grab()
+                    self.count_drop()
+                    continue
+
+                # Otherwise, decode the next frame straight into the free buffer
+                buf = self.ring[slot]
+                (self.grabbed, frame) = self.stream.read(image=buf)
+                if not self.grabbed:
+                    self.abandon_slot(slot)
+                    continue
+                if frame is not buf:
+                    # The camera changed resolution; resize the ring to match
+                    if frame.shape != buf.shape:
+                        with self.condition:
+                            self.ring[slot] = frame
+                    else:
+                        np.copyto(buf, frame)
+                self.publish(slot)
+
+    def acquire_slot(self):
+        # Reserve a buffer that is neither borrowed nor holding the latest frame
+        with self.condition:
+            for slot in range(self.ring_depth):
+                if self.ring_refs[slot] == 0 and slot != self.latest_slot:
+                    self.writing_slot = slot
+                    return slot
+            return None
+
+    def abandon_slot(self, slot):
+        # Give up a reserved buffer without publishing it
+        with self.condition:
+            self.writing_slot = None
+
+    def count_drop(self):
+        with self.condition:
+            self.frames_dropped += 1
+
+    def publish(self, slot):
+        # Make a freshly written buffer the latest frame and wake up any waiting readers
+        with self.condition:
+            if self.frame_seq > self.last_read_seq:
+                # The previous frame was never read
+                self.frames_dropped += 1
+            self.latest_slot = slot
+            self.writing_slot = None
+            self.frame_seq += 1
+            self.frame_time = time.perf_counter()
+            self.frames_captured += 1
+            self.condition.notify_all()
+
+    def wake_readers(self):
+        # Release readers blocked in read_new() when the stream stops
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait_new(self, timeout):
+        # Wait, holding the condition, until there is a frame newer than the last one read
+        self.condition.wait_for(lambda: self.frame_seq > self.last_read_seq or self.stopped, timeout)
+        if self.frame_seq <= self.last_read_seq:
+            return False
+        self.last_read_seq = self.frame_seq
+        return True
+
+    @property
+    def frame(self):
+        # The most recent frame, without copying it
+        if self.latest_slot is None:
+            return None
+        return self.ring[self.latest_slot]
 
     def read(self):
-		# Return the most recent frame
-        return self.frame
+		# Return a copy of the most recent frame
+        with self.condition:
+            self.last_read_seq = self.frame_seq
+            return None if self.frame is None else self.frame.copy()
+
+    def read_new(self, timeout=None):
+        # Wait until a frame newer than the last one read is available.
+        # Returns (frame, sequence number, capture time). frame is a copy, or
+        # None if no new frame arrived within timeout seconds or the stream stopped.
+        with self.condition:
+            if not self.wait_new(timeout):
+                return None, self.frame_seq, self.frame_time
+            return self.frame.copy(), self.frame_seq, self.frame_time
+
+    def borrow(self, timeout=None):
+        # Like read_new(), but returns a FrameRef to the buffer itself instead
+        # of a copy, or None on timeout. The caller must release() it.
+        with self.condition:
+            if not self.wait_new(timeout):
+                return None
+            self.ring_refs[self.latest_slot] += 1
+            return FrameRef(self.frame, self.frame_seq, self.frame_time, self, self.latest_slot)
+
+    def release_slot(self, slot):
+        # Called by FrameRef.release()
+        with self.condition:
+            self.ring_refs[slot] -= 1
+
+    def stats(self):
+        # Return a snapshot of the capture statistics
+        with self.condition:
+            return {
+                "frames_captured": self.frames_captured,
+                "frames_dropped": self.frames_dropped,
+                "ring_depth": self.ring_depth,
+                "ring_bytes": sum(buf.nbytes for buf in self.ring) if self.ring is not None else 0,
+                "buffers_borrowed": sum(1 for refs in self.ring_refs if refs > 0),
+            }
 
     def stop(self):
 		# Indicate that the camera and thread should be stopped
         self.stopped = True
+        self.wake_readers()
@@ -0,0 +1,291 @@
+############## Card detection benchmark ###############
+#
+# Runs the card detection pipeline over generated scenes and measures:
+#   - latency of each Cards.py stage on its own (preprocess_image,
+#     find_cards, preprocess_card, match_card), and of the whole
+#     CardDetector.process_frame
+#   - frames per second of the full pipeline
+#   - rank, suit and detection accuracy against the scene labels
+#   - with a detect scale below 1, how closely the coarse-to-fine card search
+#     (Cards.find_cards_coarse) reproduces the full resolution one
+#
+# Results are returned as a plain dict, ready to dump as JSON, so runs can
+# be compared with each other.
+
+# Import necessary packages
+import os
+import platform
+import time
+import numpy as np
+import cv2
+import Cards
+from CardDetector import CardDetector
+from FrameSource import ArraySource
+from .SceneGenerator import SceneGenerator
+
+# A detection belongs to a labeled card if their centers are this close, in pixels
+MATCH_DISTANCE = 60
+
+# A coarse detection reproduces a full resolution one if all its corners are this close, in pixels
+PARITY_DISTANCE = 3
+
+
+def percentiles(samples):
+    """Summarizes a list of durations in seconds as milliseconds."""
+
+    if len(samples) == 0:
+        return {"count": 0}
+
+    ms = np.asarray(samples) * 1000
+    return {
+        "count": int(len(ms)),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+class Accuracy:
+    """Tallies detections against scene labels"""
+    def __init__(self):
+        self.cards = 0  # Labeled cards
+        self.detected = 0  # Labeled cards with a detection at their position
+        self.rank_correct = 0
+        self.suit_correct = 0
+        self.card_correct = 0  # Both rank and suit correct
+        self.false_positives = 0  # Detections with no labeled card at their position
+
+    def add(self, scene, detections):
+        # detections is a list of (center, rank, suit)
+        used = set()
+        for card in scene.cards:
+            self.cards += 1
+            best, best_dist = None, MATCH_DISTANCE
+            for i, (center, rank, suit) in enumerate(detections):
+                dist = np.hypot(center[0] - card.center[0], center[1] - card.center[1])
+                if i not in used and dist < best_dist:
+                    best, best_dist = i, dist
+            if best is None:
+                continue
+            used.add(best)
+            self.detected += 1
+            self.rank_correct += detections[best][1] == card.rank
+            self.suit_correct += detections[best][2] == card.suit
+            self.card_correct += detections[best][1:] == (card.rank, card.suit)
+        self.false_positives += len(detections) - len(used)
+
+    def summary(self):
+        cards = max(self.cards, 1)
+        return {
+            "cards": self.cards,
+            "detection_rate": round(self.detected / cards, 4),
+            "rank_accuracy": round(self.rank_correct / cards, 4),
+            "suit_accuracy": round(self.suit_correct / cards, 4),
+            "card_accuracy": round(self.card_correct / cards, 4),
+            "false_positives": self.false_positives,
+        }
+
+
+def run_stages(scenes, detector):
+    """Times each Cards.py stage separately on every scene, without any
+    tracking state carried between scenes."""
+
+    timings = {"preprocess_image": [], "find_cards": [], "preprocess_card": [], "match_card": []}
+    accuracy = Accuracy()
+
+    for scene in scenes:
+        image = scene.image.copy()
+
+        t0 = time.perf_counter()
+        pre_proc = Cards.preprocess_image(image)
+        t1 = time.perf_counter()
+        cnts_sort, cnt_is_card = Cards.find_cards(pre_proc)
+        t2 = time.perf_counter()
+        timings["preprocess_image"].append(t1 - t0)
+        timings["find_cards"].append(t2 - t1)
+
+        detections = []
+        for i in range(len(cnts_sort)):
+            if cnt_is_card[i] != 1:
+                continue
+
+            t0 = time.perf_counter()
+            card = Cards.preprocess_card(cnts_sort[i], image)
+            t1 = time.perf_counter()
+            rank, suit, _, _ = Cards.match_card(card, detector.train_ranks, detector.train_suits,
+                                                detector.rank_index, detector.rank_bank, detector.suit_bank)
+            t2 = time.perf_counter()
+            timings["preprocess_card"].append(t1 - t0)
+            timings["match_card"].append(t2 - t1)
+            detections.append((card.center, rank, suit))
+
+        accuracy.add(scene, detections)
+
+    results = {stage: percentiles(samples) for stage, samples in timings.items()}
+    return results, accuracy.summary()
+
+
+def corner_error(corners_a, corners_b):
+    """Largest distance from a corner of one card outline to the nearest corner
+    of the other, in pixels. Independent of the order of the corners."""
+
+    a = np.asarray(corners_a, dtype=np.float32).reshape(-1, 2)
+    b = np.asarray(corners_b, dtype=np.float32).reshape(-1, 2)
+    dist = np.hypot(a[:, None, 0] - b[None, :, 0], a[:, None, 1] - b[None, :, 1])
+    return float(max(dist.min(axis=1).max(), dist.min(axis=0).max()))
+
+
+def run_detection_parity(scenes, detector, detect_scale):
+    """Runs the full resolution and the coarse-to-fine card search on every
+    scene, and compares their card outlines and the recognition results
+    they lead to. Returns timings, parity counts and both accuracies."""
+
+    timings = {"full": [], "coarse": []}
+    accuracy = {"full": Accuracy(), "coarse": Accuracy()}
+    full_cards = matched = 0
+    errors = []
+
+    for scene in scenes:
+        image = scene.image.copy()
+
+        t0 = time.perf_counter()
+        cnts_full, is_card_full = Cards.find_cards(Cards.preprocess_image(image))
+        t1 = time.perf_counter()
+        cnts_coarse, is_card_coarse = Cards.find_cards_coarse(image, detect_scale)
+        t2 = time.perf_counter()
+        timings["full"].append(t1 - t0)
+        timings["coarse"].append(t2 - t1)
+
+        cards = {}
+        for mode, cnts, is_card in (("full", cnts_full, is_card_full), ("coarse", cnts_coarse, is_card_coarse)):
+            cards[mode] = [Cards.preprocess_card(cnts[i], image) for i in range(len(cnts)) if is_card[i] == 1]
+            matches = Cards.match_card_batch(cards[mode], detector.train_ranks, detector.train_suits,
+                                             detector.rank_index, detector.rank_bank, detector.suit_bank)
+            accuracy[mode].add(scene, [(card.center, rank, suit)
+                                       for card, (rank, suit, _, _) in zip(cards[mode], matches)])
+
+        # Pair every full resolution card with the closest coarse one
+        for card in cards["full"]:
+            full_cards += 1
+            if not cards["coarse"]:
+                continue
+            error = min(corner_error(card.corner_pts, other.corner_pts) for other in cards["coarse"])
+            errors.append(error)
+            matched += error <= PARITY_DISTANCE
+
+    return {
+        "detect_scale": detect_scale,
+        "full": percentiles(timings["full"]),
+        "coarse": percentiles(timings["coarse"]),
+        "full_cards": full_cards,
+        "coarse_cards_found": matched,
+        "card_parity": round(matched / max(full_cards, 1), 4),
+        "mean_corner_error_px": round(float(np.mean(errors)), 3) if errors else None,
+        "full_accuracy": accuracy["full"].summary(),
+        "coarse_accuracy": accuracy["coarse"].summary(),
+    }
+
+
+def hold_scenes(scenes, hold_frames, seed=0, noise=3):
+    """Repeats every scene for hold_frames consecutive frames, each with fresh
+    sensor noise, like a camera watching a table where nothing moves.
+    Returns the list of frames and the scene shown on each."""
+
+    rng = np.random.default_rng(seed)
+    frames, frame_scenes = [], []
+    for scene in scenes:
+        for i in range(hold_frames):
+            if i == 0:
+                frames.append(scene.image)
+            else:
+                jitter = rng.normal(0, noise, scene.image.shape[:2])[..., None]
+                frames.append(np.clip(scene.image + jitter, 0, 255).astype(np.uint8))
+            frame_scenes.append(scene)
+    return frames, frame_scenes
+
+
+def run_pipeline(scenes, IM_WIDTH, IM_HEIGHT, hold_frames=1, motion_gate=True, **detector_kwargs):
+    """Runs CardDetector.process_frame over the scenes, fed from an ArraySource
+    as fast as possible, and times every frame. With hold_frames > 1 each scene
+    is shown for that many frames, so per-track caching and the motion gate
+    can take effect."""
+
+    frames, frame_scenes = hold_scenes(scenes, hold_frames)
+    source = ArraySource(frames).start()
+    detector = CardDetector(source, IM_WIDTH=IM_WIDTH, IM_HEIGHT=IM_HEIGHT, **detector_kwargs)
+    if not motion_gate:
+        detector.motion_gate = None
+    accuracy = Accuracy()
+    frame_times = []
+
+    t_start = time.perf_counter()
+    for scene in frame_scenes:
+        t0 = time.perf_counter()
+        image, true_count, suggestion = detector.process_frame()
+        if image is None:
+            break
+        frame_times.append(time.perf_counter() - t0)
+        accuracy.add(scene, [(card.center, card.best_rank_match, card.best_suit_match)
+                             for card in detector.previous_cards])
+    elapsed = time.perf_counter() - t_start
+
+    detector.release_frame()
+    detector.close()
+    source.stop()
+
+    return {
+        "process_frame": percentiles(frame_times),
+        "fps": round(len(frame_times) / elapsed, 2) if elapsed > 0 else 0,
+        "motion_gate": detector.motion_gate.stats() if detector.motion_gate is not None else None,
+    }, accuracy.summary()
+
+
+def run_benchmark(num_scenes=100, seed=0, IM_WIDTH=1280, IM_HEIGHT=720, warmup=5, hold_frames=1,
+                  detect_scale=1.0, motion_gate=True, recognition_workers=0, **scene_kwargs):
+    """Generates the scenes and runs the stage and pipeline benchmarks. With a
+    detect_scale below 1 the pipeline uses the coarse-to-fine card search, and
+    its parity with the full resolution search is reported. Returns the results as a dict."""
+
+    generator = SceneGenerator(seed=seed, IM_WIDTH=IM_WIDTH, IM_HEIGHT=IM_HEIGHT, **scene_kwargs)
+    scenes = generator.generate_many(num_scenes)
+
+    # Detector used only for its train data in the stage benchmark
+    stage_detector = CardDetector(ArraySource([]), IM_WIDTH=IM_WIDTH, IM_HEIGHT=IM_HEIGHT)
+
+    # Warm up caches and lazy initialization before timing
+    run_stages(scenes[:warmup], stage_detector)
+
+    stages, stage_accuracy = run_stages(scenes, stage_detector)
+    pipeline, pipeline_accuracy = run_pipeline(scenes, IM_WIDTH, IM_HEIGHT, hold_frames, motion_gate,
+                                               detect_scale=detect_scale,
+                                               recognition_workers=recognition_workers)
+
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "scenes": num_scenes,
+            "seed": seed,
+            "hold_frames": hold_frames,
+            "detect_scale": detect_scale,
+            "motion_gate": motion_gate,
+            "recognition_workers": recognition_workers,
+            "resolution": [IM_WIDTH, IM_HEIGHT],
+            "cards_per_scene": round(float(np.mean([len(scene.cards) for scene in scenes])), 2),
+            "scene_options": scene_kwargs,
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "stages": stages,
+        "stage_accuracy": stage_accuracy,
+        "pipeline": pipeline,
+        "pipeline_accuracy": pipeline_accuracy,
+    }
+
+    if detect_scale < 1:
+        results["detection_parity"] = run_detection_parity(scenes, stage_detector, detect_scale)
+
+    return results
@@ -0,0 +1,185 @@
+############## Synthetic card scene generator ###############
+#
+# Renders labeled blackjack table scenes for benchmarking. Each card is drawn
+# as a flat 200x300 face, the same size Cards.flattener produces, with the
+# rank and suit train images from Card_Imgs printed in the corner where
+# Cards.preprocess_card looks for them. The face is then warped onto a felt
+# background with a random rotation and perspective, and the whole scene gets
+# a random lighting gradient, noise and blur.
+#
+# Dealer cards are placed in the top half of the image and player cards in
+# the bottom half, matching the split CardDetector uses.
+
+# Import necessary packages
+import os
+import numpy as np
+import cv2
+import Cards
+
+RANKS = ['Ace','Two','Three','Four','Five','Six','Seven',
+         'Eight','Nine','Ten','Jack','Queen','King']
+SUITS = ['Spades','Diamonds','Clubs','Hearts']
+
+# Flat card face, same size as the warp in Cards.flattener
+FACE_WIDTH = 200
+FACE_HEIGHT = 300
+
+# Where the glyphs are printed on the face. They must fall inside the regions
+# Cards.preprocess_card crops (rank: rows 5-75, suit: rows 50-100, cols 0-50).
+RANK_BOX = (8, 6, 27, 48)  # x, y, width, height
+SUIT_BOX = (8, 57, 26, 34)
+
+# Size of a card on the table, in pixels. Its area must stay between
+# Cards.CARD_MIN_AREA and Cards.CARD_MAX_AREA.
+CARD_WIDTH = 170
+CARD_HEIGHT = 255
+
+CARD_WHITE = 235
+FELT_COLOR = (40, 90, 35)  # BGR
+
+
+class Scene_card:
+    """Structure to store the label of one card in a generated scene."""
+
+    def __init__(self):
+        self.rank = "Placeholder"
+        self.suit = "Placeholder"
+        self.center = [0, 0]  # Center of the card in the scene
+        self.corner_pts = None  # 4x2 corners of the card in the scene
+
+
+class Scene:
+    """Structure to store a generated scene and its labels."""
+
+    def __init__(self):
+        self.image = None  # BGR scene image
+        self.cards = []  # List of Scene_card
+
+
+class SceneGenerator:
+    """Generates random labeled table scenes"""
+    def __init__(self, seed=0, IM_WIDTH=1280, IM_HEIGHT=720, img_path=None,
+                 min_cards=2, max_cards=6, max_rotation=15, max_perspective=0.04,
+                 brightness=(0.7, 1.2), max_blur=1, noise=6):
+
+        self.rng = np.random.default_rng(seed)
+        self.IM_WIDTH = IM_WIDTH
+        self.IM_HEIGHT = IM_HEIGHT
+
+        # Scene variation
+        self.min_cards = min_cards
+        self.max_cards = max_cards
+        self.max_rotation = max_rotation  # Degrees
+        self.max_perspective = max_perspective  # Corner jitter, as a fraction of the card size
+        self.brightness = brightness  # Range of the lighting gain
+        self.max_blur = max_blur  # Largest Gaussian blur sigma
+        self.noise = noise  # Standard deviation of the sensor noise
+
+        # Load the rank and suit glyphs
+        if img_path is None:
+            img_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/Card_Imgs/'
+        self.rank_glyphs = {Trank.name: Trank.img for Trank in Cards.load_ranks(img_path)}
+        self.suit_glyphs = {Tsuit.name: Tsuit.img for Tsuit in Cards.load_suits(img_path)}
+
+    def render_face(self, rank, suit):
+        """Returns a grayscale 200x300 card face with the rank and suit printed in the corner."""
+
+        face = np.full((FACE_HEIGHT, FACE_WIDTH), CARD_WHITE, np.uint8)
+
+        for glyph, (x, y, w, h) in ((self.rank_glyphs[rank], RANK_BOX), (self.suit_glyphs[suit], SUIT_BOX)):
+            # Train images are white glyphs on black; print them dark on the white face
+            ink = cv2.resize(glyph, (w, h), interpolation=cv2.INTER_AREA)
+            region = face[y:y+h, x:x+w]
+            face[y:y+h, x:x+w] = np.minimum(region, 255 - ink * ((255 - 20) / 255)).astype(np.uint8)
+
+        # Large center pip so the face is not blank
+        cx, cy = FACE_WIDTH // 2, FACE_HEIGHT // 2
+        pip = cv2.resize(self.suit_glyphs[suit], (60, 80), interpolation=cv2.INTER_AREA)
+        face[cy-40:cy+40, cx-30:cx+30] = np.minimum(face[cy-40:cy+40, cx-30:cx+30], 255 - pip * (200 / 255)).astype(np.uint8)
+
+        return face
+
+    def background(self):
+        """Returns a noisy felt background."""
+
+        bkg = np.empty((self.IM_HEIGHT, self.IM_WIDTH, 3), np.float32)
+        bkg[:] = FELT_COLOR
+        bkg += self.rng.normal(0, 4, (self.IM_HEIGHT, self.IM_WIDTH, 1))
+        return bkg
+
+    def card_slots(self, num_cards):
+        """Returns non-overlapping card centers, split between the dealer and player halves."""
+
+        num_dealer = max(1, num_cards // 3)
+        num_player = num_cards - num_dealer
+        centers = []
+
+        for count, (top, bottom) in ((num_dealer, (0, self.IM_HEIGHT // 2)),
+                                     (num_player, (self.IM_HEIGHT // 2, self.IM_HEIGHT))):
+            if count == 0:
+                continue
+            # Spread the cards evenly across the width. Cards stay clear of the
+            # top rows, where Cards.preprocess_image samples the background.
+            slot_width = (self.IM_WIDTH - 100) / count
+            for i in range(count):
+                x = 50 + slot_width * (i + 0.5) + self.rng.uniform(-0.1, 0.1) * slot_width
+                y = (top + bottom) / 2 + self.rng.uniform(-20, 20)
+                centers.append((x, y))
+
+        return centers
+
+    def generate(self):
+        """Returns a new random Scene."""
+
+        scene = Scene()
+        num_cards = int(self.rng.integers(self.min_cards, self.max_cards + 1))
+        num_cards = min(num_cards, int((self.IM_WIDTH - 100) // (CARD_HEIGHT * 0.8)) * 2)
+
+        # Deal distinct cards
+        deck = [(rank, suit) for rank in RANKS for suit in SUITS]
+        picks = self.rng.choice(len(deck), size=num_cards, replace=False)
+
+        image = self.background()
+        src = np.float32([[0, 0], [FACE_WIDTH, 0], [FACE_WIDTH, FACE_HEIGHT], [0, FACE_HEIGHT]])
+
+        for (cx, cy), pick in zip(self.card_slots(num_cards), picks):
+            rank, suit = deck[pick]
+            face = cv2.cvtColor(self.render_face(rank, suit), cv2.COLOR_GRAY2BGR).astype(np.float32)
+
+            # Place the card corners: rotate about the center, then jitter for perspective
+            angle = np.deg2rad(self.rng.uniform(-self.max_rotation, self.max_rotation))
+            rot = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+            half = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * [CARD_WIDTH / 2, CARD_HEIGHT / 2]
+            jitter = self.rng.uniform(-self.max_perspective, self.max_perspective, (4, 2)) * [CARD_WIDTH, CARD_HEIGHT]
+            dst = np.float32((half + jitter) @ rot.T + [cx, cy])
+
+            # Warp the face and a mask of it onto the table
+            M = cv2.getPerspectiveTransform(src, dst)
+            warped = cv2.warpPerspective(face, M, (self.IM_WIDTH, self.IM_HEIGHT))
+            mask = cv2.warpPerspective(np.ones((FACE_HEIGHT, FACE_WIDTH), np.float32), M, (self.IM_WIDTH, self.IM_HEIGHT))
+            image = image * (1 - mask[..., None]) + warped * mask[..., None]
+
+            card = Scene_card()
+            card.rank, card.suit = rank, suit
+            card.center = [int(dst[:, 0].mean()), int(dst[:, 1].mean())]
+            card.corner_pts = dst
+            scene.cards.append(card)
+
+        # Lighting: overall gain with a left-to-right gradient
+        gain = self.rng.uniform(*self.brightness)
+        slope = self.rng.uniform(-0.15, 0.15)
+        gradient = gain * (1 + slope * np.linspace(-1, 1, self.IM_WIDTH, dtype=np.float32))
+        image *= gradient[None, :, None]
+
+        # Sensor noise and focus blur
+        image += self.rng.normal(0, self.noise, image.shape[:2])[..., None]
+        sigma = self.rng.uniform(0, self.max_blur)
+        if sigma > 0.3:
+            image = cv2.GaussianBlur(image, (0, 0), sigma)
+
+        scene.image = np.clip(image, 0, 255).astype(np.uint8)
+        return scene
+
+    def generate_many(self, num_scenes):
+        """Returns a list of num_scenes new random Scenes."""
+        return [self.generate() for _ in range(num_scenes)]
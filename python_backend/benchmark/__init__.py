@@ -0,0 +1 @@
+# Synthetic scene generator and benchmarks for the card detection pipeline.
@@ -0,0 +1,51 @@
+############## Card detection benchmark CLI ###############
+#
+# Run from the python_backend directory:
+#   python -m benchmark --scenes 200 --seed 0 --output results.json
+#
+# Prints the results as JSON, and also writes them to --output if given.
+
+# Import necessary packages
+import argparse
+import json
+from .CVBenchmark import run_benchmark
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark card detection speed and accuracy on synthetic scenes.")
+    parser.add_argument("--scenes", type=int, default=100, help="number of scenes to generate")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the scene generator")
+    parser.add_argument("--width", type=int, default=1280, help="scene width in pixels")
+    parser.add_argument("--height", type=int, default=720, help="scene height in pixels")
+    parser.add_argument("--min-cards", type=int, default=2, help="fewest cards per scene")
+    parser.add_argument("--max-cards", type=int, default=6, help="most cards per scene")
+    parser.add_argument("--max-rotation", type=float, default=15, help="largest card rotation in degrees")
+    parser.add_argument("--max-perspective", type=float, default=0.04, help="largest corner jitter, as a fraction of the card size")
+    parser.add_argument("--max-blur", type=float, default=1, help="largest Gaussian blur sigma")
+    parser.add_argument("--noise", type=float, default=6, help="standard deviation of the sensor noise")
+    parser.add_argument("--hold-frames", type=int, default=1, help="frames each scene is shown for in the pipeline benchmark")
+    parser.add_argument("--detect-scale", type=float, default=1.0,
+                        help="search for cards on the frame downscaled by this factor, and check parity with full resolution")
+    parser.add_argument("--no-motion-gate", action="store_true", help="process every frame in full, even when nothing changed")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="threads recognizing cards in parallel in the pipeline benchmark; 0 for none, -1 for one per CPU")
+    parser.add_argument("--output", help="file to write the JSON results to")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        num_scenes=args.scenes, seed=args.seed, IM_WIDTH=args.width, IM_HEIGHT=args.height,
+        hold_frames=args.hold_frames, detect_scale=args.detect_scale,
+        motion_gate=not args.no_motion_gate,
+        recognition_workers=None if args.workers < 0 else args.workers,
+        min_cards=args.min_cards, max_cards=args.max_cards, max_rotation=args.max_rotation,
+        max_perspective=args.max_perspective, max_blur=args.max_blur, noise=args.noise)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,226 @@
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
+from contextlib import asynccontextmanager
 import cv2
 import asyncio
 import numpy as np
 import os
 import time
+import traceback
 import Cards
 import VideoStream
+import FrameSource
+import Metrics
+import FrameProtocol
+import Counting
 from CardDetector import CardDetector  # Import the class
-
-app = FastAPI()
+from FrameWorker import FrameWorker, FrameResult
+from BroadcastHub import BroadcastHub
+from VideoEncoder import VideoEncoder
+from Recorder import Recorder
 
 # Camera settings
 IM_WIDTH = 1280
 IM_HEIGHT = 720
 FRAME_RATE = 10
 
-# Initialize video stream
-videostream = VideoStream.VideoStream((IM_WIDTH, IM_HEIGHT), FRAME_RATE, 2, 0).start()
-time.sleep(1)  # Give the camera time to warm up
+# Frame source: "usb", "usb:N", "picamera", a video file or a directory of images
+SOURCE = os.environ.get("DD_SOURCE", "usb")
+SOURCE_REALTIME = os.environ.get("DD_SOURCE_REALTIME", "1") == "1"  # Pace recordings at their frame rate
+SOURCE_LOOP = os.environ.get("DD_SOURCE_LOOP", "0") == "1"  # Replay recordings forever
+
+# Game settings
+NUMBER_OF_DECKS = int(os.environ.get("DD_DECKS", "1"))  # Decks in the shoe
+# Counting systems sent with every frame, comma separated (see Counting.SYSTEMS)
+COUNTING_SYSTEMS = Counting.parse_systems(os.environ.get("DD_COUNTING_SYSTEMS", "hi_lo"))
+
+# Session recording: a new directory for every session, empty for no recording
+RECORD_DIR = os.environ.get("DD_RECORD_DIR", "")
+RECORD_FRAMES_MB = float(os.environ.get("DD_RECORD_FRAMES_MB", "0"))  # Size of the frame ring, 0 for no frames
+RECORD_FRAME_WIDTH = int(os.environ.get("DD_RECORD_FRAME_WIDTH", "640"))  # 0 records full size frames
+
+# Processing settings
+# "thread" runs detection and encoding in a worker thread, "inline" runs them on the event loop
+PROCESSING_MODE = os.environ.get("DD_PROCESSING_MODE", "thread")
+MAX_DETECTION_FPS = float(os.environ.get("DD_MAX_DETECTION_FPS", "0"))  # 0 = unlimited
+DETECT_SCALE = float(os.environ.get("DD_DETECT_SCALE", "1.0"))  # Below 1, search for cards on a downscaled frame
+# Threads recognizing the cards of a frame in parallel: 0 for none, "auto" for one per CPU
+RECOGNITION_WORKERS = os.environ.get("DD_RECOGNITION_WORKERS", "0")
+RECOGNITION_WORKERS = None if RECOGNITION_WORKERS == "auto" else int(RECOGNITION_WORKERS)
+
+# Output settings
+SEND_VIDEO = os.environ.get("DD_VIDEO", "1") == "1"  # Send the frames, or only the structured results
+SERVER_OVERLAY = os.environ.get("DD_SERVER_OVERLAY", "1") == "1"  # Draw the results onto the frames sent
+PREVIEW_WIDTH = int(os.environ.get("DD_PREVIEW_WIDTH", "960"))  # Width of the frames sent; 0 for the full frame
+JPEG_QUALITY = int(os.environ.get("DD_JPEG_QUALITY", "80"))
+ADAPTIVE_VIDEO = os.environ.get("DD_ADAPTIVE_VIDEO", "1") == "1"  # Lower quality and size when clients fall behind
+
+# Shared pipeline, owned by the app rather than by any connection
+videostream = None
+card_detector = None
+encoder = None
+hub = BroadcastHub()
+worker = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global videostream, card_detector, encoder, worker
+
+    # Initialize video stream
+    videostream = FrameSource.open_source(SOURCE, (IM_WIDTH, IM_HEIGHT), FRAME_RATE, SOURCE_REALTIME, SOURCE_LOOP)
+    if isinstance(videostream, VideoStream.VideoStream):
+        await asyncio.sleep(1)  # Give the camera time to warm up
+
+    # Initialize card detector
+    card_detector = CardDetector(videostream, IM_WIDTH=IM_WIDTH, IM_HEIGHT=IM_HEIGHT, number_of_decks=NUMBER_OF_DECKS,
+                                 detect_scale=DETECT_SCALE, recognition_workers=RECOGNITION_WORKERS,
+                                 counting_systems=COUNTING_SYSTEMS)
 
-# Initialize card detector
-card_detector = CardDetector(videostream, IM_WIDTH=1280, IM_HEIGHT=720, number_of_decks=1)
+    card_detector.server_overlay = SERVER_OVERLAY and SEND_VIDEO
+    if RECORD_DIR:
+        session = os.path.join(RECORD_DIR, time.strftime("session-%Y%m%d-%H%M%S"))
+        card_detector.recorder = Recorder(session, NUMBER_OF_DECKS, RECORD_FRAMES_MB, RECORD_FRAME_WIDTH).start()
+    if SEND_VIDEO:
+        encoder = VideoEncoder(PREVIEW_WIDTH or None, JPEG_QUALITY, ADAPTIVE_VIDEO)
+
+    # Start the single detection loop that feeds every client
+    if PROCESSING_MODE == "thread":
+        worker = FrameWorker(card_detector, hub, MAX_DETECTION_FPS, encoder).start(asyncio.get_running_loop())
+        producer = None
+    else:
+        producer = asyncio.create_task(produce_inline())
+
+    try:
+        yield
+    finally:
+        if worker is not None:
+            worker.stop()
+        if producer is not None:
+            producer.cancel()
+        card_detector.release_frame()
+        card_detector.close()
+        videostream.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+# Gauges read from the live pipeline at scrape time
+Metrics.REGISTRY.gauge("clients", "Connected websocket clients", hub.subscriber_count)
+Metrics.REGISTRY.gauge("camera_frames_captured", "Frames captured by the frame source",
+                       lambda: videostream.stats()["frames_captured"] if videostream is not None else 0)
+Metrics.REGISTRY.gauge("camera_frames_dropped", "Captured frames never processed by the detector",
+                       lambda: videostream.stats()["frames_dropped"] if videostream is not None else 0)
+Metrics.REGISTRY.gauge("frames_published", "Results published to the clients", lambda: hub.frames_published)
+Metrics.REGISTRY.gauge("client_frames_dropped", "Results replaced before a client sent them",
+                       lambda: sum(mailbox.frames_dropped for mailbox in list(hub.subscribers)))
+Metrics.REGISTRY.gauge("detection_fps", "Frame rate of the detection pipeline, from the last frame",
+                       lambda: card_detector.frame_rate_calc if card_detector is not None else 0)
+Metrics.REGISTRY.gauge("video_quality", "JPEG quality of the frames sent",
+                       lambda: encoder.levels[encoder.level][1] if encoder is not None else 0)
+Metrics.REGISTRY.gauge("video_width", "Width of the frames sent, 0 for the full frame",
+                       lambda: (encoder.levels[encoder.level][0] or 0) if encoder is not None else 0)
+Metrics.REGISTRY.gauge("composition_ev_cache_hit_rate", "Hit rate of the composition EV result cache",
+                       lambda: card_detector.composition_ev.result_cache.hit_rate()
+                       if card_detector is not None and card_detector.composition_ev is not None else 0)
+Metrics.REGISTRY.gauge("composition_ev_dealer_cache_hit_rate", "Hit rate of the composition EV dealer probability cache",
+                       lambda: card_detector.composition_ev.dealer_cache.hit_rate()
+                       if card_detector is not None and card_detector.composition_ev is not None else 0)
+Metrics.REGISTRY.gauge("motion_gate_threshold", "Block gray level change the motion gate treats as motion",
+                       lambda: card_detector.motion_gate.threshold
+                       if card_detector is not None and card_detector.motion_gate is not None else 0)
+Metrics.REGISTRY.gauge("motion_gate_skip_ratio",
+                       "Fraction of frames the motion gate found unchanged, skipping card detection",
+                       lambda: card_detector.motion_gate.skip_ratio()
+                       if card_detector is not None and card_detector.motion_gate is not None else 0)
+
+async def produce_inline():
+    # Detection loop that runs on the event loop itself
+    while True:
+        if hub.subscriber_count() == 0:
+            await asyncio.sleep(0.05)
+            continue
+
+        # Process a frame. An error fails only this frame, not the loop.
+        try:
+            image, true_count, suggestion = card_detector.process_frame()
+        except Exception:
+            traceback.print_exc()
+            card_detector.release_frame()
+            await asyncio.sleep(0)
+            continue
+        if image is None:
+            # No new frame from the camera
+            if videostream.stopped:
+                return
+            await asyncio.sleep(0.01)
+            continue
+
+        result = FrameResult()
+
+        # Convert frame to JPEG, unless it has not changed
+        if encoder is not None:
+            encoder.adapt(*hub.pressure())
+            result.jpeg, result.jpeg_seq = encoder.encode(image, card_detector.frame_changed)
+
+        result.detections = card_detector.last_result
+        result.true_count = true_count
+        result.suggestion = suggestion
+        result.frame_seq = card_detector.frame_seq
+        result.capture_time = card_detector.capture_time
+        result.produced_at = time.perf_counter()
+        hub.publish(result)
+
+        # Add a short sleep to yield control
+        await asyncio.sleep(0.01)
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "mode": PROCESSING_MODE,
+        "camera": videostream.stats(),
+        "worker": worker.stats() if worker is not None else None,
+        "hub": hub.stats(),
+        "encoder": encoder.stats() if encoder is not None else None,
+        # Snapshot taken by the detection thread after each frame; the live
+        # components change while the worker runs
+        **card_detector.last_stats,
+    }
+
+
+@app.post("/reshuffle")
+async def reshuffle():
+    # Start counting a new shoe from the next frame on
+    card_detector.reshuffle()
+    return {"reshuffle": "pending"}
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(Metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    mailbox = hub.subscribe()
+    jpeg_seq = 0  # Last JPEG sent to this client
     try:
         while True:
-            # Process a frame
-            image, true_count, suggestion = card_detector.process_frame()
-
-            # Send the True Count and suggestion over WebSocket
-            await websocket.send_json({"true_count": true_count, "suggestion": suggestion})
+            # Wait for the latest processed frame
+            result = await mailbox.get()
 
-            # Convert frame to JPEG and send over WebSocket
-            _, jpeg = cv2.imencode('.jpg', image)
-            await websocket.send_bytes(jpeg.tobytes())
-
-            # Add a short sleep to yield control
-            await asyncio.sleep(0.01)
-    except asyncio.CancelledError:
-        print("WebSocket connection cancelled")
+            # Send the frame as one message: the True Count, suggestion and structured
+            # results, and the JPEG frame if this client does not have it yet
+            with_jpeg = bool(result.jpeg) and result.jpeg_seq != jpeg_seq
+            await websocket.send_bytes(FrameProtocol.pack(result, with_jpeg))
+            if with_jpeg:
+                jpeg_seq = result.jpeg_seq
+            mailbox.record_send(result)
+    except (WebSocketDisconnect, asyncio.CancelledError):
+        print("WebSocket connection closed")
     finally:
-        await websocket.close()
-        videostream.stop()
-        cv2.destroyAllWindows()
-
+        # Only this client leaves; the camera keeps running for the others
+        hub.unsubscribe(mailbox)